@@ -6,8 +6,8 @@ import gzip
 import hashlib
 import logging
 import os
-import shutil
 import subprocess
+import threading
 import time
 import monotonic
 import ujson as json
@@ -167,7 +167,7 @@ class AndroidBrowser(object):
                 visualmetrics = os.path.join(support_path, "visualmetrics.py")
                 args = ['python', visualmetrics, '-vvvv', '-i', task['video_file'],
                         '-d', video_path, '--force', '--quality', '{0:d}'.format(self.job['iq']),
-                        '--viewport', '--maxframes', '50', '--histogram', histograms]
+                        '--viewport', '--maxframes', '50', '--pipe', '--histogram', histograms]
                 if 'renderVideo' in self.job and self.job['renderVideo']:
                     video_out = os.path.join(task['dir'], task['prefix']) + '_rendered_video.mp4'
                     args.extend(['--render', video_out])
@@ -183,21 +183,10 @@ class AndroidBrowser(object):
         if self.tcpdump_enabled:
             tcpdump = os.path.join(task['dir'], task['prefix']) + '.cap'
             if os.path.isfile(tcpdump):
-                pcap_out = tcpdump + '.gz'
-                with open(tcpdump, 'rb') as f_in:
-                    with gzip.open(pcap_out, 'wb', 7) as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-                if os.path.isfile(pcap_out):
-                    os.remove(tcpdump)
-                    self.tcpdump_file = pcap_out
-                    path_base = os.path.join(task['dir'], task['prefix'])
-                    slices_file = path_base + '_pcap_slices.json.gz'
-                    pcap_parser = os.path.join(os.path.abspath(os.path.dirname(__file__)),
-                                               'support', "pcap-parser.py")
-                    cmd = ['python', pcap_parser, '--json', '-i', pcap_out, '-d', slices_file]
-                    logging.debug(' '.join(cmd))
-                    self.tcpdump_processing = subprocess.Popen(cmd, stdout=subprocess.PIPE,
-                                                               stderr=subprocess.PIPE)
+                self.tcpdump_processing = threading.Thread(target=self.process_pcap,
+                                                           args=(task, tcpdump))
+                self.tcpdump_processing.daemon = True
+                self.tcpdump_processing.start()
 
     def wait_for_processing(self, task):
         """Wait for any background processing threads to finish"""
@@ -210,23 +199,33 @@ class AndroidBrowser(object):
                 except Exception:
                     pass
         if self.tcpdump_processing is not None:
+            self.tcpdump_processing.join()
+            self.tcpdump_processing = None
             try:
-                stdout, _ = self.tcpdump_processing.communicate()
-                if stdout is not None:
-                    result = json.loads(stdout)
-                    if result:
-                        if 'in' in result:
-                            task['page_data']['pcapBytesIn'] = result['in']
-                        if 'out' in result:
-                            task['page_data']['pcapBytesOut'] = result['out']
-                        if 'in_dup' in result:
-                            task['page_data']['pcapBytesInDup'] = result['in_dup']
                 if 'tcpdump' not in self.job or not self.job['tcpdump']:
                     if self.tcpdump_file is not None:
                         os.remove(self.tcpdump_file)
             except Exception:
                 pass
 
+    def process_pcap(self, task, tcpdump):
+        """Compress and process the tcpdump capture in a background thread"""
+        from internal.support.pcap_parser import Pcap
+        pcap_out = tcpdump + '.gz'
+        path_base = os.path.join(task['dir'], task['prefix'])
+        slices_file = path_base + '_pcap_slices.json.gz'
+        try:
+            pcap = Pcap()
+            if pcap.ProcessAndCompress(tcpdump, pcap_out):
+                os.remove(tcpdump)
+                self.tcpdump_file = pcap_out
+            pcap.SaveDetails(slices_file)
+            task['page_data']['pcapBytesIn'] = pcap.bytes['in']
+            task['page_data']['pcapBytesOut'] = pcap.bytes['out']
+            task['page_data']['pcapBytesInDup'] = pcap.bytes['in_dup']
+        except Exception:
+            pass
+
     def step_complete(self, task):
         """All of the processing for the current test step is complete"""
         # Write out the accumulated page_data
@@ -341,7 +341,8 @@ class DesktopBrowser(object):
             visualmetrics = os.path.join(support_path, "visualmetrics.py")
             args = ['python', visualmetrics, '-vvvv', '-i', task['video_file'],
                     '-d', video_path, '--force', '--quality', '{0:d}'.format(self.job['iq']),
-                    '--viewport', '--orange', '--maxframes', '50', '--histogram', histograms]
+                    '--viewport', '--orange', '--maxframes', '50', '--pipe',
+                    '--histogram', histograms]
             if not task['navigated']:
                 args.append('--forceblank')
             if 'renderVideo' in self.job and self.job['renderVideo']:
@@ -353,20 +354,11 @@ class DesktopBrowser(object):
     def on_start_processing(self, task):
         """Start any processing of the captured data"""
         if self.pcap_file is not None:
-            logging.debug('Compressing pcap')
+            logging.debug('Processing pcap')
             if os.path.isfile(self.pcap_file):
-                pcap_out = self.pcap_file + '.gz'
-                with open(self.pcap_file, 'rb') as f_in:
-                    with gzip.open(pcap_out, 'wb', 7) as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-                if os.path.isfile(pcap_out):
-                    self.pcap_thread = threading.Thread(target=self.process_pcap)
-                    self.pcap_thread.daemon = True
-                    self.pcap_thread.start()
-                    try:
-                        os.remove(self.pcap_file)
-                    except Exception:
-                        pass
+                self.pcap_thread = threading.Thread(target=self.process_pcap)
+                self.pcap_thread.daemon = True
+                self.pcap_thread.start()
 
     def wait_for_processing(self, task):
         """Wait for any background processing threads to finish"""
@@ -403,26 +395,24 @@ class DesktopBrowser(object):
                 outfile.write(json_page_data)
 
     def process_pcap(self):
-        """Process the pcap in a background thread"""
-        pcap_file = self.pcap_file + '.gz'
+        """Compress and process the pcap in a background thread"""
+        from internal.support.pcap_parser import Pcap
+        pcap_file = self.pcap_file
         if os.path.isfile(pcap_file):
             path_base = os.path.join(self.task['dir'], self.task['prefix'])
             slices_file = path_base + '_pcap_slices.json.gz'
-            pcap_parser = os.path.join(os.path.abspath(os.path.dirname(__file__)),
-                                       'support', "pcap-parser.py")
-            cmd = ['python', pcap_parser, '--json', '-i', pcap_file, '-d', slices_file]
-            logging.debug(cmd)
+            pcap_out = pcap_file + '.gz'
             try:
-                stdout = subprocess.check_output(cmd)
-                if stdout is not None:
-                    result = json.loads(stdout)
-                    if result:
-                        if 'in' in result:
-                            self.task['page_data']['pcapBytesIn'] = result['in']
-                        if 'out' in result:
-                            self.task['page_data']['pcapBytesOut'] = result['out']
-                        if 'in_dup' in result:
-                            self.task['page_data']['pcapBytesInDup'] = result['in_dup']
+                pcap = Pcap()
+                if pcap.ProcessAndCompress(pcap_file, pcap_out):
+                    try:
+                        os.remove(pcap_file)
+                    except Exception:
+                        pass
+                pcap.SaveDetails(slices_file)
+                self.task['page_data']['pcapBytesIn'] = pcap.bytes['in']
+                self.task['page_data']['pcapBytesOut'] = pcap.bytes['out']
+                self.task['page_data']['pcapBytesInDup'] = pcap.bytes['in_dup']
             except Exception:
                 pass
 
@@ -9,12 +9,21 @@ import os
 import Queue
 import re
 import subprocess
+import threading
 import time
 import zipfile
 import monotonic
 import ujson as json
 from ws4py.client.threadedclient import WebSocketClient
 
+# Number of Network.getResponseBody commands to keep in flight at a time
+MAX_BODY_REQUESTS = 4
+# Number of fetched bodies that can be waiting to be written to disk
+MAX_BODY_WRITES = 32
+# Category of a raw trace event and the separator between adjacent JSON objects
+TRACE_CATEGORY_RE = re.compile(r'"cat":\s*"([^"\\]*)"')
+TRACE_EVENT_JOIN_RE = re.compile(r'\}\s*,\s*\{')
+
 class DevTools(object):
     """Interface into Chrome's remote dev tools protocol"""
     def __init__(self, options, job, task, use_devtools_video):
@@ -24,8 +33,6 @@ class DevTools(object):
         self.job = job
         self.task = task
         self.command_id = 0
-        self.command_responses = {}
-        self.pending_commands = []
         self.workers = []
         self.page_loaded = None
         self.main_frame = None
@@ -39,6 +46,11 @@ class DevTools(object):
         self.body_fail_count = 0
         self.body_index = 0
         self.bodies_zip_file = None
+        self.body_queue = []
+        self.body_requests = {}
+        self.body_requested = set()
+        self.body_write_queue = None
+        self.body_thread = None
         self.nav_error = None
         self.nav_error_code = None
         self.main_request = None
@@ -72,6 +84,10 @@ class DevTools(object):
             os.makedirs(self.video_path)
         self.body_fail_count = 0
         self.body_index = 0
+        self.finish_body_writes()
+        self.body_queue = []
+        self.body_requests = {}
+        self.body_requested = set()
         if self.bodies_zip_file is not None:
             self.bodies_zip_file.close()
             self.bodies_zip_file = None
@@ -265,6 +281,7 @@ class DevTools(object):
             self.send_command('Security.disable', {})
             self.send_command('Console.disable', {})
             self.get_response_bodies()
+        self.wait_for_response_bodies()
         if self.bodies_zip_file is not None:
             self.bodies_zip_file.close()
             self.bodies_zip_file = None
@@ -274,7 +291,6 @@ class DevTools(object):
                 self.send_command('Network.disable', {}, target_id=target['targetId'])
         self.send_command('ServiceWorker.disable', {})
         if self.dev_tools_file is not None:
-            self.dev_tools_file.write("\n]")
             self.dev_tools_file.close()
             self.dev_tools_file = None
 
@@ -296,12 +312,13 @@ class DevTools(object):
                 no_message_count = 0
                 while not done and no_message_count < 30:
                     try:
-                        raw = self.websocket.get_message(1)
-                        if raw is not None and len(raw):
+                        msg = self.websocket.get_message(1)
+                        if msg is not None:
                             no_message_count = 0
-                            msg = json.loads(raw)
                             if 'method' in msg and msg['method'] == 'Tracing.tracingComplete':
                                 done = True
+                            elif self.body_requests:
+                                self.process_message(msg)
                         else:
                             no_message_count += 1
                     except Exception:
@@ -312,8 +329,9 @@ class DevTools(object):
             self.recording_video = False
 
     def get_response_body(self, request_id):
-        """Retrieve and store the given response body (if necessary)"""
-        if request_id not in self.response_bodies and self.body_fail_count < 3:
+        """Queue the retrieval of the given response body (if necessary)"""
+        if request_id not in self.response_bodies and request_id not in self.body_requested \
+                and self.body_fail_count < 3:
             request = self.get_request(request_id)
             if request is not None and 'status' in request and request['status'] == 200 and \
                     'response_headers' in request:
@@ -354,40 +372,109 @@ class DevTools(object):
                         target_id = None
                         if request_id in self.requests and 'targetId' in self.requests[request_id]:
                             target_id = self.requests[request_id]['targetId']
-                        response = self.send_command("Network.getResponseBody",
-                                                     {'requestId': request_id}, wait=True,
-                                                     target_id=target_id)
-                        if response is None:
-                            self.body_fail_count += 1
-                            logging.warning('No response to body request for request %s',
-                                            request_id)
-                        elif 'result' not in response or \
-                                'body' not in response['result']:
-                            self.body_fail_count = 0
-                            logging.warning('Missing response body for request %s',
-                                            request_id)
-                        elif len(response['result']['body']):
-                            self.body_fail_count = 0
-                            # Write the raw body to a file (all bodies)
-                            if 'base64Encoded' in response['result'] and \
-                                    response['result']['base64Encoded']:
-                                body = base64.b64decode(response['result']['body'])
-                            else:
-                                body = response['result']['body'].encode('utf-8')
-                                is_text = True
-                            # Add text bodies to the zip archive
-                            if self.bodies_zip_file is not None and is_text:
-                                self.body_index += 1
-                                name = '{0:03d}-{1}-body.txt'.format(self.body_index, request_id)
-                                self.bodies_zip_file.writestr(name, body)
-                                logging.debug('%s: Stored body in zip', request_id)
-                            logging.debug('%s: Body length: %d', request_id, len(body))
-                            self.response_bodies[request_id] = body
-                            with open(body_file_path, 'wb') as body_file:
-                                body_file.write(body)
-                        else:
-                            self.body_fail_count = 0
-                            self.response_bodies[request_id] = response['result']['body']
+                        self.body_requested.add(request_id)
+                        self.body_queue.append({'id': request_id,
+                                                'path': body_file_path,
+                                                'is_text': is_text,
+                                                'target_id': target_id})
+                        self.fetch_response_bodies()
+
+    def fetch_response_bodies(self):
+        """Keep a limited number of Network.getResponseBody commands in flight"""
+        now = monotonic.monotonic()
+        for command_id in self.body_requests.keys():
+            fetch = self.body_requests[command_id]
+            if now >= fetch['end_time']:
+                del self.body_requests[command_id]
+                self.body_fail_count += 1
+                logging.warning('No response to body request for request %s', fetch['id'])
+        if self.body_fail_count >= 3:
+            self.body_queue = []
+        while self.body_queue and len(self.body_requests) < MAX_BODY_REQUESTS:
+            fetch = self.body_queue.pop(0)
+            command_id = self.send_command_async("Network.getResponseBody",
+                                                 {'requestId': fetch['id']},
+                                                 target_id=fetch['target_id'])
+            if command_id is not None:
+                fetch['end_time'] = monotonic.monotonic() + 10
+                self.body_requests[command_id] = fetch
+
+    def process_response_body(self, fetch, response):
+        """Handle the response to a Network.getResponseBody command"""
+        request_id = fetch['id']
+        if 'result' not in response or 'body' not in response['result']:
+            self.body_fail_count = 0
+            logging.warning('Missing response body for request %s', request_id)
+        elif len(response['result']['body']):
+            self.body_fail_count = 0
+            # Decoding and writing the body happens on a background thread
+            if self.body_thread is None:
+                self.body_write_queue = Queue.Queue(MAX_BODY_WRITES)
+                self.body_thread = threading.Thread(target=self.body_writer_thread)
+                self.body_thread.daemon = True
+                self.body_thread.start()
+            base64_encoded = bool('base64Encoded' in response['result'] and
+                                  response['result']['base64Encoded'])
+            self.body_write_queue.put((fetch, response['result']['body'], base64_encoded))
+        else:
+            self.body_fail_count = 0
+            self.response_bodies[request_id] = response['result']['body']
+        self.fetch_response_bodies()
+
+    def body_writer_thread(self):
+        """Background thread for decoding and storing the response bodies"""
+        while True:
+            item = self.body_write_queue.get()
+            if item is None:
+                self.body_write_queue.task_done()
+                break
+            fetch, body, base64_encoded = item
+            request_id = fetch['id']
+            try:
+                is_text = fetch['is_text']
+                # Write the raw body to a file (all bodies)
+                if base64_encoded:
+                    body = base64.b64decode(body)
+                else:
+                    body = body.encode('utf-8')
+                    is_text = True
+                # Add text bodies to the zip archive
+                if self.bodies_zip_file is not None and is_text:
+                    self.body_index += 1
+                    name = '{0:03d}-{1}-body.txt'.format(self.body_index, request_id)
+                    self.bodies_zip_file.writestr(name, body)
+                    logging.debug('%s: Stored body in zip', request_id)
+                logging.debug('%s: Body length: %d', request_id, len(body))
+                self.response_bodies[request_id] = body
+                with open(fetch['path'], 'wb') as body_file:
+                    body_file.write(body)
+            except Exception as err:
+                logging.warning('Error storing body for request %s: %s', request_id,
+                                err.__str__())
+            self.body_write_queue.task_done()
+
+    def finish_body_writes(self):
+        """Wait for the background body writer to store everything it was handed"""
+        if self.body_thread is not None:
+            self.body_write_queue.put(None)
+            self.body_thread.join()
+            self.body_thread = None
+            self.body_write_queue = None
+
+    def wait_for_response_bodies(self):
+        """Wait for all of the queued and in-flight response bodies to be stored"""
+        if self.websocket:
+            while self.body_queue or self.body_requests:
+                try:
+                    msg = self.websocket.get_message(1)
+                    if msg is not None:
+                        self.process_message(msg)
+                except Exception:
+                    pass
+                self.fetch_response_bodies()
+        self.body_queue = []
+        self.body_requests = {}
+        self.finish_body_writes()
 
     def get_response_bodies(self):
         """Retrieve all of the response bodies for the requests that we know about"""
@@ -395,6 +482,7 @@ class DevTools(object):
         if self.task['error'] is None and requests:
             for request_id in requests:
                 self.get_response_body(request_id)
+        self.wait_for_response_bodies()
 
     def get_request(self, request_id):
         """Get the given request details if it is a real request"""
@@ -462,73 +550,45 @@ class DevTools(object):
         if self.websocket:
             try:
                 while True:
-                    raw = self.websocket.get_message(0)
-                    if raw is not None and len(raw):
-                        if self.recording:
-                            logging.debug(raw[:200])
-                            msg = json.loads(raw)
-                            self.process_message(msg)
-                    if not raw:
+                    msg = self.websocket.get_message(0)
+                    if msg is None:
                         break
+                    if self.recording or self.body_requests:
+                        self.process_message(msg)
             except Exception:
                 pass
 
-    def send_command(self, method, params, wait=False, timeout=10, target_id=None):
-        """Send a raw dev tools message and optionally wait for the response"""
-        ret = None
-        if target_id is not None:
-            self.command_id += 1
-            command_id = int(self.command_id)
-            msg = {'id': command_id, 'method': method, 'params': params}
-            if wait:
-                self.pending_commands.append(command_id)
-            end_time = monotonic.monotonic() + timeout
-            self.send_command('Target.sendMessageToTarget',
-                              {'targetId': target_id, 'message': json.dumps(msg)},
-                              wait=True, timeout=timeout)
-            if wait:
-                if command_id in self.command_responses:
-                    ret = self.command_responses[command_id]
-                    del self.command_responses[command_id]
-                else:
-                    while ret is None and monotonic.monotonic() < end_time:
-                        try:
-                            raw = self.websocket.get_message(1)
-                            if raw is not None and len(raw):
-                                logging.debug(raw[:200])
-                                msg = json.loads(raw)
-                                self.process_message(msg)
-                                if command_id in self.command_responses:
-                                    ret = self.command_responses[command_id]
-                                    del self.command_responses[command_id]
-                        except Exception:
-                            pass
-        elif self.websocket:
+    def send_command_async(self, method, params, target_id=None, wait=False):
+        """Send a raw dev tools message without blocking and return the command id.
+        With wait set the response is routed to a waiter for wait_for_response."""
+        command_id = None
+        if self.websocket:
             self.command_id += 1
             command_id = int(self.command_id)
             if wait:
-                self.pending_commands.append(command_id)
+                self.websocket.add_command_waiter(command_id)
             msg = {'id': command_id, 'method': method, 'params': params}
             try:
                 out = json.dumps(msg)
-                logging.debug("Sending: %s", out)
-                self.websocket.send(out)
-                if wait:
-                    end_time = monotonic.monotonic() + timeout
-                    while ret is None and monotonic.monotonic() < end_time:
-                        try:
-                            raw = self.websocket.get_message(1)
-                            if raw is not None and len(raw):
-                                logging.debug(raw[:200])
-                                msg = json.loads(raw)
-                                self.process_message(msg)
-                                if command_id in self.command_responses:
-                                    ret = self.command_responses[command_id]
-                                    del self.command_responses[command_id]
-                        except Exception:
-                            pass
+                if target_id is not None:
+                    self.send_command_async('Target.sendMessageToTarget',
+                                            {'targetId': target_id, 'message': out})
+                else:
+                    logging.debug("Sending: %s", out)
+                    self.websocket.send(out)
             except Exception as err:
                 logging.debug("Websocket send error: %s", err.__str__())
+                if wait:
+                    self.websocket.remove_command_waiter(command_id)
+                command_id = None
+        return command_id
+
+    def send_command(self, method, params, wait=False, timeout=10, target_id=None):
+        """Send a raw dev tools message and optionally wait for the response"""
+        ret = None
+        command_id = self.send_command_async(method, params, target_id=target_id, wait=wait)
+        if wait and command_id is not None and self.websocket:
+            ret = self.websocket.wait_for_response(command_id, timeout)
         return ret
 
     def wait_for_page_load(self):
@@ -539,10 +599,8 @@ class DevTools(object):
             done = False
             while not done:
                 try:
-                    raw = self.websocket.get_message(1)
-                    if raw is not None and len(raw):
-                        logging.debug(raw[:200])
-                        msg = json.loads(raw)
+                    msg = self.websocket.get_message(1)
+                    if msg is not None:
                         self.process_message(msg)
                 except Exception:
                     # ignore timeouts when we're in a polling read loop
@@ -659,11 +717,14 @@ class DevTools(object):
                     self.process_target_event(event, msg)
                 else:
                     self.log_dev_tools_event(msg)
+        elif self.body_requests and 'method' in msg and \
+                msg['method'] == 'Target.receivedMessageFromTarget':
+            # Service worker bodies can still be arriving after recording stops
+            self.process_target_event('receivedMessageFromTarget', msg)
         if 'id' in msg:
             response_id = int(re.search(r'\d+', str(msg['id'])).group())
-            if response_id in self.pending_commands:
-                self.pending_commands.remove(response_id)
-                self.command_responses[response_id] = msg
+            if response_id in self.body_requests:
+                self.process_response_body(self.body_requests.pop(response_id), msg)
 
     def process_page_event(self, event, msg):
         """Process Page.* dev tools events"""
@@ -797,11 +858,9 @@ class DevTools(object):
         if self.task['log_data']:
             if self.dev_tools_file is None:
                 path = self.path_base + '_devtools.json.gz'
-                self.dev_tools_file = gzip.open(path, 'wb', 7)
-                self.dev_tools_file.write("[{}")
-            if self.dev_tools_file is not None:
-                self.dev_tools_file.write(",\n")
-                self.dev_tools_file.write(json.dumps(msg))
+                self.dev_tools_file = JsonLogWriter(path, "[{}", "\n]",
+                                                    self.options.logcompression)
+            self.dev_tools_file.write(msg)
 
     def get_header_value(self, headers, name):
         """Get the value for the requested header"""
@@ -863,6 +922,8 @@ class DevToolsClient(WebSocketClient):
         self.path_base = None
         self.trace_parser = None
         self.trace_event_counts = {}
+        self.command_waiters = {}
+        self.waiter_lock = threading.Lock()
 
     def opened(self):
         """Websocket interface - connection opened"""
@@ -873,38 +934,97 @@ class DevToolsClient(WebSocketClient):
         """Websocket interface - connection closed"""
         logging.debug("DevTools websocket disconnected")
         self.connected = False
+        # Nothing else is coming, release anyone waiting on a response
+        with self.waiter_lock:
+            for command_id in self.command_waiters:
+                self.command_waiters[command_id]['event'].set()
 
     def received_message(self, raw):
         """Websocket interface - message received"""
         try:
             if raw.is_text:
+                if self.path_base is not None and \
+                        raw.data[:50].find('"Tracing.dataCollected') > -1:
+                    self.messages.put({'method': 'got_message'})
+                    self.process_trace_data(raw.data)
+                    return
                 message = raw.data.decode(raw.encoding) if raw.encoding is not None else raw.data
                 compare = message[:50]
-                is_trace_data = False
-                if self.path_base is not None and compare.find('"Tracing.dataCollected') > -1:
-                    is_trace_data = True
-                    msg = json.loads(message)
-                    self.messages.put('{"method":"got_message"}')
-                    if msg is not None:
-                        self.process_trace_event(msg)
-                elif self.trace_file is not None and compare.find('"Tracing.tracingComplete') > -1:
-                    self.trace_file.write("\n]}")
+                resolved = False
+                if self.trace_file is not None and compare.find('"Tracing.tracingComplete') > -1:
                     self.trace_file.close()
                     self.trace_file = None
-                if not is_trace_data:
+                elif self.command_waiters:
+                    # Anything decoded while looking for a waiter is queued already parsed
+                    resolved, msg = self.resolve_command(message, compare)
+                    if msg is not None:
+                        message = msg
+                if not resolved:
                     self.messages.put(message)
         except Exception:
             pass
 
+    def add_command_waiter(self, command_id):
+        """Route the response for the given command id to a waiter"""
+        with self.waiter_lock:
+            self.command_waiters[command_id] = {'event': threading.Event(), 'response': None}
+
+    def remove_command_waiter(self, command_id):
+        """Stop waiting for the response to the given command id"""
+        with self.waiter_lock:
+            waiter = self.command_waiters.pop(command_id, None)
+        return waiter
+
+    def wait_for_response(self, command_id, timeout):
+        """Wait for the response to a command registered with add_command_waiter"""
+        response = None
+        with self.waiter_lock:
+            waiter = self.command_waiters.get(command_id)
+        if waiter is not None:
+            if self.connected:
+                waiter['event'].wait(timeout)
+            self.remove_command_waiter(command_id)
+            response = waiter['response']
+        return response
+
+    def resolve_command(self, message, compare):
+        """Hand a command response (direct or from a target) to its waiter.
+        Returns whether it was resolved and the decoded message (None if it wasn't decoded)"""
+        resolved = False
+        decoded = None
+        response = None
+        if compare.find('"id"') > -1:
+            decoded = json.loads(message)
+            response = decoded
+        elif compare.find('"Target.receivedMessageFromTarget') > -1:
+            decoded = json.loads(message)
+            if 'params' in decoded and 'message' in decoded['params']:
+                response = json.loads(decoded['params']['message'])
+        if response is not None and 'id' in response and 'method' not in response:
+            response_id = int(re.search(r'\d+', str(response['id'])).group())
+            with self.waiter_lock:
+                if response_id in self.command_waiters:
+                    waiter = self.command_waiters[response_id]
+                    waiter['response'] = response
+                    waiter['event'].set()
+                    resolved = True
+        return resolved, decoded
+
     def get_message(self, timeout):
-        """Wait for and return a message from the queue"""
+        """Wait for and return a decoded message from the queue"""
         message = None
         try:
             if timeout is None or timeout <= 0:
-                message = self.messages.get_nowait()
+                raw = self.messages.get_nowait()
             else:
-                message = self.messages.get(True, timeout)
+                raw = self.messages.get(True, timeout)
             self.messages.task_done()
+            # Messages that were decoded on the receive thread are queued as-is
+            if isinstance(raw, dict):
+                message = raw
+            else:
+                logging.debug(raw[:200])
+                message = json.loads(raw)
         except Exception:
             pass
         return message
@@ -931,7 +1051,6 @@ class DevToolsClient(WebSocketClient):
         self.pending_image = None
         self.trace_ts_start = None
         if self.trace_file is not None:
-            self.trace_file.write("\n]}")
             self.trace_file.close()
             self.trace_file = None
         self.options = None
@@ -959,54 +1078,121 @@ class DevToolsClient(WebSocketClient):
         logging.debug(self.trace_event_counts)
         self.trace_event_counts = {}
 
+    def open_trace_file(self):
+        """Start the trace file and trace parser when the first events arrive"""
+        if self.trace_file is None:
+            self.trace_file = JsonLogWriter(self.path_base + '_trace.json.gz',
+                                            '{"traceEvents":[{}', "\n]}",
+                                            self.options.logcompression)
+            from internal.support.trace_parser import Trace
+            self.trace_parser = Trace()
+
+    def split_trace_data(self, data):
+        """Split the raw value array of a Tracing.dataCollected message into the
+        JSON text for the individual events (None if it isn't one event per line)"""
+        events = None
+        start = data.find('[', data.find('"value"'))
+        end = data.rfind(']')
+        if start >= 0 and end > start:
+            value = data[start + 1:end].strip()
+            events = value.split(',\n') if len(value) else []
+            for event in events:
+                if event[:1] != '{' or event[-1:] != '}':
+                    events = None
+                    break
+                # Make sure lines that might hold more than one event are a single event
+                if TRACE_EVENT_JOIN_RE.search(event) and \
+                        not isinstance(json.loads(event), dict):
+                    events = None
+                    break
+        return events
+
+    def process_trace_data(self, data):
+        """Process a raw Tracing.dataCollected message. Events are passed
+        through to the trace file as-is and only the events that the trace
+        parser or the screenshot extraction use get decoded."""
+        events = None
+        try:
+            events = self.split_trace_data(data)
+        except Exception:
+            pass
+        if events is None:
+            msg = json.loads(data)
+            if msg is not None:
+                self.process_trace_event(msg)
+        elif len(events):
+            self.open_trace_file()
+            keep = []
+            for event in events:
+                match = TRACE_CATEGORY_RE.search(event)
+                if match is None or self.decode_trace_category(match.group(1)):
+                    # Write the processed event so it keeps the trace parser annotations
+                    trace_event = json.loads(event)
+                    if self.process_single_trace_event(trace_event):
+                        keep.append(dict(trace_event))
+                else:
+                    cat = match.group(1)
+                    if self.video_prefix is not None:
+                        if cat not in self.trace_event_counts:
+                            self.trace_event_counts[cat] = 0
+                        self.trace_event_counts[cat] += 1
+                    if self.job['keep_netlog'] or cat != 'netlog':
+                        keep.append(event)
+            self.trace_file.write_events(keep)
+            logging.debug("Processed %d trace events", len(events))
+
+    def decode_trace_category(self, cat):
+        """See if the trace events for a given category need to be decoded"""
+        return self.trace_parser.IsProcessedCategory(cat) or \
+            (self.video_prefix is not None and cat.find('devtools.screenshot') > -1)
+
     def process_trace_event(self, msg):
         """Process Tracing.* dev tools events"""
         if 'params' in msg and 'value' in msg['params'] and len(msg['params']['value']):
-            if self.trace_file is None:
-                self.trace_file = gzip.open(self.path_base + '_trace.json.gz',
-                                            'wb', compresslevel=7)
-                self.trace_file.write('{"traceEvents":[{}')
-                from internal.support.trace_parser import Trace
-                self.trace_parser = Trace()
-            # write out the trace events one-per-line but pull out any
-            # devtools screenshots as separate files.
-            if self.trace_file is not None:
-                trace_events = msg['params']['value']
-                for _, trace_event in enumerate(trace_events):
-                    keep_event = True
-                    process_event = True
-                    if self.video_prefix is not None and 'cat' in trace_event and \
-                            'name' in trace_event and 'ts' in trace_event:
-                        if trace_event['cat'] not in self.trace_event_counts:
-                            self.trace_event_counts[trace_event['cat']] = 0
-                        self.trace_event_counts[trace_event['cat']] += 1
-                        if self.trace_ts_start is None and \
-                                (trace_event['name'] == 'navigationStart' or \
-                                 trace_event['name'] == 'fetchStart') and \
-                                trace_event['cat'].find('blink.user_timing') > -1:
-                            logging.debug("Trace start detected: %d", trace_event['ts'])
-                            self.trace_ts_start = trace_event['ts']
-                        if self.trace_ts_start is None and \
-                                (trace_event['name'] == 'navigationStart' or \
-                                 trace_event['name'] == 'fetchStart') and \
-                                trace_event['cat'].find('rail') > -1:
-                            logging.debug("Trace start detected: %d", trace_event['ts'])
-                            self.trace_ts_start = trace_event['ts']
-                        if trace_event['name'] == 'Screenshot' and \
-                                trace_event['cat'].find('devtools.screenshot') > -1:
-                            keep_event = False
-                            process_event = False
-                            self.process_screenshot(trace_event)
-                    if not self.job['keep_netlog'] and 'cat' in trace_event and \
-                            trace_event['cat'] == 'netlog':
-                        keep_event = False
-                    if process_event and self.trace_parser is not None:
-                        self.trace_parser.ProcessTraceEvent(trace_event)
-                    if keep_event:
-                        # Write it to the trace file and pass it to the trace parser
-                        self.trace_file.write(",\n")
-                        self.trace_file.write(json.dumps(trace_event))
-                logging.debug("Processed %d trace events", len(msg['params']['value']))
+            self.open_trace_file()
+            keep = []
+            for trace_event in msg['params']['value']:
+                # The trace parser annotates the events it processes (thread, dur)
+                # and those are written to the trace file so the writer thread
+                # gets a snapshot taken after processing
+                if self.process_single_trace_event(trace_event):
+                    keep.append(dict(trace_event))
+            self.trace_file.write_events(keep)
+            logging.debug("Processed %d trace events", len(msg['params']['value']))
+
+    def process_single_trace_event(self, trace_event):
+        """Process a single trace event, pulling out any devtools screenshots
+        as separate files. Returns True if the event belongs in the trace file."""
+        keep_event = True
+        process_event = True
+        if self.video_prefix is not None and 'cat' in trace_event and \
+                'name' in trace_event and 'ts' in trace_event:
+            if trace_event['cat'] not in self.trace_event_counts:
+                self.trace_event_counts[trace_event['cat']] = 0
+            self.trace_event_counts[trace_event['cat']] += 1
+            if self.trace_ts_start is None and \
+                    (trace_event['name'] == 'navigationStart' or \
+                     trace_event['name'] == 'fetchStart') and \
+                    trace_event['cat'].find('blink.user_timing') > -1:
+                logging.debug("Trace start detected: %d", trace_event['ts'])
+                self.trace_ts_start = trace_event['ts']
+            if self.trace_ts_start is None and \
+                    (trace_event['name'] == 'navigationStart' or \
+                     trace_event['name'] == 'fetchStart') and \
+                    trace_event['cat'].find('rail') > -1:
+                logging.debug("Trace start detected: %d", trace_event['ts'])
+                self.trace_ts_start = trace_event['ts']
+            if trace_event['name'] == 'Screenshot' and \
+                    trace_event['cat'].find('devtools.screenshot') > -1:
+                keep_event = False
+                process_event = False
+                self.process_screenshot(trace_event)
+        if not self.job['keep_netlog'] and 'cat' in trace_event and \
+                trace_event['cat'] == 'netlog':
+            keep_event = False
+        if process_event and self.trace_parser is not None:
+            self.trace_parser.ProcessTraceEvent(trace_event)
+        return keep_event
 
     def process_screenshot(self, trace_event):
         """Process an individual screenshot event"""
@@ -1061,3 +1247,70 @@ class DevToolsClient(WebSocketClient):
                                                "time": int(ms_elapsed),
                                                "path": str(path)}
                             image_file.write(base64.b64decode(img))
+
+
+class JsonLogWriter(object):
+    """Gzip JSON log file (one event per line) written from a background thread.
+    Events are queued by the capture threads and serialized in batches
+    (strings are taken to already be serialized JSON)."""
+    def __init__(self, path, header, footer, compression=7, max_queue=10000, batch_size=100):
+        self.path = path
+        self.footer = footer
+        self.batch_size = batch_size
+        self.queue = Queue.Queue(max_queue)
+        self.high_water = 0
+        self.count = 0
+        self.file = gzip.open(path, 'wb', compression)
+        self.file.write(header)
+        self.thread = threading.Thread(target=self.writer_thread)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, event):
+        """Queue an event to be appended to the log"""
+        self.write_events([event])
+
+    def write_events(self, events):
+        """Queue a list of events to be appended to the log"""
+        if events:
+            self.queue.put(events)
+        pending = self.queue.qsize()
+        if pending > self.high_water:
+            self.high_water = pending
+
+    def close(self):
+        """Flush any queued events, write the footer and close the file"""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+            self.file.write(self.footer)
+            self.file.close()
+            logging.debug("Wrote %d events to %s (queue high-water mark %d)",
+                          self.count, self.path, self.high_water)
+
+    def writer_thread(self):
+        """Background thread that serializes and compresses the queued events"""
+        done = False
+        while not done:
+            batch = []
+            events = self.queue.get()
+            while events is not None:
+                batch.extend(events)
+                events = []
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    events = self.queue.get_nowait()
+                except Queue.Empty:
+                    break
+            if events is None:
+                done = True
+            if batch:
+                try:
+                    self.file.write(",\n" + ",\n".join(
+                        [event if isinstance(event, str) else json.dumps(event)
+                         for event in batch]))
+                    self.count += len(batch)
+                except Exception as err:
+                    logging.warning("Error writing to %s: %s", self.path, err.__str__())
@@ -54,6 +54,7 @@ class Firefox(DesktopBrowser):
         self.path = path
         self.event_name = None
         self.moz_log = None
+        self.moz_log_parser = None
         self.marionette = None
         self.addons = None
         self.extension_id = None
@@ -199,6 +200,9 @@ class Firefox(DesktopBrowser):
             subprocess.call(['killall', '-9', 'firefox-trunk'])
         os.environ["MOZ_LOG_FILE"] = ''
         os.environ["MOZ_LOG"] = ''
+        if self.moz_log_parser is not None:
+            self.moz_log_parser.stop_tailing()
+            self.moz_log_parser = None
         # delete the raw log files
         if self.moz_log is not None:
             files = sorted(glob.glob(self.moz_log + '*'))
@@ -499,6 +503,15 @@ class Firefox(DesktopBrowser):
         DesktopBrowser.on_start_recording(self, task)
         logging.debug('Starting measurement')
         task['start_time'] = datetime.utcnow()
+        # Parse the moz logs as they are written
+        if self.moz_log is not None:
+            from internal.support.firefox_log_parser import FirefoxLogParser
+            if self.moz_log_parser is not None:
+                self.moz_log_parser.stop_tailing()
+            start_time = task['start_time'].strftime('%Y-%m-%d %H:%M:%S.%f')
+            logging.debug('Parsing moz logs relative to %s start time', start_time)
+            self.moz_log_parser = FirefoxLogParser()
+            self.moz_log_parser.start_tailing(self.moz_log, self.log_pos, start_time)
 
     def on_stop_recording(self, task):
         """Notification that we are done with recording"""
@@ -513,50 +526,18 @@ class Firefox(DesktopBrowser):
                 self.grab_screenshot(screen_shot, png=False, resize=600)
         # Collect end of test data from the browser
         self.collect_browser_metrics(task)
-        # Copy the log files
-        if self.moz_log is not None:
-            task['moz_log'] = os.path.join(task['dir'], task['prefix'] + '_moz.log')
-            files = sorted(glob.glob(self.moz_log + '*'))
-            for path in files:
-                try:
-                    base_name = os.path.basename(path)
-                    dest = os.path.join(task['dir'],
-                                        task['prefix'] + '_' + base_name + '.gz')
-                    start_pos = self.log_pos[path] if path in self.log_pos else 0
-                    end_pos = os.path.getsize(path)
-                    if end_pos > start_pos:
-                        length = end_pos - start_pos
-                        logging.debug('Preparing moz log %s (%d bytes from %d)',
-                                      base_name, length, start_pos)
-                        with open(path, 'rb') as f_in:
-                            f_in.seek(start_pos)
-                            with gzip.open(dest, 'wb', 7) as f_out:
-                                while length > 0:
-                                    read_bytes = min(length, 1024 * 1024)
-                                    buff = f_in.read(read_bytes)
-                                    read_bytes = len(buff)
-                                    f_out.write(buff)
-                                    length -= read_bytes
-                except Exception:
-                    pass
+        # Catch up with the end of the moz logs
+        if self.moz_log_parser is not None:
+            self.moz_log_parser.stop_tailing()
 
     def on_start_processing(self, task):
         """Start any processing of the captured data"""
         DesktopBrowser.on_start_processing(self, task)
-        # Parse the moz log for the accurate request timings
+        # Assemble the request timings parsed from the moz logs
         request_timings = []
-        if 'moz_log' in task:
-            from internal.support.firefox_log_parser import FirefoxLogParser
-            parser = FirefoxLogParser()
-            start_time = task['start_time'].strftime('%Y-%m-%d %H:%M:%S.%f')
-            logging.debug('Parsing moz logs relative to %s start time', start_time)
-            request_timings = parser.process_logs(task['moz_log'], start_time)
-            files = sorted(glob.glob(task['moz_log'] + '*'))
-            for path in files:
-                try:
-                    os.remove(path)
-                except Exception:
-                    pass
+        if self.moz_log_parser is not None:
+            request_timings = self.moz_log_parser.finish_processing()
+            self.moz_log_parser = None
         # Build the request and page data
         if len(request_timings) and task['current_step'] == 1:
             self.adjust_timings(request_timings)
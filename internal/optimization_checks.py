@@ -4,18 +4,31 @@
 """Run the various optimization checks"""
 import binascii
 import gzip
+import hashlib
 import logging
+import multiprocessing
 import os
 import Queue
 import re
-import shutil
 import struct
 import subprocess
 import threading
 import time
+import zlib
 import monotonic
 import ujson as json
 
+GZIP_LEVEL = 7
+GZIP_OVERHEAD = 18  # gzip header and trailer
+GZIP_READ_SIZE = 65536
+OPTIMIZATION_CACHE_SIZE = 20000
+# Bump the version for a check whenever its results change so stale entries get ignored
+CHECK_VERSIONS = {'gzip': 1, 'jpeg': 1, 'gif': 1, 'progressive': 1}
+DNS_CACHE_SIZE = 20000
+DNS_CACHE_MAX_TTL = 3600
+# How long expired CNAME chains keep being used while they are refreshed in the background
+DNS_CACHE_STALE_TIME = 86400
+
 class OptimizationChecks(object):
     """Threaded optimization checks"""
     def __init__(self, job, task, requests):
@@ -24,9 +37,14 @@ class OptimizationChecks(object):
         self.running_checks = False
         self.requests = requests
         self.cdn_thread = None
-        self.gzip_thread = None
-        self.image_thread = None
         self.progressive_thread = None
+        self.pool = None
+        self.gzip_tasks = {}
+        self.image_tasks = {}
+        self.tasks_start = None
+        self.cache = None
+        self.body_hashes = {}
+        self.dns_cache = None
         self.cdn_time = None
         self.gzip_time = None
         self.image_time = None
@@ -221,19 +239,38 @@ class OptimizationChecks(object):
             'Yunjiasu': [{'Server': 'yunjiasu'}],
             'Zenedge': [{'X-Cdn': 'Zenedge'}]
         }
+        self.compile_cdn_cnames()
+
+    def compile_cdn_cnames(self):
+        """Build a single regex that matches any of the cname patterns"""
+        self.cdn_cname_providers = {}
+        self.cdn_cname_order = {}
+        patterns = []
+        for cdn in self.cdn_cnames:
+            self.cdn_cname_order[cdn] = len(self.cdn_cname_order)
+            for cname in self.cdn_cnames[cdn]:
+                self.cdn_cname_providers[cname] = cdn
+                patterns.append(cname)
+        # Longest first so the match at each position is the full pattern
+        patterns.sort(key=len, reverse=True)
+        self.cdn_cname_re = re.compile('|'.join(re.escape(p) for p in patterns))
 
     def start(self):
         """Start running the optimization checks"""
         optimization_checks_disabled = bool('noopt' in self.job and self.job['noopt'])
         if self.requests is not None and not optimization_checks_disabled:
             self.running_checks = True
+            if 'persistent_dir' in self.job:
+                self.cache = OptimizationCache(os.path.join(self.job['persistent_dir'],
+                                                            'optimization_cache.json.gz'))
+            # Queue the expensive per-request compression checks on a process pool
+            self.tasks_start = monotonic.monotonic()
+            self.check_gzip()
+            self.check_images()
+            self.start_tasks()
             # Run the slow checks in background threads
             self.cdn_thread = threading.Thread(target=self.check_cdn)
             self.cdn_thread.start()
-            self.gzip_thread = threading.Thread(target=self.check_gzip)
-            self.gzip_thread.start()
-            self.image_thread = threading.Thread(target=self.check_images)
-            self.image_thread.start()
             self.progressive_thread = threading.Thread(target=self.check_progressive)
             self.progressive_thread.start()
             # collect the miscellaneous results directly
@@ -250,17 +287,19 @@ class OptimizationChecks(object):
             if self.progressive_time is not None:
                 logging.debug("Progressive JPEG check took %0.3f seconds", self.progressive_time)
             logging.debug('Waiting for gzip check to complete')
-            if self.gzip_thread is not None:
-                self.gzip_thread.join()
-                self.gzip_thread = None
+            self.finish_gzip_checks()
             if self.gzip_time is not None:
                 logging.debug("gzip check took %0.3f seconds", self.gzip_time)
             logging.debug('Waiting for image check to complete')
-            if self.image_thread is not None:
-                self.image_thread.join()
-                self.image_thread = None
+            self.finish_image_checks()
+            self.stop_tasks()
             if self.image_time is not None:
                 logging.debug("image check took %0.3f seconds", self.image_time)
+            if self.cache is not None:
+                logging.debug('Optimization check cache: %d hits, %d misses',
+                              self.cache.hits, self.cache.misses)
+                self.cache.save()
+                self.cache = None
             logging.debug('Waiting for CDN check to complete')
             if self.cdn_thread is not None:
                 self.cdn_thread.join()
@@ -423,12 +462,29 @@ class OptimizationChecks(object):
                         provider = self.check_cdn_name(domain)
                         if provider is not None:
                             domains[domain] = provider
+        # Use the cached CNAME chains where we have them
+        if 'persistent_dir' in self.job:
+            self.dns_cache = DnsCache(os.path.join(self.job['persistent_dir'],
+                                                   'dns_cache.json.gz'))
         # Spawn several workers to do CNAME lookups for the unknown domains
         count = 0
+        stale = []
         for domain in domains:
             if not domains[domain]:
-                count += 1
-                self.dns_lookup_queue.put(domain)
+                names = None
+                if self.dns_cache is not None:
+                    names, refresh = self.dns_cache.get(domain)
+                    if refresh:
+                        stale.append(domain)
+                if names is not None:
+                    for name in names:
+                        provider = self.check_cdn_name(name)
+                        if provider is not None:
+                            domains[domain] = provider
+                            break
+                else:
+                    count += 1
+                    self.dns_lookup_queue.put(domain)
         if count:
             thread_count = min(10, count)
             threads = []
@@ -444,6 +500,15 @@ class OptimizationChecks(object):
                     domains[dns_result['domain']] = dns_result['provider']
             except Exception:
                 pass
+        if self.dns_cache is not None:
+            logging.debug('DNS cache: %d hits (%d stale), %d misses', self.dns_cache.hits,
+                          len(stale), self.dns_cache.misses)
+            self.dns_cache.save()
+            if stale:
+                thread = threading.Thread(target=self.refresh_dns_cache,
+                                          args=(self.dns_cache, stale))
+                thread.daemon = True
+                thread.start()
         # Final pass, populate the CDN infor for each request
         for request_id in self.requests:
             check = {'score': -1, 'provider': ''}
@@ -464,14 +529,18 @@ class OptimizationChecks(object):
                 self.cdn_results[request_id] = check
         self.cdn_time = monotonic.monotonic() - start
 
-    def find_dns_cdn(self, domain, depth=0):
+    def find_dns_cdn(self, domain, depth=0, lookup=None):
         """Recursively check a CNAME chain"""
         import dns.resolver
         provider = self.check_cdn_name(domain)
         logging.debug("Looking up %s", domain)
+        if lookup is not None:
+            lookup['names'].append(domain)
         if provider is None:
             try:
                 answers = dns.resolver.query(domain, 'CNAME')
+                if lookup is not None and answers.rrset is not None:
+                    lookup['ttl'] = min(lookup['ttl'], answers.rrset.ttl)
                 if answers and len(answers):
                     for rdata in answers:
                         name = '.'.join(rdata.target).strip(' .')
@@ -479,11 +548,17 @@ class OptimizationChecks(object):
                         if name != domain:
                             provider = self.check_cdn_name(name)
                             if provider is None and depth < 10:
-                                provider = self.find_dns_cdn(name, depth + 1)
+                                provider = self.find_dns_cdn(name, depth + 1, lookup)
+                            elif provider is not None and lookup is not None:
+                                lookup['names'].append(name)
                         if provider is not None:
                             break
-            except Exception:
+            except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
                 pass
+            except Exception:
+                # Don't cache lookups that failed (timeouts, no nameservers, etc)
+                if lookup is not None:
+                    lookup['valid'] = False
         return provider
 
     def dns_worker(self):
@@ -491,21 +566,42 @@ class OptimizationChecks(object):
         try:
             while True:
                 domain = self.dns_lookup_queue.get_nowait()
-                provider = self.find_dns_cdn(domain)
+                lookup = {'names': [], 'ttl': DNS_CACHE_MAX_TTL, 'valid': True}
+                provider = self.find_dns_cdn(domain, lookup=lookup)
                 if provider is not None:
                     self.dns_result_queue.put({'domain': domain, 'provider': provider})
+                if self.dns_cache is not None and lookup['valid']:
+                    self.dns_cache.put(domain, lookup['names'], lookup['ttl'])
                 self.dns_lookup_queue.task_done()
         except Exception:
             pass
 
+    def refresh_dns_cache(self, dns_cache, domains):
+        """Re-resolve the expired CNAME chains that were used from the cache"""
+        try:
+            for domain in domains:
+                lookup = {'names': [], 'ttl': DNS_CACHE_MAX_TTL, 'valid': True}
+                self.find_dns_cdn(domain, lookup=lookup)
+                if lookup['valid']:
+                    dns_cache.put(domain, lookup['names'], lookup['ttl'])
+            dns_cache.save()
+        except Exception:
+            logging.exception('Error refreshing the DNS cache')
+
     def check_cdn_name(self, domain):
         """Check the given domain against our cname list"""
         if domain is not None and len(domain):
             check_name = domain.lower()
-            for cdn in self.cdn_cnames:
-                for cname in self.cdn_cnames[cdn]:
-                    if check_name.find(cname) > -1:
-                        return cdn
+            provider = None
+            # Keep searching past each match since patterns can overlap and the
+            # provider listed first wins
+            match = self.cdn_cname_re.search(check_name)
+            while match is not None:
+                cdn = self.cdn_cname_providers[match.group(0)]
+                if provider is None or self.cdn_cname_order[cdn] < self.cdn_cname_order[provider]:
+                    provider = cdn
+                match = self.cdn_cname_re.search(check_name, match.start() + 1)
+            return provider
         return None
 
     def check_cdn_headers(self, headers):
@@ -530,7 +626,6 @@ class OptimizationChecks(object):
 
     def check_gzip(self):
         """Check each request to see if it can be compressed"""
-        start = monotonic.monotonic()
         for request_id in self.requests:
             try:
                 request = self.requests[request_id]
@@ -562,39 +657,44 @@ class OptimizationChecks(object):
                     if sniff_type is not None:
                         check['score'] = -1
                     else:
-                        out_file = request['body'] + '.gzip'
-                        with open(request['body'], 'rb') as f_in:
-                            with gzip.open(out_file, 'wb', 7) as f_out:
-                                shutil.copyfileobj(f_in, f_out)
-                        if os.path.isfile(out_file):
-                            target_size = os.path.getsize(out_file)
-                            try:
-                                os.remove(out_file)
-                            except Exception:
-                                pass
-                            if target_size is not None:
-                                delta = content_length - target_size
-                                # Only count it if there is at least 1 packet and 10% savings
-                                if target_size > 0 and \
-                                        delta > 1400 and \
-                                        target_size < (content_length * 0.9):
-                                    check['target_size'] = target_size
-                                    check['score'] = int(target_size * 100 / content_length)
-                                else:
-                                    check['score'] = -1
-                            else:
-                                check['score'] = -1
-                        else:
-                            check['score'] = -1
+                        self.gzip_tasks[request_id] = self.create_task('gzip', check, gzip_size,
+                                                                       request['body'])
+                        continue
+                if check['score'] >= 0:
+                    self.gzip_results[request_id] = check
+            except Exception:
+                pass
+
+    def finish_gzip_checks(self):
+        """Collect the compressed sizes from the gzip tasks"""
+        for request_id in self.gzip_tasks:
+            try:
+                task = self.gzip_tasks[request_id]
+                check = task['check']
+                content_length = check['size']
+                target_size = self.get_task_result(task)
+                if target_size is not None:
+                    delta = content_length - target_size
+                    # Only count it if there is at least 1 packet and 10% savings
+                    if target_size > 0 and \
+                            delta > 1400 and \
+                            target_size < (content_length * 0.9):
+                        check['target_size'] = target_size
+                        check['score'] = int(target_size * 100 / content_length)
+                    else:
+                        check['score'] = -1
+                else:
+                    check['score'] = -1
                 if check['score'] >= 0:
                     self.gzip_results[request_id] = check
             except Exception:
                 pass
-        self.gzip_time = monotonic.monotonic() - start
+        self.gzip_tasks = {}
+        if self.tasks_start is not None:
+            self.gzip_time = monotonic.monotonic() - self.tasks_start
 
     def check_images(self):
         """Check each request to see if images can be compressed better"""
-        start = monotonic.monotonic()
         for request_id in self.requests:
             try:
                 request = self.requests[request_id]
@@ -611,25 +711,9 @@ class OptimizationChecks(object):
                         if content_length < 1400:
                             check['score'] = 100
                         else:
-                            # Compress it as a quality 85 stripped progressive image and compare
-                            jpeg_file = request['body'] + '.jpg'
-                            command = 'convert -define jpeg:dct-method=fast -strip '\
-                                '-interlace Plane -quality 85 '\
-                                '"{0}" "{1}"'.format(request['body'], jpeg_file)
-                            subprocess.call(command, shell=True)
-                            if os.path.isfile(jpeg_file):
-                                target_size = os.path.getsize(jpeg_file)
-                                try:
-                                    os.remove(jpeg_file)
-                                except Exception:
-                                    pass
-                                delta = content_length - target_size
-                                # Only count it if there is at least 1 packet savings
-                                if target_size > 0 and delta > 1400:
-                                    check['target_size'] = target_size
-                                    check['score'] = int(target_size * 100 / content_length)
-                                else:
-                                    check['score'] = 100
+                            self.image_tasks[request_id] = self.create_task('jpeg', check,
+                                                                            jpeg_size,
+                                                                            request['body'])
                     elif sniff_type == 'png' and 'response_body' in request:
                         if content_length < 1400:
                             check['score'] = 100
@@ -668,42 +752,108 @@ class OptimizationChecks(object):
                         if content_length < 1400:
                             check['score'] = 100
                         else:
-                            is_animated = False
-                            from PIL import Image
-                            with Image.open(request['body']) as gif:
-                                try:
-                                    gif.seek(1)
-                                except EOFError:
-                                    is_animated = False
-                                else:
-                                    is_animated = True
-                            if is_animated:
-                                check['score'] = 100
-                            else:
-                                # Convert it to a PNG
-                                png_file = request['body'] + '.png'
-                                command = 'convert "{0}" "{1}"'.format(request['body'], png_file)
-                                subprocess.call(command, shell=True)
-                                if os.path.isfile(png_file):
-                                    target_size = os.path.getsize(png_file)
-                                    try:
-                                        os.remove(png_file)
-                                    except Exception:
-                                        pass
-                                    delta = content_length - target_size
-                                    # Only count it if there is at least 1 packet savings
-                                    if target_size > 0 and delta > 1400:
-                                        check['target_size'] = target_size
-                                        check['score'] = int(target_size * 100 / content_length)
-                                    else:
-                                        check['score'] = 100
+                            self.image_tasks[request_id] = self.create_task('gif', check,
+                                                                            gif_size,
+                                                                            request['body'])
                     elif sniff_type == 'webp':
                         check['score'] = 100
                     if check['score'] >= 0:
                         self.image_results[request_id] = check
             except Exception:
                 pass
-        self.image_time = monotonic.monotonic() - start
+
+    def finish_image_checks(self):
+        """Collect the re-encoded image sizes from the image tasks"""
+        for request_id in self.image_tasks:
+            try:
+                task = self.image_tasks[request_id]
+                check = task['check']
+                content_length = check['size']
+                target_size = self.get_task_result(task)
+                if target_size is not None:
+                    delta = content_length - target_size
+                    # Only count it if there is at least 1 packet savings
+                    if target_size > 0 and delta > 1400:
+                        check['target_size'] = target_size
+                        check['score'] = int(target_size * 100 / content_length)
+                    else:
+                        check['score'] = 100
+                if check['score'] >= 0:
+                    self.image_results[request_id] = check
+            except Exception:
+                pass
+        self.image_tasks = {}
+        if self.tasks_start is not None:
+            self.image_time = monotonic.monotonic() - self.tasks_start
+
+    def create_task(self, check_name, check, func, body_file):
+        """Create a task for checking a body file (using the cached result if available)"""
+        task = {'check': check, 'name': check_name, 'func': func, 'args': (body_file,),
+                'result': None, 'hash': None}
+        if self.cache is not None:
+            task['hash'] = self.get_file_hash(body_file)
+            value = self.cache.get(check_name, task['hash'])
+            if value is not None:
+                task['value'] = value
+        return task
+
+    def get_file_hash(self, path):
+        """Hash the contents of a body file (once per file)"""
+        if path not in self.body_hashes:
+            body_hash = hashlib.sha1()
+            with open(path, 'rb') as f_in:
+                while True:
+                    data = f_in.read(GZIP_READ_SIZE)
+                    if not data:
+                        break
+                    body_hash.update(data)
+            self.body_hashes[path] = body_hash.hexdigest()
+        return self.body_hashes[path]
+
+    def start_tasks(self):
+        """Run the queued per-request tasks on a pool of worker processes"""
+        tasks = [task for task in self.gzip_tasks.values() + self.image_tasks.values()
+                 if 'value' not in task]
+        if tasks:
+            # Leave a core free for the video processing that runs alongside the checks
+            processes = min(len(tasks), max(1, multiprocessing.cpu_count() - 1))
+            try:
+                self.pool = multiprocessing.Pool(processes)
+                for task in tasks:
+                    task['result'] = self.pool.apply_async(task['func'], task['args'])
+                logging.debug('Running %d optimization check tasks in %d processes',
+                              len(tasks), processes)
+            except Exception:
+                logging.exception('Error starting the optimization check pool')
+                self.stop_tasks()
+                for task in tasks:
+                    task['result'] = None
+
+    def get_task_result(self, task):
+        """Wait for a task to complete (running it in-process if it wasn't queued)"""
+        if 'value' in task:
+            return task['value']
+        result = None
+        try:
+            if task['result'] is not None:
+                result = task['result'].get()
+            else:
+                result = task['func'](*task['args'])
+        except Exception:
+            pass
+        if result is not None and self.cache is not None and task['hash'] is not None:
+            self.cache.put(task['name'], task['hash'], result)
+        return result
+
+    def stop_tasks(self):
+        """Shut down the worker pool"""
+        if self.pool is not None:
+            try:
+                self.pool.close()
+                self.pool.join()
+            except Exception:
+                pass
+            self.pool = None
 
     def check_progressive(self):
         """Count the number of scan lines in each jpeg"""
@@ -716,47 +866,61 @@ class OptimizationChecks(object):
                     sniff_type = self.sniff_content(body)
                     if sniff_type == 'jpeg':
                         content_length = len(request['response_body'])
-                        check = {'size': content_length, 'scan_count': 0}
-                        pos = 0
-                        try:
-                            while pos < content_length:
-                                block = struct.unpack('B', body[pos])[0]
-                                pos += 1
-                                if block != 0xff:
-                                    break
-                                block = struct.unpack('B', body[pos])[0]
-                                pos += 1
-                                while block == 0xff:
-                                    block = struct.unpack('B', body[pos])[0]
-                                    pos += 1
-                                if block == 0x01 or (block >= 0xd0 and block <= 0xd9):
-                                    continue
-                                elif block == 0xda: # Image data
-                                    check['scan_count'] += 1
-                                    # Seek to the next non-padded 0xff to find the next marker
-                                    found = False
-                                    while not found and pos < content_length:
-                                        value = struct.unpack('B', body[pos])[0]
-                                        pos += 1
-                                        if value == 0xff:
-                                            value = struct.unpack('B', body[pos])[0]
-                                            pos += 1
-                                            if value != 0x00:
-                                                found = True
-                                                pos -= 2
-                                else:
-                                    chunk = body[pos:pos+2]
-                                    block_size = struct.unpack('2B', chunk)
-                                    pos += 2
-                                    block_size = block_size[0] * 256 + block_size[1] - 2
-                                    pos += block_size
-                        except Exception:
-                            pass
+                        check = {'size': content_length, 'scan_count': None}
+                        body_hash = None
+                        if self.cache is not None:
+                            body_hash = hashlib.sha1(body).hexdigest()
+                            check['scan_count'] = self.cache.get('progressive', body_hash)
+                        if check['scan_count'] is None:
+                            check['scan_count'] = self.count_scans(body)
+                            if body_hash is not None:
+                                self.cache.put('progressive', body_hash, check['scan_count'])
                         self.progressive_results[request_id] = check
             except Exception:
                 pass
         self.progressive_time = monotonic.monotonic() - start
 
+    def count_scans(self, body):
+        """Count the number of scans in a jpeg"""
+        scan_count = 0
+        content_length = len(body)
+        pos = 0
+        try:
+            while pos < content_length:
+                block = struct.unpack('B', body[pos])[0]
+                pos += 1
+                if block != 0xff:
+                    break
+                block = struct.unpack('B', body[pos])[0]
+                pos += 1
+                while block == 0xff:
+                    block = struct.unpack('B', body[pos])[0]
+                    pos += 1
+                if block == 0x01 or (block >= 0xd0 and block <= 0xd9):
+                    continue
+                elif block == 0xda: # Image data
+                    scan_count += 1
+                    # Seek to the next non-padded 0xff to find the next marker
+                    found = False
+                    while not found and pos < content_length:
+                        value = struct.unpack('B', body[pos])[0]
+                        pos += 1
+                        if value == 0xff:
+                            value = struct.unpack('B', body[pos])[0]
+                            pos += 1
+                            if value != 0x00:
+                                found = True
+                                pos -= 2
+                else:
+                    chunk = body[pos:pos+2]
+                    block_size = struct.unpack('2B', chunk)
+                    pos += 2
+                    block_size = block_size[0] * 256 + block_size[1] - 2
+                    pos += block_size
+        except Exception:
+            pass
+        return scan_count
+
     def get_header_value(self, headers, name):
         """Get the value for the requested header"""
         value = None
@@ -794,3 +958,167 @@ class OptimizationChecks(object):
             raw = f_in.read(14)
             content_type = self.sniff_content(raw)
         return content_type
+
+
+def gzip_size(path):
+    """Size of the file when gzip-compressed (counted in memory)"""
+    compress = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    size = GZIP_OVERHEAD
+    with open(path, 'rb') as f_in:
+        while True:
+            data = f_in.read(GZIP_READ_SIZE)
+            if not data:
+                break
+            size += len(compress.compress(data))
+    size += len(compress.flush())
+    return size
+
+
+def convert_size(command):
+    """Size of the image that ImageMagick writes to stdout"""
+    size = None
+    proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
+    out, _ = proc.communicate()
+    if proc.returncode == 0 and out:
+        size = len(out)
+    return size
+
+
+def jpeg_size(path):
+    """Size of the jpeg as a quality 85 stripped progressive image"""
+    command = 'convert -define jpeg:dct-method=fast -strip '\
+        '-interlace Plane -quality 85 "{0}" jpeg:-'.format(path)
+    return convert_size(command)
+
+
+def gif_size(path):
+    """Size of a non-animated gif converted to png (0 for animated gifs)"""
+    from PIL import Image
+    is_animated = False
+    with Image.open(path) as gif:
+        try:
+            gif.seek(1)
+        except EOFError:
+            is_animated = False
+        else:
+            is_animated = True
+    if is_animated:
+        return 0
+    return convert_size('convert "{0}" png:-'.format(path))
+
+
+class PersistentCache(object):
+    """Gzipped json cache of [value, timestamp] entries that persists across tests.
+    The timestamp orders the entries for eviction (oldest first) once the cache grows
+    past max_entries and subclasses can also drop expired entries."""
+    def __init__(self, path, max_entries, name):
+        self.path = path
+        self.max_entries = max_entries
+        self.name = name
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self.lock = threading.Lock()
+        if os.path.isfile(self.path):
+            try:
+                with gzip.open(self.path, 'rb') as f_in:
+                    self.entries = json.load(f_in)
+            except Exception:
+                logging.exception('Error loading %s cache %s', self.name, self.path)
+                self.entries = {}
+
+    def is_expired(self, entry, now):
+        """Entries only get evicted when the cache is full by default"""
+        return False
+
+    def save(self):
+        """Drop the expired and oldest entries and write the cache to disk"""
+        with self.lock:
+            if not self.dirty:
+                return
+            now = time.time()
+            for key in [key for key in self.entries if self.is_expired(self.entries[key], now)]:
+                del self.entries[key]
+            if len(self.entries) > self.max_entries:
+                keys = sorted(self.entries, key=lambda key: self.entries[key][1], reverse=True)
+                for key in keys[self.max_entries:]:
+                    del self.entries[key]
+            try:
+                cache_dir = os.path.dirname(self.path)
+                if not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir)
+                tmp_file = self.path + '.tmp'
+                with gzip.open(tmp_file, 'wb', 7) as f_out:
+                    json.dump(self.entries, f_out)
+                if os.path.isfile(self.path):
+                    os.remove(self.path)
+                os.rename(tmp_file, self.path)
+                self.dirty = False
+            except Exception:
+                logging.exception('Error saving %s cache %s', self.name, self.path)
+
+
+class OptimizationCache(PersistentCache):
+    """Persistent LRU cache of optimization check results keyed by body hash"""
+    def __init__(self, path, max_entries=OPTIMIZATION_CACHE_SIZE):
+        PersistentCache.__init__(self, path, max_entries, 'optimization')
+
+    def get_key(self, check_name, body_hash):
+        """Cache key for a check against a given body"""
+        return '{0}.{1:d}.{2}'.format(check_name, CHECK_VERSIONS[check_name], body_hash)
+
+    def get(self, check_name, body_hash):
+        """Look up a check result (None if it isn't cached)"""
+        value = None
+        key = self.get_key(check_name, body_hash)
+        with self.lock:
+            if key in self.entries:
+                entry = self.entries[key]
+                value = entry[0]
+                entry[1] = int(time.time())
+                self.dirty = True
+                self.hits += 1
+            else:
+                self.misses += 1
+        return value
+
+    def put(self, check_name, body_hash, value):
+        """Store a check result"""
+        key = self.get_key(check_name, body_hash)
+        with self.lock:
+            self.entries[key] = [value, int(time.time())]
+            self.dirty = True
+
+
+class DnsCache(PersistentCache):
+    """Persistent cache of the CNAME chains for host names (expires with the DNS TTL
+    but expired chains are still served for DNS_CACHE_STALE_TIME while they are refreshed)"""
+    def __init__(self, path, max_entries=DNS_CACHE_SIZE):
+        PersistentCache.__init__(self, path, max_entries, 'DNS')
+
+    def is_expired(self, entry, now):
+        """The timestamp for DNS entries is when the TTL runs out"""
+        return entry[1] + DNS_CACHE_STALE_TIME <= now
+
+    def get(self, domain):
+        """List of names in the CNAME chain for the domain (None if not cached) and
+        whether the TTL ran out so it needs to be refreshed"""
+        names = None
+        refresh = False
+        with self.lock:
+            now = time.time()
+            if domain in self.entries and not self.is_expired(self.entries[domain], now):
+                names = self.entries[domain][0]
+                refresh = self.entries[domain][1] <= now
+                self.hits += 1
+            else:
+                self.misses += 1
+        return names, refresh
+
+    def put(self, domain, names, ttl):
+        """Store the CNAME chain for the domain"""
+        if ttl > 0:
+            with self.lock:
+                self.entries[domain] = [names, int(time.time() + ttl)]
+                self.dirty = True
@@ -786,7 +786,8 @@ class iWptBrowser(object):
                 visualmetrics = os.path.join(support_path, "visualmetrics.py")
                 args = ['python', visualmetrics, '-vvvv', '-i', task['video_file'],
                         '-d', video_path, '--force', '--quality', '{0:d}'.format(self.job['iq']),
-                        '--viewport', '--orange', '--maxframes', '50', '--histogram', histograms]
+                        '--viewport', '--orange', '--maxframes', '50', '--pipe',
+                        '--histogram', histograms]
                 if 'renderVideo' in self.job and self.job['renderVideo']:
                     video_out = self.path_base + '_rendered_video.mp4'
                     args.extend(['--render', video_out])
@@ -14,7 +14,9 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import collections
 import gzip
+import io
 import logging
 import os
 import re
@@ -26,6 +28,34 @@ try:
     import ujson as json
 except BaseException:
     import json
+# The standard json module is used for incremental decoding
+import json as std_json
+
+# Lines longer than this are decoded incrementally instead of as a single event
+DEVTOOLS_LINE_LIMIT = 1024 * 1024
+# Size of the reads when incrementally decoding a devtools log
+DEVTOOLS_READ_SIZE = 1024 * 1024
+# Events that extract_net_requests uses the full params from. Only the
+# timestamp and request ID are kept for all of the other events.
+NET_REQUEST_METHODS = set(['Network.requestWillBeSent',
+                           'Network.requestServedFromCache',
+                           'Network.dataReceived',
+                           'Network.responseReceived',
+                           'Network.loadingFinished',
+                           'Network.loadingFailed',
+                           'Page.frameNavigated',
+                           'Page.loadEventFired',
+                           'Page.domContentEventFired'])
+
+# Patterns used when merging the netlog requests
+NETLOG_NUMBER_RE = re.compile(r'^\d+\.?(\d+)?$')
+NETLOG_NUMBER_PREFIX_RE = re.compile(r'\d+\.?(\d+)?')
+HTTP1_STATUS_RE = re.compile(r'^HTTP\/1[^\s]+ (\d+)')
+HTTP2_STATUS_RE = re.compile(r'^:status: (\d+)')
+CONTENT_TYPE_RE = re.compile(r'^content-type: (.+)', re.IGNORECASE)
+CACHE_CONTROL_RE = re.compile(r'^cache-control: (.+)', re.IGNORECASE)
+CONTENT_ENCODING_RE = re.compile(r'^content-encoding: (.+)', re.IGNORECASE)
+EXPIRES_RE = re.compile(r'^expires: (.+)', re.IGNORECASE)
 
 class DevToolsParser(object):
     """Main class"""
@@ -68,20 +98,93 @@ class DevToolsParser(object):
             except Exception:
                 logging.critical("Error writing to " + self.out_file)
 
+    def read_events(self, f_in):
+        """Yield the events from a devtools log without loading all of it.
+        Handles one event per line as well as the whole list on one line."""
+        while True:
+            line = f_in.readline(DEVTOOLS_LINE_LIMIT)
+            if not line:
+                break
+            event = None
+            if len(line) < DEVTOOLS_LINE_LIMIT or line.endswith('\n'):
+                text = line.strip("\r\n\t ,[]")
+                if not len(text):
+                    continue
+                try:
+                    event = json.loads(text)
+                except BaseException:
+                    pass
+            if isinstance(event, dict):
+                yield event
+            else:
+                for event in self.read_json_list(f_in, line):
+                    yield event
+                break
+
+    def read_json_list(self, f_in, buf):
+        """Incrementally decode the objects in the rest of a JSON list"""
+        decoder = std_json.JSONDecoder()
+        pos = 0
+        eof = False
+        while True:
+            length = len(buf)
+            while pos < length and buf[pos] in ' \t\r\n,[':
+                pos += 1
+            if pos < length and buf[pos] != '{':
+                # End of the list
+                break
+            event = None
+            if pos < length:
+                try:
+                    event, pos = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    event = None
+            if event is not None:
+                if isinstance(event, dict):
+                    yield event
+            elif eof:
+                break
+            else:
+                # The next object isn't complete yet, read more of the file
+                more = f_in.read(DEVTOOLS_READ_SIZE)
+                if not more:
+                    eof = True
+                buf = buf[pos:] + more
+                pos = 0
+
+    def load_net_events(self, f_in):
+        """Load the events that extract_net_requests uses, sorted by timestamp"""
+        events = []
+        timestamps = []
+        for raw_event in self.read_events(f_in):
+            if 'method' in raw_event and 'params' in raw_event:
+                method = raw_event['method']
+                params = raw_event['params']
+                if method not in NET_REQUEST_METHODS:
+                    # Other events only matter for their timing
+                    if 'timestamp' not in params:
+                        continue
+                    stub = {'timestamp': params['timestamp']}
+                    if 'requestId' in params:
+                        stub['requestId'] = params['requestId']
+                    raw_event = {'method': method, 'params': stub}
+                events.append(raw_event)
+                timestamps.append(params['timestamp'] if 'timestamp' in params else 0)
+        # sort all of the events by timestamp (stable, like sorting the events)
+        order = sorted(xrange(len(timestamps)), key=timestamps.__getitem__)
+        return [events[index] for index in order]
+
     def extract_net_requests(self):
         """Load the events we are interested in"""
         net_requests = []
         page_data = {'endTime': 0}
         _, ext = os.path.splitext(self.devtools_file)
+        # buffered readers keep the length-limited readline calls fast
         if ext.lower() == '.gz':
-            f_in = gzip.open(self.devtools_file, 'rb')
+            f_in = io.BufferedReader(gzip.open(self.devtools_file, 'rb'), DEVTOOLS_READ_SIZE)
         else:
-            f_in = open(self.devtools_file, 'r')
-        raw_events = json.load(f_in)
-        # sort all of the events by timestamp
-        if len(raw_events):
-            raw_events.sort(key=lambda x: x['params']['timestamp'] if \
-                ('params' in x and 'timestamp' in x['params']) else 0)
+            f_in = io.open(self.devtools_file, 'rb', DEVTOOLS_READ_SIZE)
+        raw_events = self.load_net_events(f_in)
         f_in.close()
         if raw_events is not None and len(raw_events):
             end_timestamp = None
@@ -572,37 +675,45 @@ class DevToolsParser(object):
                 f_in = open(self.netlog_requests_file, 'r')
             netlog = json.load(f_in)
             f_in.close()
+            # Index the netlog entries by URL (in netlog order) so each request
+            # claims the first unclaimed entry for its URL without a full scan
+            netlog_urls = {}
+            for entry in netlog:
+                if 'url' in entry and 'start' in entry and 'claimed' not in entry:
+                    if entry['url'] not in netlog_urls:
+                        netlog_urls[entry['url']] = collections.deque()
+                    netlog_urls[entry['url']].append(entry)
             for request in requests:
-                if 'full_url' in request:
-                    for entry in netlog:
-                        if 'url' in entry and 'start' in entry and 'claimed' not in entry and \
-                                entry['url'] == request['full_url']:
-                            entry['claimed'] = True
-                            for key in mapping:
-                                if key in entry:
-                                    if re.match(r'^\d+\.?(\d+)?$', str(entry[key]).strip()):
-                                        request[mapping[key]] = \
-                                                int(round(float(str(entry[key]).strip())))
-                                    else:
-                                        request[mapping[key]] = str(entry[key])
-                            if 'first_byte' in entry:
-                                request['ttfb_ms'] = int(round(entry['first_byte'] -
-                                                               entry['start']))
-                            if 'end' in entry:
-                                request['load_ms'] = int(round(entry['end'] -
-                                                               entry['start']))
-                            if 'pushed' in entry and entry['pushed']:
-                                request['was_pushed'] = 1
-                            if 'server_address' in entry:
-                                parts = entry['server_address'].rsplit(':', 1)
-                                if len(parts) == 2:
-                                    request['ip_addr'] = parts[0]
-                                    request['server_port'] = parts[1]
-                            if 'client_address' in entry:
-                                parts = entry['client_address'].rsplit(':', 1)
-                                if len(parts) == 2:
-                                    request['client_port'] = parts[1]
-                            break
+                if 'full_url' in request and request['full_url'] in netlog_urls:
+                    entries = netlog_urls[request['full_url']]
+                    entry = entries.popleft()
+                    if not entries:
+                        del netlog_urls[request['full_url']]
+                    entry['claimed'] = True
+                    for key in mapping:
+                        if key in entry:
+                            if NETLOG_NUMBER_RE.match(str(entry[key]).strip()):
+                                request[mapping[key]] = \
+                                        int(round(float(str(entry[key]).strip())))
+                            else:
+                                request[mapping[key]] = str(entry[key])
+                    if 'first_byte' in entry:
+                        request['ttfb_ms'] = int(round(entry['first_byte'] -
+                                                       entry['start']))
+                    if 'end' in entry:
+                        request['load_ms'] = int(round(entry['end'] -
+                                                       entry['start']))
+                    if 'pushed' in entry and entry['pushed']:
+                        request['was_pushed'] = 1
+                    if 'server_address' in entry:
+                        parts = entry['server_address'].rsplit(':', 1)
+                        if len(parts) == 2:
+                            request['ip_addr'] = parts[0]
+                            request['server_port'] = parts[1]
+                    if 'client_address' in entry:
+                        parts = entry['client_address'].rsplit(':', 1)
+                        if len(parts) == 2:
+                            request['client_port'] = parts[1]
             # Add any requests we didn't know about
             index = 0
             for entry in netlog:
@@ -649,7 +760,7 @@ class DevToolsParser(object):
                         request['frame_id'] = page_data['main_frame']
                     for key in mapping:
                         if key in entry:
-                            if re.match(r'\d+\.?(\d+)?', str(entry[key])):
+                            if NETLOG_NUMBER_PREFIX_RE.match(str(entry[key])):
                                 request[mapping[key]] = int(round(float(entry[key])))
                             else:
                                 request[mapping[key]] = str(entry[key])
@@ -667,22 +778,22 @@ class DevToolsParser(object):
                     if 'response_headers' in entry:
                         request['headers']['response'] = list(entry['response_headers'])
                         for header in entry['response_headers']:
-                            matches = re.search(r'^HTTP\/1[^\s]+ (\d+)', header)
+                            matches = HTTP1_STATUS_RE.search(header)
                             if matches:
                                 request['responseCode'] = int(matches.group(1))
-                            matches = re.search(r'^:status: (\d+)', header)
+                            matches = HTTP2_STATUS_RE.search(header)
                             if matches:
                                 request['responseCode'] = int(matches.group(1))
-                            matches = re.search(r'^content-type: (.+)', header, re.IGNORECASE)
+                            matches = CONTENT_TYPE_RE.search(header)
                             if matches:
                                 request['contentType'] = matches.group(1).split(';')[0]
-                            matches = re.search(r'^cache-control: (.+)', header, re.IGNORECASE)
+                            matches = CACHE_CONTROL_RE.search(header)
                             if matches:
                                 request['cacheControl'] = matches.group(1)
-                            matches = re.search(r'^content-encoding: (.+)', header, re.IGNORECASE)
+                            matches = CONTENT_ENCODING_RE.search(header)
                             if matches:
                                 request['contentEncoding'] = matches.group(1)
-                            matches = re.search(r'^expires: (.+)', header, re.IGNORECASE)
+                            matches = EXPIRES_RE.search(header)
                             if matches:
                                 request['expires'] = matches.group(1)
                     if 'bytes_in' in entry:
@@ -869,6 +980,77 @@ class DevToolsParser(object):
                 page_data['score_progressive_jpeg'] = int(round(progressive_bytes * 100 /
                                                                 progressive_total_bytes))
 
+def write_synthetic_log(path, event_count):
+    """Write a gzipped devtools log with one event per line and roughly event_count events.
+    Each request gets a response, 4 data chunks and 3 console messages logged with it."""
+    def write_event(f_out, method, params):
+        f_out.write(',\n' + json.dumps({'method': method, 'params': params}))
+    timestamp = 1000.0
+    with gzip.open(path, 'wb') as f_out:
+        f_out.write('[{}')
+        write_event(f_out, 'Page.frameNavigated', {'frame': {'id': 'main'}})
+        for index in xrange(max(event_count / 10, 1)):
+            request_id = str(index)
+            url = 'https://www.example.com/resource{0:d}.js'.format(index)
+            timestamp += 0.001
+            write_event(f_out, 'Network.requestWillBeSent',
+                        {'requestId': request_id, 'timestamp': timestamp, 'frameId': 'main',
+                         'request': {'url': url, 'method': 'GET',
+                                     'headers': {'User-Agent': 'benchmark'}}})
+            timestamp += 0.001
+            write_event(f_out, 'Network.responseReceived',
+                        {'requestId': request_id, 'timestamp': timestamp,
+                         'response': {'url': url, 'status': 200, 'fromDiskCache': False,
+                                      'headers': {'Content-Type': 'text/javascript'},
+                                      'timing': {'requestTime': timestamp, 'sendStart': 0.1,
+                                                 'sendEnd': 0.2, 'receiveHeadersEnd': 1.0}}})
+            for chunk in xrange(4):
+                timestamp += 0.001
+                write_event(f_out, 'Network.dataReceived',
+                            {'requestId': request_id, 'timestamp': timestamp,
+                             'dataLength': 8192, 'encodedDataLength': 2048})
+                if chunk < 3:
+                    write_event(f_out, 'Runtime.consoleAPICalled',
+                                {'type': 'log', 'timestamp': timestamp,
+                                 'args': [{'type': 'string', 'value': 'x' * 200}]})
+            timestamp += 0.001
+            write_event(f_out, 'Network.loadingFinished',
+                        {'requestId': request_id, 'timestamp': timestamp,
+                         'encodedDataLength': 8192})
+        write_event(f_out, 'Page.domContentEventFired', {'timestamp': timestamp})
+        write_event(f_out, 'Page.loadEventFired', {'timestamp': timestamp})
+        f_out.write('\n]')
+
+
+def benchmark(event_count):
+    """Time the processing of a synthetic devtools log"""
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp()
+    try:
+        devtools_file = os.path.join(directory, 'devtools.json.gz')
+        write_synthetic_log(devtools_file, event_count)
+        start = time.time()
+        devtools = DevToolsParser({'devtools': devtools_file,
+                                   'out': os.path.join(directory, 'devtools_requests.json')})
+        devtools.process()
+        elapsed = time.time() - start
+        print "Processed {0:d} events in {1:0.3f} seconds".format(event_count, elapsed)
+        print "Requests: {0:d}".format(len(devtools.result['requests']))
+        try:
+            import platform
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # ru_maxrss is in bytes on OSX and KB everywhere else
+            if platform.system() != 'Darwin':
+                peak *= 1024
+            print "Peak RSS: {0:0.1f} MB".format(peak / (1024.0 * 1024.0))
+        except ImportError:
+            pass
+    finally:
+        shutil.rmtree(directory)
+
+
 def main():
     """Main entry point"""
     import argparse
@@ -883,6 +1065,9 @@ def main():
     parser.add_argument('-c', '--cached', action='store_true', default=False,
                         help="Test was of a cached page.")
     parser.add_argument('-o', '--out', help="Output requests json file.")
+    parser.add_argument('-b', '--benchmark', type=int, nargs='?', const=100000,
+                        help="Time the processing of a synthetic devtools log with the given " \
+                             "number of events (100k default).")
     options, _ = parser.parse_known_args()
 
     # Set up logging
@@ -898,6 +1083,10 @@ def main():
     logging.basicConfig(
         level=log_level, format="%(asctime)s.%(msecs)03d - %(message)s", datefmt="%H:%M:%S")
 
+    if options.benchmark:
+        benchmark(options.benchmark)
+        return
+
     if not options.devtools or not options.out:
         parser.error("Input devtools or output file is not specified.")
 
@@ -907,7 +1096,7 @@ def main():
            'optimization': options.optimization,
            'cached': options.cached,
            'out': options.out}
-    devtools = DevTools(opt)
+    devtools = DevToolsParser(opt)
     devtools.process()
     end = time.time()
     elapsed = end - start
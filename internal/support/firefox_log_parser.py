@@ -19,6 +19,7 @@ import gzip
 import logging
 import os
 import re
+import threading
 import urlparse
 import monotonic
 try:
@@ -26,6 +27,46 @@ try:
 except BaseException:
     import json
 
+# How often the logs are checked for new lines when tailing them
+TAIL_INTERVAL = 0.2
+# Parser state that tracks the position within a sequence of related lines of one log file
+LINE_STATE_KEYS = ['current_channel', 'current_transaction', 'request_headers',
+                   'current_socket', 'current_socket_transaction']
+# Pre-compiled patterns for the individual log messages
+URI_RE = re.compile(r'uri=(?P<url>[^ \r\n]+)')
+HTTP_BASE_CHANNEL_INIT_RE = re.compile(r'HttpBaseChannel::Init \[this=(?P<channel>[\w\d]+)]')
+HTTP_CHANNEL_CREATED_RE = re.compile(r'nsHttpChannel (?P<channel>[\w\d]+) created '
+                                     r'nsHttpTransaction (?P<id>[\w\d]+)')
+HTTP_TRANSACTION_INIT_RE = re.compile(r'nsHttpTransaction::Init \[this=(?P<id>[\w\d]+)')
+HTTP_CONNECTION_ACTIVATE_RE = re.compile(r'nsHttpConnection::Activate \['
+                                         r'this=(?P<connection>[\w\d]+) '
+                                         r'trans=(?P<id>[\w\d]+)')
+HTTP_CONNECTION_INIT_RE = re.compile(r'nsHttpConnection::Init this=(?P<connection>[\w\d]+)')
+HTTP_CONNECTION_SETUP_SSL_RE = re.compile(r'nsHttpConnection::SetupSSL (?P<connection>[\w\d]+)')
+HTTP_CONNECTION_NPN_COMPLETE_RE = re.compile(r'nsHttpConnection::EnsureNPNComplete '
+                                             r'(?P<connection>[\w\d]+)')
+HTTP_TRANSACTION_SENDING_RE = re.compile(r'nsHttpTransaction::OnTransportStatus '
+                                         r'(?P<id>[\w\d]+) SENDING_TO ')
+HTTP_TRANSACTION_SOCKET_STATUS_RE = re.compile(r'nsHttpTransaction::OnSocketStatus '
+                                               r'\[this=(?P<id>[\w\d]+) status=804b0005 '
+                                               r'progress=(?P<bytes>[\d+]+)')
+HTTP_TRANSACTION_PROCESS_DATA_RE = re.compile(r'nsHttpTransaction::ProcessData '
+                                              r'\[this=(?P<id>[\w\d]+)')
+HTTP_TRANSACTION_HANDLE_CONTENT_RE = re.compile(r'nsHttpTransaction::HandleContent \['
+                                                r'this=(?P<id>[\w\d]+) '
+                                                r'count=(?P<len>[\d]+) read=')
+HTTP_TRANSACTION_PARSE_LINE_RE = re.compile(r'nsHttpTransaction::ParseLine \[(?P<line>.*)\]\s*$')
+STATUS_LINE_RE = re.compile(r'Have status line \[[^\]]*status=(?P<status>\d+)')
+SOCKET_INIT_RE = re.compile(r'nsSocketTransport::Init \['
+                            r'this=(?P<socket>[\w\d]+) '
+                            r'host=(?P<host>[^ :]+):(?P<port>\d+)')
+SOCKET_SEND_STATUS_RE = re.compile(r'nsSocketTransport::SendStatus \['
+                                   r'this=(?P<socket>[\w\d]+) '
+                                   r'status=(?P<status>[\w\d]+)')
+SOCKET_READY_RE = re.compile(r'nsSocketTransport::OnSocketReady \[this=(?P<socket>[\w\d]+) ')
+DNS_START_RE = re.compile(r'Calling getaddrinfo for host \[(?P<host>[^\]]+)\]')
+DNS_END_RE = re.compile(r'lookup completed for host \[(?P<host>[^\]]+)\]')
+
 class FirefoxLogParser(object):
     """Handle parsing of firefox logs"""
     def __init__(self):
@@ -37,6 +78,38 @@ class FirefoxLogParser(object):
             self.int_map['{0:02d}'.format(val)] = float(val)
         self.dns = {}
         self.http = {'channels': {}, 'requests': {}, 'connections': {}, 'sockets': {}}
+        self.tail_log_file = None
+        self.tail_thread = None
+        self.tail_done = None
+        self.tail_pos = {}
+        self.tail_buffer = {}
+        self.tail_state = {}
+        self.tail_lines = 0
+        # Handlers for the messages, keyed by the first token of the message
+        self.main_thread_http_handlers = {
+            'HttpBaseChannel::Init': self.http_base_channel_init,
+            'nsHttpChannel::Init': self.http_channel_init,
+            'nsHttpChannel': self.http_channel_created,
+            'nsHttpTransaction::Init': self.http_transaction_init,
+            'nsHttpTransaction': self.http_transaction_request_context,
+            'http': self.http_request_start,
+            ']': self.http_request_end,
+            '': self.http_request_header}
+        self.socket_thread_http_handlers = {
+            'nsHttpConnection::Activate': self.http_connection_activate,
+            'nsHttpConnection::Init': self.http_connection_init,
+            'nsHttpConnection::SetupSSL': self.http_connection_setup_ssl,
+            'nsHttpConnection::EnsureNPNComplete': self.http_connection_npn_complete,
+            'nsHttpTransaction::OnTransportStatus': self.http_transaction_transport_status,
+            'nsHttpTransaction::OnSocketStatus': self.http_transaction_socket_status,
+            'nsHttpTransaction::ProcessData': self.http_transaction_process_data,
+            'nsHttpTransaction::HandleContent': self.http_transaction_handle_content,
+            'nsHttpTransaction::ParseLine': self.http_transaction_parse_line,
+            'Have': self.http_status_line}
+        self.socket_transport_handlers = {
+            'nsSocketTransport::Init': self.socket_init,
+            'nsSocketTransport::SendStatus': self.socket_send_status,
+            'nsSocketTransport::OnSocketReady': self.socket_ready}
         self.logline = re.compile(r'^(?P<timestamp>\d\d\d\d-\d\d-\d\d \d\d:\d\d:\d\d\.\d+) \w+ - '
                                   r'\[(?P<thread>[^\]]+)\]: (?P<level>\w)/(?P<category>[^ ]+) '
                                   r'(?P<message>[^\r\n]+)')
@@ -62,6 +135,76 @@ class FirefoxLogParser(object):
                 pass
         return self.finish_processing()
 
+    def start_tailing(self, log_file, log_pos, start_time):
+        """Parse the logs in a background thread as they are written (from the log_pos
+        offsets for existing files)"""
+        self.__init__()
+        self.set_start_time(start_time)
+        self.tail_log_file = log_file
+        self.tail_pos = dict(log_pos)
+        self.tail_done = threading.Event()
+        self.tail_thread = threading.Thread(target=self.tail_logs)
+        self.tail_thread.daemon = True
+        self.tail_thread.start()
+
+    def stop_tailing(self):
+        """Parse whatever is left in the logs and stop the background thread"""
+        if self.tail_thread is not None:
+            self.tail_done.set()
+            self.tail_thread.join()
+            self.tail_thread = None
+
+    def tail_logs(self):
+        """Background thread that keeps up with the logs"""
+        start = monotonic.monotonic()
+        done = False
+        while not done:
+            done = self.tail_done.wait(TAIL_INTERVAL)
+            for path in sorted(glob.glob(self.tail_log_file + '*')):
+                try:
+                    self.tail_log_file_data(path)
+                except Exception:
+                    pass
+        # Process any trailing lines that didn't end with a newline
+        for path in self.tail_buffer:
+            if self.tail_buffer[path]:
+                self.process_log_lines(path, [self.tail_buffer[path]])
+        self.tail_buffer = {}
+        elapsed = monotonic.monotonic() - start
+        logging.debug("%0.3f s tailing %s (%d lines)", elapsed, self.tail_log_file,
+                      self.tail_lines)
+
+    def tail_log_file_data(self, path):
+        """Process any complete lines that were added to the given log file"""
+        size = os.path.getsize(path)
+        pos = self.tail_pos[path] if path in self.tail_pos else 0
+        if size > pos:
+            with open(path, 'rb') as f_in:
+                f_in.seek(pos)
+                data = f_in.read(size - pos)
+            self.tail_pos[path] = pos + len(data)
+            if path in self.tail_buffer:
+                data = self.tail_buffer[path] + data
+            lines = data.split('\n')
+            self.tail_buffer[path] = lines.pop()
+            self.process_log_lines(path, lines)
+
+    def process_log_lines(self, path, lines):
+        """Process lines from one of the logs being tailed. The logs are read a chunk at a
+        time so the state for multi-line sequences is kept separately for each file."""
+        http = self.http
+        if path in self.tail_state:
+            http.update(self.tail_state[path])
+        for line in lines:
+            self.process_log_line(line.rstrip("\r"))
+        self.tail_lines += len(lines)
+        state = {}
+        for key in LINE_STATE_KEYS:
+            if key in http:
+                state[key] = http[key]
+                del http[key]
+        self.tail_state[path] = state
+
     def finish_processing(self):
         """Do the post-parse processing"""
         logging.debug('Processing network requests from moz log')
@@ -76,17 +219,19 @@ class FirefoxLogParser(object):
         if len(requests):
             requests.sort(key=lambda x: x['start'] if 'start' in x else 0)
         # Attach the DNS lookups to the first request on each domain
+        first_requests = {}
+        for request in requests:
+            host = urlparse.urlsplit(request['url']).hostname
+            if host not in first_requests:
+                first_requests[host] = request
         for domain in self.dns:
-            if 'claimed' not in self.dns[domain]:
-                for request in requests:
-                    host = urlparse.urlsplit(request['url']).hostname
-                    if host == domain:
-                        self.dns[domain]['claimed'] = True
-                        if 'start' in self.dns[domain]:
-                            request['dns_start'] = self.dns[domain]['start']
-                        if 'end' in self.dns[domain]:
-                            request['dns_end'] = self.dns[domain]['end']
-                        break
+            if 'claimed' not in self.dns[domain] and domain in first_requests:
+                request = first_requests[domain]
+                self.dns[domain]['claimed'] = True
+                if 'start' in self.dns[domain]:
+                    request['dns_start'] = self.dns[domain]['start']
+                if 'end' in self.dns[domain]:
+                    request['dns_end'] = self.dns[domain]['end']
         # Attach the socket connect events to the first request on each connection
         for request in requests:
             if 'connection' in request and request['connection'] in self.http['connections']:
@@ -165,228 +310,341 @@ class FirefoxLogParser(object):
 
     def main_thread_http_entry(self, msg):
         """Process a single HTTP log line from the main thread"""
-        # V/nsHttp HttpBaseChannel::Init [this=c30d000]
-        if msg['message'].startswith('HttpBaseChannel::Init'):
-            match = re.search(r'^HttpBaseChannel::Init \[this=(?P<channel>[\w\d]+)]',
-                              msg['message'])
-            if match:
-                self.http['current_channel'] = match.groupdict().get('channel')
-        # D/nsHttp nsHttpChannel::Init [this=c30d000]
-        elif 'current_channel' in self.http and msg['message'].startswith('nsHttpChannel::Init'):
-            del self.http['current_channel']
+        message = msg['message']
+        space = message.find(' ')
+        token = message[:space] if space >= 0 else message
+        if token in self.main_thread_http_handlers:
+            self.main_thread_http_handlers[token](msg)
         # V/nsHttp uri=http://www.webpagetest.org/?bare=1
-        elif 'current_channel' in self.http and  msg['message'].startswith('uri='):
-            match = re.search(r'^uri=(?P<url>[^ \r\n]+)', msg['message'])
+        elif 'current_channel' in self.http and message.startswith('uri='):
+            match = URI_RE.match(message)
             if match:
-                self.http['channels'][self.http['current_channel']] = \
-                        match.groupdict().get('url')
-        # D/nsHttp nsHttpChannel c30d000 created nsHttpTransaction c138c00
-        elif msg['message'].startswith('nsHttpChannel') and \
-                msg['message'].find(' created nsHttpTransaction ') > -1:
-            match = re.search(r'^nsHttpChannel (?P<channel>[\w\d]+) created '\
-                              r'nsHttpTransaction (?P<id>[\w\d]+)', msg['message'])
-            if match:
-                channel = match.groupdict().get('channel')
-                if channel in self.http['channels']:
-                    url = self.http['channels'][channel]
-                    del self.http['channels'][channel]
-                    trans_id = match.groupdict().get('id')
-                    # If there is already an existing transaction with the same ID,
-                    # move it to a unique ID.
-                    if trans_id in self.http['requests']:
-                        tmp_request = self.http['requests'][trans_id]
-                        del self.http['requests'][trans_id]
-                        self.unique_id += 1
-                        new_id = '{0}.{1:d}'.format(trans_id, self.unique_id)
-                        self.http['requests'][new_id] = tmp_request
-                    self.http['requests'][trans_id] = {'url': url,
-                                                       'request_headers': [],
-                                                       'response_headers': [],
-                                                       'status': None,
-                                                       'bytes_in': 0}
-        # D/nsHttp nsHttpTransaction::Init [this=c138c00 caps=21]
-        elif msg['message'].startswith('nsHttpTransaction::Init '):
-            match = re.search(r'^nsHttpTransaction::Init \[this=(?P<id>[\w\d]+)', msg['message'])
-            if match:
-                trans_id = match.groupdict().get('id')
-                self.http['current_transaction'] = trans_id
-        # D/nsHttp nsHttpTransaction c138c00 SetRequestContext c15ba00
-        elif 'current_transaction' in self.http and \
-                msg['message'].startswith('nsHttpTransaction ') and \
+                self.http['channels'][self.http['current_channel']] = match.group('url')
+
+    def http_base_channel_init(self, msg):
+        """V/nsHttp HttpBaseChannel::Init [this=c30d000]"""
+        match = HTTP_BASE_CHANNEL_INIT_RE.match(msg['message'])
+        if match:
+            self.http['current_channel'] = match.group('channel')
+
+    def http_channel_init(self, msg):
+        """D/nsHttp nsHttpChannel::Init [this=c30d000]"""
+        if 'current_channel' in self.http:
+            del self.http['current_channel']
+
+    def http_channel_created(self, msg):
+        """D/nsHttp nsHttpChannel c30d000 created nsHttpTransaction c138c00"""
+        match = HTTP_CHANNEL_CREATED_RE.match(msg['message'])
+        if match:
+            channel = match.group('channel')
+            if channel in self.http['channels']:
+                url = self.http['channels'][channel]
+                del self.http['channels'][channel]
+                trans_id = match.group('id')
+                # If there is already an existing transaction with the same ID,
+                # move it to a unique ID.
+                if trans_id in self.http['requests']:
+                    tmp_request = self.http['requests'][trans_id]
+                    del self.http['requests'][trans_id]
+                    self.unique_id += 1
+                    new_id = '{0}.{1:d}'.format(trans_id, self.unique_id)
+                    self.http['requests'][new_id] = tmp_request
+                self.http['requests'][trans_id] = {'url': url,
+                                                   'request_headers': [],
+                                                   'response_headers': [],
+                                                   'status': None,
+                                                   'bytes_in': 0}
+
+    def http_transaction_init(self, msg):
+        """D/nsHttp nsHttpTransaction::Init [this=c138c00 caps=21]"""
+        match = HTTP_TRANSACTION_INIT_RE.match(msg['message'])
+        if match:
+            self.http['current_transaction'] = match.group('id')
+
+    def http_transaction_request_context(self, msg):
+        """D/nsHttp nsHttpTransaction c138c00 SetRequestContext c15ba00"""
+        if 'current_transaction' in self.http and \
                 msg['message'].find(' SetRequestContext  ') > -1:
             del self.http['current_transaction']
-        # I/nsHttp http request [
-        elif 'current_transaction' in self.http and msg['message'] == 'http request [':
+
+    def http_request_start(self, msg):
+        """I/nsHttp http request ["""
+        if 'current_transaction' in self.http and msg['message'] == 'http request [':
             self.http['request_headers'] = self.http['current_transaction']
-        elif 'request_headers' in self.http and msg['message'] == ']':
+
+    def http_request_end(self, msg):
+        """I/nsHttp ]"""
+        if 'request_headers' in self.http:
             del self.http['request_headers']
-        # Individual request headers
-        elif 'request_headers' in self.http and msg['message'][0:2] == '  ':
+
+    def http_request_header(self, msg):
+        """Individual request headers"""
+        if 'request_headers' in self.http and msg['message'][0:2] == '  ':
             trans_id = self.http['request_headers']
             if trans_id in self.http['requests']:
                 self.http['requests'][trans_id]['request_headers'].append(msg['message'][2:])
 
     def socket_thread_http_entry(self, msg):
         """Process a single HTTP log line from the socket thread"""
-        # V/nsHttp nsHttpConnection::Activate [this=ed6c450 trans=143f3c00 caps=21]
-        if msg['message'].startswith('nsHttpConnection::Activate '):
-            match = re.search(r'^nsHttpConnection::Activate \['
-                              r'this=(?P<connection>[\w\d]+) '
-                              r'trans=(?P<id>[\w\d]+)', msg['message'])
-            if match:
-                connection = match.groupdict().get('connection')
-                trans_id = match.groupdict().get('id')
-                if trans_id in self.http['requests']:
-                    self.http['requests'][trans_id]['connection'] = connection
-        # V/nsHttp nsHttpConnection::Init this=ed6c450
-        elif msg['message'].startswith('nsHttpConnection::Init ') and \
-                'current_socket' in self.http:
-            match = re.search(r'^nsHttpConnection::Init '
-                              r'this=(?P<connection>[\w\d]+)', msg['message'])
+        message = msg['message']
+        space = message.find(' ')
+        if space >= 0:
+            token = message[:space]
+            if token in self.socket_thread_http_handlers:
+                self.socket_thread_http_handlers[token](msg)
+
+    def http_connection_activate(self, msg):
+        """V/nsHttp nsHttpConnection::Activate [this=ed6c450 trans=143f3c00 caps=21]"""
+        match = HTTP_CONNECTION_ACTIVATE_RE.match(msg['message'])
+        if match:
+            trans_id = match.group('id')
+            if trans_id in self.http['requests']:
+                self.http['requests'][trans_id]['connection'] = match.group('connection')
+
+    def http_connection_init(self, msg):
+        """V/nsHttp nsHttpConnection::Init this=ed6c450"""
+        if 'current_socket' in self.http:
+            match = HTTP_CONNECTION_INIT_RE.match(msg['message'])
             if match:
-                connection = match.groupdict().get('connection')
+                connection = match.group('connection')
                 socket = self.http['current_socket']
                 self.http['connections'][connection] = {'socket': socket}
             del self.http['current_socket']
-        elif msg['message'].startswith('nsHttpConnection::SetupSSL '):
-            match = re.search(r'^nsHttpConnection::SetupSSL (?P<connection>[\w\d]+)',
-                              msg['message'])
-            if match:
-                connection = match.groupdict().get('connection')
-                if connection in self.http['connections']:
-                    if 'ssl_start' not in self.http['connections'][connection]:
-                        self.http['connections'][connection]['ssl_start'] = msg['timestamp']
-        elif msg['message'].startswith('nsHttpConnection::EnsureNPNComplete '):
-            match = re.search(r'^nsHttpConnection::EnsureNPNComplete (?P<connection>[\w\d]+)',
-                              msg['message'])
-            if match:
-                connection = match.groupdict().get('connection')
-                if connection in self.http['connections']:
-                    if 'ssl_start' in self.http['connections'][connection]:
-                        self.http['connections'][connection]['ssl_end'] = msg['timestamp']
-        elif msg['message'].startswith('nsHttpTransaction::OnTransportStatus ') and \
-                msg['message'].find(' SENDING_TO ') > -1:
-            match = re.search(r'^nsHttpTransaction::OnTransportStatus (?P<id>[\w\d]+) SENDING_TO ',
-                              msg['message'])
-            if match:
-                trans_id = match.groupdict().get('id')
-                if trans_id in self.http['requests'] and \
-                        'start' not in self.http['requests'][trans_id]:
-                    self.http['requests'][trans_id]['start'] = msg['timestamp']
-        elif msg['message'].startswith('nsHttpTransaction::OnSocketStatus ') and \
-                msg['message'].find(' status=804b0005 progress=') > -1:
-            match = re.search(r'^nsHttpTransaction::OnSocketStatus '\
-                              r'\[this=(?P<id>[\w\d]+) status=804b0005 progress=(?P<bytes>[\d+]+)',
-                              msg['message'])
-            if match:
-                trans_id = match.groupdict().get('id')
-                byte_count = int(match.groupdict().get('bytes'))
-                if byte_count > 0 and trans_id in self.http['requests'] and \
-                        'start' not in self.http['requests'][trans_id]:
-                    self.http['requests'][trans_id]['start'] = msg['timestamp']
-        elif msg['message'].startswith('nsHttpTransaction::ProcessData '):
-            match = re.search(r'^nsHttpTransaction::ProcessData \[this=(?P<id>[\w\d]+)',
-                              msg['message'])
-            if match:
-                trans_id = match.groupdict().get('id')
-                self.http['current_socket_transaction'] = trans_id
-        elif msg['message'].startswith('nsHttpTransaction::HandleContent '):
-            if 'current_socket_transaction' in self.http:
-                del self.http['current_socket_transaction']
-            match = re.search(r'^nsHttpTransaction::HandleContent \['
-                              r'this=(?P<id>[\w\d]+) '
-                              r'count=(?P<len>[\d]+) read=', msg['message'])
-            if match:
-                trans_id = match.groupdict().get('id')
-                if trans_id in self.http['requests']:
-                    bytes_in = int(match.groupdict().get('len'))
-                    if 'first_byte' not in self.http['requests'][trans_id]:
-                        self.http['requests'][trans_id]['first_byte'] = msg['timestamp']
-                    if 'end' not in self.http['requests'][trans_id] or \
-                            msg['timestamp'] > self.http['requests'][trans_id]['end']:
-                        self.http['requests'][trans_id]['end'] = msg['timestamp']
-                    self.http['requests'][trans_id]['bytes_in'] += bytes_in
-        elif 'current_socket_transaction' in self.http and \
-                msg['message'].startswith('nsHttpTransaction::ParseLine '):
+
+    def http_connection_setup_ssl(self, msg):
+        """V/nsHttp nsHttpConnection::SetupSSL ed6c450"""
+        match = HTTP_CONNECTION_SETUP_SSL_RE.match(msg['message'])
+        if match:
+            connection = match.group('connection')
+            if connection in self.http['connections']:
+                if 'ssl_start' not in self.http['connections'][connection]:
+                    self.http['connections'][connection]['ssl_start'] = msg['timestamp']
+
+    def http_connection_npn_complete(self, msg):
+        """V/nsHttp nsHttpConnection::EnsureNPNComplete ed6c450"""
+        match = HTTP_CONNECTION_NPN_COMPLETE_RE.match(msg['message'])
+        if match:
+            connection = match.group('connection')
+            if connection in self.http['connections']:
+                if 'ssl_start' in self.http['connections'][connection]:
+                    self.http['connections'][connection]['ssl_end'] = msg['timestamp']
+
+    def http_transaction_transport_status(self, msg):
+        """V/nsHttp nsHttpTransaction::OnTransportStatus 143f3c00 SENDING_TO 804b0005"""
+        match = HTTP_TRANSACTION_SENDING_RE.match(msg['message'])
+        if match:
+            trans_id = match.group('id')
+            if trans_id in self.http['requests'] and \
+                    'start' not in self.http['requests'][trans_id]:
+                self.http['requests'][trans_id]['start'] = msg['timestamp']
+
+    def http_transaction_socket_status(self, msg):
+        """V/nsHttp nsHttpTransaction::OnSocketStatus [this=143f3c00 status=804b0005 progress=100]"""
+        match = HTTP_TRANSACTION_SOCKET_STATUS_RE.match(msg['message'])
+        if match:
+            trans_id = match.group('id')
+            byte_count = int(match.group('bytes'))
+            if byte_count > 0 and trans_id in self.http['requests'] and \
+                    'start' not in self.http['requests'][trans_id]:
+                self.http['requests'][trans_id]['start'] = msg['timestamp']
+
+    def http_transaction_process_data(self, msg):
+        """V/nsHttp nsHttpTransaction::ProcessData [this=143f3c00 count=400]"""
+        match = HTTP_TRANSACTION_PROCESS_DATA_RE.match(msg['message'])
+        if match:
+            self.http['current_socket_transaction'] = match.group('id')
+
+    def http_transaction_handle_content(self, msg):
+        """V/nsHttp nsHttpTransaction::HandleContent [this=143f3c00 count=1000 read=1000]"""
+        if 'current_socket_transaction' in self.http:
+            del self.http['current_socket_transaction']
+        match = HTTP_TRANSACTION_HANDLE_CONTENT_RE.match(msg['message'])
+        if match:
+            trans_id = match.group('id')
+            if trans_id in self.http['requests']:
+                bytes_in = int(match.group('len'))
+                self.update_response_time(self.http['requests'][trans_id], msg['timestamp'])
+                self.http['requests'][trans_id]['bytes_in'] += bytes_in
+
+    def http_transaction_parse_line(self, msg):
+        """V/nsHttp nsHttpTransaction::ParseLine [Content-Type: text/html]"""
+        if 'current_socket_transaction' in self.http:
             trans_id = self.http['current_socket_transaction']
             if trans_id in self.http['requests']:
-                if trans_id in self.http['requests']:
-                    if 'first_byte' not in self.http['requests'][trans_id]:
-                        self.http['requests'][trans_id]['first_byte'] = msg['timestamp']
-                    if 'end' not in self.http['requests'][trans_id] or \
-                            msg['timestamp'] > self.http['requests'][trans_id]['end']:
-                        self.http['requests'][trans_id]['end'] = msg['timestamp']
-                match = re.search(r'^nsHttpTransaction::ParseLine \[(?P<line>.*)\]\s*$',
-                                  msg['message'])
+                self.update_response_time(self.http['requests'][trans_id], msg['timestamp'])
+                match = HTTP_TRANSACTION_PARSE_LINE_RE.match(msg['message'])
                 if match:
-                    line = match.groupdict().get('line')
+                    line = match.group('line')
                     self.http['requests'][trans_id]['response_headers'].append(line)
-        elif 'current_socket_transaction' in self.http and \
+
+    def http_status_line(self, msg):
+        """V/nsHttp Have status line [version=11 status=200 statusText=OK]"""
+        if 'current_socket_transaction' in self.http and \
                 msg['message'].startswith('Have status line '):
             trans_id = self.http['current_socket_transaction']
             if trans_id in self.http['requests']:
-                if trans_id in self.http['requests']:
-                    if 'first_byte' not in self.http['requests'][trans_id]:
-                        self.http['requests'][trans_id]['first_byte'] = msg['timestamp']
-                    if 'end' not in self.http['requests'][trans_id] or \
-                            msg['timestamp'] > self.http['requests'][trans_id]['end']:
-                        self.http['requests'][trans_id]['end'] = msg['timestamp']
-                match = re.search(r'^Have status line \[[^\]]*status=(?P<status>\d+)',
-                                  msg['message'])
+                self.update_response_time(self.http['requests'][trans_id], msg['timestamp'])
+                match = STATUS_LINE_RE.match(msg['message'])
                 if match:
-                    status = int(match.groupdict().get('status'))
+                    status = int(match.group('status'))
                     self.http['requests'][trans_id]['status'] = status
 
+    def update_response_time(self, request, timestamp):
+        """Extend the first byte and end times of the response for a new line of response data"""
+        if 'first_byte' not in request:
+            request['first_byte'] = timestamp
+        if 'end' not in request or timestamp > request['end']:
+            request['end'] = timestamp
+
     def socket_transport_entry(self, msg):
         """Process a single socket transport line"""
-        # nsSocketTransport::Init [this=143f4000 host=www.webpagetest.org:80 origin=www.webpagetest.org:80 proxy=:0]
-        if msg['message'].startswith('nsSocketTransport::Init '):
-            match = re.search(r'^nsSocketTransport::Init \['
-                              r'this=(?P<socket>[\w\d]+) '
-                              r'host=(?P<host>[^ :]+):(?P<port>\d+)', msg['message'])
-            if match:
-                socket = match.groupdict().get('socket')
-                host = match.groupdict().get('host')
-                port = match.groupdict().get('port')
-                self.http['sockets'][socket] = {'host': host, 'port': port}
-        # nsSocketTransport::SendStatus [this=143f4000 status=804b0007]
-        elif msg['message'].startswith('nsSocketTransport::SendStatus '):
-            match = re.search(r'^nsSocketTransport::SendStatus \['
-                              r'this=(?P<socket>[\w\d]+) '
-                              r'status=(?P<status>[\w\d]+)', msg['message'])
-            if match:
-                socket = match.groupdict().get('socket')
-                status = match.groupdict().get('status')
-                if status == '804b0007':
-                    if socket not in self.http['sockets']:
-                        self.http['sockets'][socket] = {}
-                    if 'start' not in self.http['sockets'][socket]:
-                        self.http['sockets'][socket]['start'] = msg['timestamp']
-        # nsSocketTransport::OnSocketReady [this=143f4000 outFlags=2]
-        elif msg['message'].startswith('nsSocketTransport::OnSocketReady '):
-            match = re.search(r'^nsSocketTransport::OnSocketReady \['
-                              r'this=(?P<socket>[\w\d]+) ', msg['message'])
-            if match:
-                socket = match.groupdict().get('socket')
-                self.http['current_socket'] = socket
-                if socket in self.http['sockets'] and 'end' not in self.http['sockets'][socket]:
-                    self.http['sockets'][socket]['end'] = msg['timestamp']
+        message = msg['message']
+        space = message.find(' ')
+        if space >= 0:
+            token = message[:space]
+            if token in self.socket_transport_handlers:
+                self.socket_transport_handlers[token](msg)
+
+    def socket_init(self, msg):
+        """nsSocketTransport::Init [this=143f4000 host=www.webpagetest.org:80 origin=www.webpagetest.org:80 proxy=:0]"""
+        match = SOCKET_INIT_RE.match(msg['message'])
+        if match:
+            socket = match.group('socket')
+            host = match.group('host')
+            port = match.group('port')
+            self.http['sockets'][socket] = {'host': host, 'port': port}
+
+    def socket_send_status(self, msg):
+        """nsSocketTransport::SendStatus [this=143f4000 status=804b0007]"""
+        match = SOCKET_SEND_STATUS_RE.match(msg['message'])
+        if match:
+            socket = match.group('socket')
+            status = match.group('status')
+            if status == '804b0007':
+                if socket not in self.http['sockets']:
+                    self.http['sockets'][socket] = {}
+                if 'start' not in self.http['sockets'][socket]:
+                    self.http['sockets'][socket]['start'] = msg['timestamp']
+
+    def socket_ready(self, msg):
+        """nsSocketTransport::OnSocketReady [this=143f4000 outFlags=2]"""
+        match = SOCKET_READY_RE.match(msg['message'])
+        if match:
+            socket = match.group('socket')
+            self.http['current_socket'] = socket
+            if socket in self.http['sockets'] and 'end' not in self.http['sockets'][socket]:
+                self.http['sockets'][socket]['end'] = msg['timestamp']
 
     def dns_entry(self, msg):
         """Process a single DNS log line"""
         if msg['message'].find('Calling getaddrinfo') > -1:
-            match = re.search(r'Calling getaddrinfo for host \[(?P<host>[^\]]+)\]', msg['message'])
+            match = DNS_START_RE.search(msg['message'])
             if match:
-                hostname = match.groupdict().get('host')
+                hostname = match.group('host')
                 if hostname not in self.dns:
                     self.dns[hostname] = {'start': msg['timestamp']}
         elif msg['message'].find('lookup completed for host') > -1:
-            match = re.search(r'lookup completed for host \[(?P<host>[^\]]+)\]', msg['message'])
+            match = DNS_END_RE.search(msg['message'])
             if match:
-                hostname = match.groupdict().get('host')
+                hostname = match.group('host')
                 if hostname in self.dns and 'end' not in self.dns[hostname]:
                     self.dns[hostname]['end'] = msg['timestamp']
 
+def write_synthetic_log(log_file, request_count):
+    """Write a moz log for request_count https requests spread across 25 hosts and 40
+    connections. Returns the start time for the log."""
+    import datetime
+    import random
+    rand = random.Random(0)
+    timestamp = datetime.datetime(2017, 6, 27, 13, 46, 10, 48844)
+    start_time = timestamp.strftime('%Y-%m-%d %H:%M:%S.%f')
+    with open(log_file, 'w') as f_out:
+        for index in xrange(request_count):
+            channel = '{0:x}'.format(0x10000000 + index)
+            transaction = '{0:x}'.format(0x20000000 + index)
+            socket = '{0:x}'.format(0x30000000 + index % 40)
+            connection = '{0:x}'.format(0x40000000 + index % 40)
+            host = 'host{0:d}.example.com'.format(index % 25)
+            size = rand.randint(1000, 100000)
+            main = ('Main Thread', 'D', 'nsHttp')
+            dns = ('Socket Thread', 'D', 'nsHostResolver')
+            transport = ('Socket Thread', 'D', 'nsSocketTransport')
+            http = ('Socket Thread', 'V', 'nsHttp')
+            lines = [
+                (main, 'HttpBaseChannel::Init [this={0}]'.format(channel)),
+                (main, 'uri=https://{0}/resource{1:d}.js'.format(host, index)),
+                (main, 'nsHttpChannel::Init [this={0}]'.format(channel)),
+                (main, 'nsHttpChannel {0} created nsHttpTransaction {1}'.format(channel,
+                                                                                 transaction)),
+                (main, 'nsHttpTransaction::Init [this={0} caps=21]'.format(transaction)),
+                (main, 'http request ['),
+                (main, '  GET /resource{0:d}.js HTTP/1.1'.format(index)),
+                (main, '  Host: {0}'.format(host)),
+                (main, ']'),
+                (main, 'nsHttpTransaction {0} SetRequestContext  c15ba00'.format(transaction)),
+                (dns, 'Calling getaddrinfo for host [{0}].'.format(host)),
+                (dns, 'nsHostResolver::OnResolveHostComplete lookup completed for host '
+                      '[{0}]'.format(host)),
+                (transport, 'nsSocketTransport::Init [this={0} host={1}:443 origin={1}:443 '
+                            'proxy=:0]'.format(socket, host)),
+                (transport, 'nsSocketTransport::SendStatus [this={0} '
+                            'status=804b0007]'.format(socket)),
+                (transport, 'nsSocketTransport::OnSocketReady [this={0} '
+                            'outFlags=2]'.format(socket)),
+                (http, 'nsHttpConnection::Init this={0}'.format(connection)),
+                (http, 'nsHttpConnection::SetupSSL {0}'.format(connection)),
+                (http, 'nsHttpConnection::EnsureNPNComplete {0}'.format(connection)),
+                (http, 'nsHttpConnection::Activate [this={0} trans={1} '
+                       'caps=21]'.format(connection, transaction)),
+                (http, 'nsHttpTransaction::OnTransportStatus {0} SENDING_TO '
+                       '804b0005'.format(transaction)),
+                (http, 'nsHttpTransaction::OnSocketStatus [this={0} status=804b0005 '
+                       'progress=100]'.format(transaction)),
+                (http, 'nsHttpTransaction::ProcessData [this={0} count=400]'.format(transaction)),
+                (http, 'Have status line [version=11 status=200 statusText=OK]'),
+                (http, 'nsHttpTransaction::ParseLine [Content-Type: text/javascript]'),
+                (http, 'nsHttpTransaction::HandleContent [this={0} count={1:d} '
+                       'read={1:d}]'.format(transaction, size))]
+            for (thread, level, category), message in lines:
+                timestamp += datetime.timedelta(microseconds=rand.randint(10, 200))
+                f_out.write('{0} UTC - [{1}]: {2}/{3} {4}\n'.format(
+                    timestamp.strftime('%Y-%m-%d %H:%M:%S.%f'), thread, level, category,
+                    message))
+    return start_time
+
+def benchmark(log_file, start_time, request_count):
+    """Report the line throughput for parsing the given (recorded) moz logs or a
+    synthetic log for request_count requests if no logs are given"""
+    temp_dir = None
+    if log_file is None:
+        import tempfile
+        temp_dir = tempfile.mkdtemp()
+        log_file = os.path.join(temp_dir, 'moz.log')
+        start_time = write_synthetic_log(log_file, request_count)
+    lines = []
+    for path in sorted(glob.glob(log_file + '*')):
+        _, ext = os.path.splitext(path)
+        if ext.lower() == '.gz':
+            f_in = gzip.open(path, 'rb')
+        else:
+            f_in = open(path, 'r')
+        lines.extend(line.rstrip("\r\n") for line in f_in)
+        f_in.close()
+    parser = FirefoxLogParser()
+    parser.set_start_time(start_time)
+    start = monotonic.monotonic()
+    for line in lines:
+        parser.process_log_line(line)
+    parsed = monotonic.monotonic()
+    requests = parser.finish_processing()
+    end = monotonic.monotonic()
+    print "Parsed {0:d} lines in {1:0.3f} s ({2:0.0f} lines/s)".format(
+        len(lines), parsed - start, len(lines) / max(parsed - start, 0.000001))
+    print "Assembled {0:d} requests in {1:0.3f} s".format(len(requests), end - parsed)
+    if temp_dir is not None:
+        import shutil
+        shutil.rmtree(temp_dir)
+
 def main():
     """ Main entry-point when running on the command-line"""
     import argparse
@@ -399,6 +657,10 @@ def main():
     parser.add_argument('-s', '--start',
                         help="Start Time in UTC with microseconds YYYY-MM-DD HH:MM:SS.xxxxxx.")
     parser.add_argument('-o', '--out', help="Output requests json file.")
+    parser.add_argument('-b', '--benchmark', type=int, nargs='?', const=10000,
+                        help="Report the parsing throughput for the log instead (or for a "
+                             "synthetic log with the given number of requests, 10k default, "
+                             "if no log is specified).")
     options, _ = parser.parse_known_args()
 
     # Set up logging
@@ -414,9 +676,17 @@ def main():
     logging.basicConfig(
         level=log_level, format="%(asctime)s.%(msecs)03d - %(message)s", datefmt="%H:%M:%S")
 
+    if options.benchmark and not options.logfile:
+        benchmark(None, None, options.benchmark)
+        return
+
     if not options.logfile or not options.start:
         parser.error("Input devtools file or start time is not specified.")
 
+    if options.benchmark:
+        benchmark(options.logfile, options.start, options.benchmark)
+        return
+
     parser = FirefoxLogParser()
     requests = parser.process_logs(options.logfile, options.start)
     if options.out:
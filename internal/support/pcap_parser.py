@@ -0,0 +1,561 @@
+#!/usr/bin/env python
+"""
+Copyright 2016 Google Inc. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import array
+import bisect
+import gzip
+import json
+import logging
+import math
+import mmap
+import os
+import random
+import shutil
+import struct
+import threading
+import time
+
+# numpy speeds up the time slice accounting if it is installed
+try:
+  import numpy
+except BaseException:
+  numpy = None
+
+#Globals
+options = None
+
+# Pre-compiled header layouts
+FILE_HEADER = struct.Struct("=LHHLLLL")
+PACKET_HEADER = struct.Struct("=LLLL")
+COOKED_HEADER = struct.Struct("!HHHLL")
+PROTOCOL = struct.Struct("!H")
+IPV4_HEADER = struct.Struct("!BBHHHBBHLL")
+TCP_HEADER = struct.Struct("!HHLLB")
+UDP_HEADER = struct.Struct("!HHHH")
+BROADCAST_MAC = '\xff' * 6
+# Index of each direction in the packet_directions array
+DIRECTIONS = ['in', 'out', 'in_dup']
+DIRECTION_INDEX = dict((direction, index) for index, direction in enumerate(DIRECTIONS))
+# Size of the reads when compressing a capture
+COMPRESS_CHUNK_SIZE = 1024 * 1024
+
+
+########################################################################################################################
+#   Pcap processing
+########################################################################################################################
+class Pcap():
+  def __init__(self):
+    self.start_seconds = None
+    self.start_time = None
+    self.local_ethernet_mac = None
+    self.slices = {'in': [], 'out': [], 'in_dup': []}
+    self.bytes = {'in': 0, 'out': 0, 'in_dup': 0}
+    self.streams = {}
+    self.compressed = False
+    # time, byte count and direction index for every accounted packet
+    self.packet_times = array.array('d')
+    self.packet_bytes = array.array('l')
+    self.packet_directions = array.array('B')
+    return
+
+
+  def SaveStats(self, out):
+    file_name, ext = os.path.splitext(out)
+    if ext.lower() == '.gz':
+      f = gzip.open(out, 'wb')
+    else:
+      f = open(out, 'wb')
+    try:
+      result = {"bytes": self.bytes}
+      json.dump(result, f)
+      logging.info('Result stats written to {0}'.format(out))
+    except:
+      logging.critical('Error writing result stats to {0}'.format(out))
+    f.close()
+
+
+  def SaveDetails(self, out):
+    file_name, ext = os.path.splitext(out)
+    if ext.lower() == '.gz':
+      f = gzip.open(out, 'wb')
+    else:
+      f = open(out, 'wb')
+    try:
+      json.dump(self.slices, f)
+      logging.info('Result details written to {0}'.format(out))
+    except:
+      logging.critical('Error writing result details to {0}'.format(out))
+    f.close()
+
+
+  def Print(self):
+    global options
+    if options.json:
+      print(json.dumps(self.bytes, indent=2))
+    else:
+      print "Bytes Out: {0:d}".format(self.bytes['out'])
+      print "Bytes In:  {0:d}".format(self.bytes['in'])
+      print "Duplicate Bytes In:  {0:d}".format(self.bytes['in_dup'])
+
+
+  def Process(self, pcap):
+    f = None
+    data = None
+    self.__init__() #Reset state if called multiple times
+    try:
+      file_name, ext = os.path.splitext(pcap)
+      if ext.lower() == '.gz':
+        # Decompress the whole capture once and parse it in memory
+        f = gzip.open(pcap, 'rb')
+        data = f.read()
+      else:
+        f = open(pcap, 'rb')
+        try:
+          data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+          data = f.read()
+      self.ProcessData(data)
+    except:
+      logging.critical("Error processing pcap " + pcap)
+
+    if data is not None and not isinstance(data, str):
+      data.close()
+    if f is not None:
+      f.close()
+
+    return
+
+
+  def ProcessAndCompress(self, pcap, out):
+    """Process an uncompressed capture while it is gzipped to out on a worker thread.
+    Returns True if the compressed copy was written."""
+    self.__init__() #Reset state if called multiple times
+    compress_thread = threading.Thread(target=self.Compress, args=(pcap, out))
+    compress_thread.daemon = True
+    compress_thread.start()
+    try:
+      with open(pcap, 'rb') as f:
+        try:
+          data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+          data = f.read()
+        try:
+          self.ProcessData(data)
+        finally:
+          if not isinstance(data, str):
+            data.close()
+    except:
+      logging.critical("Error processing pcap " + pcap)
+    compress_thread.join()
+    return self.compressed
+
+
+  def Compress(self, pcap, out):
+    """gzip the raw capture (zlib releases the GIL so this overlaps the parsing)"""
+    try:
+      with open(pcap, 'rb') as f_in:
+        with gzip.open(out, 'wb', 7) as f_out:
+          shutil.copyfileobj(f_in, f_out, COMPRESS_CHUNK_SIZE)
+      self.compressed = True
+    except Exception:
+      logging.exception("Error compressing pcap " + pcap)
+
+
+  def ProcessData(self, data):
+    """Process a complete raw capture (anything supporting the buffer interface)"""
+    if len(data) < FILE_HEADER.size:
+      logging.critical("Invalid pcap file")
+      return
+    # File header:
+    # Magic Number - 4 bytes - 0xa1b2c3d4
+    # Major Version - 2 bytes
+    # Minor version - 2 bytes
+    # Tz offset - 4 bytes (always 0)
+    # Timestamp accuracy - 4 bytes (always 0)
+    # Snapshot length - 4 bytes
+    # Link layer header type - 4 bytes
+    #
+    # unpack constants:
+    # L - unsigned long (4 byte)
+    # H - unsigned short (2 byte)
+    # B - unsigned char (1 byte int)
+    file_header = FILE_HEADER.unpack_from(data, 0)
+
+    # ignore byte order reversals for now
+    if file_header[0] != 0xa1b2c3d4:
+      logging.critical("Invalid pcap file")
+      return
+    self.linktype = file_header[6]
+    if self.linktype == 1:
+      self.linklen = 12
+    elif self.linktype == 113:
+      self.linklen = 14
+    else:
+      logging.critical("Unknown link layer header type: {0:d}".format(self.linktype))
+      return
+
+    # Packet header:
+    # Time stamp (seconds) - 4 bytes
+    # Time stamp (microseconds value) - 4 bytes
+    # Captured data length - 4 bytes
+    # Original length - 4 bytes
+    data_length = len(data)
+    offset = FILE_HEADER.size
+    while offset + PACKET_HEADER.size <= data_length:
+      (seconds, useconds, captured_length, packet_length) = PACKET_HEADER.unpack_from(data, offset)
+      offset += PACKET_HEADER.size
+      if offset + captured_length > data_length:
+        break
+      if self.start_seconds is None:
+        self.start_seconds = seconds
+      seconds -= self.start_seconds
+      if packet_length and captured_length <= packet_length and captured_length >= self.linklen + 2:
+        packet_time = float(seconds) + float(useconds) / 1000000.0
+        try:
+          self.ProcessPacket(data, offset, offset + captured_length, packet_time, packet_length)
+        except Exception:
+          logging.debug("Error processing packet at {0:0.6f}".format(packet_time), exc_info=True)
+      offset += captured_length
+
+    self.CalculateSlices()
+
+
+  def ProcessPacket(self, data, offset, end, packet_time, packet_length):
+    """Parse the headers of the packet in data[offset:end] and do the accounting for it"""
+    valid = False
+    direction = None
+    ethernet_src = None
+    flow = None
+    tcp_sequence = None
+    tcp_payload_length = 0
+    if self.linktype == 1:
+      # Ethernet:
+      # dst: 6 bytes
+      # src: 6 bytes
+      # Ignore broadcast traffic
+      ethernet_src = data[offset + 6:offset + 12]
+      if data[offset:offset + 6] != BROADCAST_MAC:
+        valid = True
+
+    elif self.linktype == 113:
+      # Linux cooked capture
+      # Packet Type: 2 bytes
+      # aprhrd type: 2 bytes
+      # Address length: 2 bytes
+      # Address part 1: 4 bytes
+      # Address part 2: 4 bytes
+      packet_type = COOKED_HEADER.unpack_from(data, offset)[0]
+      if packet_type == 0:
+        valid = True
+        direction = 'in'
+      if packet_type == 4:
+        valid = True
+        direction = 'out'
+
+    protocol = PROTOCOL.unpack_from(data, offset + self.linklen)[0]
+    if valid and protocol == 0x800: # Only handle IPv4 for now
+      # IP Header:
+      # Version/len: 1 Byte (4 bits each)
+      # dscp/ecn: 1 Byte
+      # Total Length: 2 Bytes
+      # Identification: 2 Bytes
+      # Flags/Fragment: 2 Bytes
+      # TTL: 1 Byte
+      # Protocol: 1 Byte
+      # Header Checksum: 2 Bytes
+      # Source Address: 4 Bytes
+      # Dest Address: 4 Bytes
+      ip_offset = offset + self.linklen + 2
+      if end - ip_offset > 20:
+        ip_header = IPV4_HEADER.unpack_from(data, ip_offset)
+        header_length = (ip_header[0] & 0x0F) * 4
+        payload_length = ip_header[2] - header_length
+        ip_protocol = ip_header[6]
+        if payload_length > 0:
+          payload_offset = ip_offset + header_length
+          if ip_protocol == 6:
+            # TCP Packet Header
+            # Source Port: 2 bytes
+            # Dest Port: 2 bytes
+            # Sequence number: 4 bytes
+            # Ack number: 4 bytes
+            # Header len: 1 byte (masked)
+            if end - payload_offset >= TCP_HEADER.size:
+              tcp_header = TCP_HEADER.unpack_from(data, payload_offset)
+              tcp_payload_length = payload_length - (tcp_header[4] >> 4 & 0x0F) * 4
+              tcp_sequence = tcp_header[2]
+              flow = (ip_header[8], tcp_header[0], ip_header[9], tcp_header[1])
+              # If DNS didn't trigger a start yet and we see outbound TCP traffic, use that to identify the
+              # starting point. Outbound can be explicit (if we have a cooked capture like android) or implicit if
+              # dest port is 80, 443, 1080.
+              if self.start_time is None:
+                dst_port = tcp_header[1]
+                if direction == 'out' or dst_port == 80 or dst_port == 443 or dst_port == 1080:
+                  self.start_time = packet_time
+                  if ethernet_src is not None and self.local_ethernet_mac is None:
+                    self.local_ethernet_mac = ethernet_src
+            else:
+              valid = False
+          elif ip_protocol == 17:
+            # UDP Packet header:
+            # Source Port: 2 bytes
+            # Dest Port: 2 bytes
+            # Length (including header): 2 bytes
+            # Checksum: 2 bytes
+            if end - payload_offset > UDP_HEADER.size:
+              udp_header = UDP_HEADER.unpack_from(data, payload_offset)
+              if udp_header[1] == 53:
+                # DNS request
+                if ethernet_src is not None and self.local_ethernet_mac is None:
+                  self.local_ethernet_mac = ethernet_src
+                if self.start_time is None:
+                  self.start_time = packet_time
+            else:
+              valid = False
+          else:
+            valid = False
+      else:
+        valid = False
+
+    if valid and self.start_time:
+      if self.local_ethernet_mac is not None:
+        if ethernet_src == self.local_ethernet_mac:
+          direction = 'out'
+        else:
+          direction = 'in'
+      if direction is not None:
+        self.ProcessPacketInfo(packet_time, packet_length, direction, flow, tcp_sequence, tcp_payload_length)
+
+    return
+
+
+  def ProcessPacketInfo(self, packet_time, length, direction, flow, tcp_sequence, tcp_payload_length):
+    # Record the packet for the time slices (bucketed all at once at the end)
+    self.bytes[direction] += length
+    self.packet_times.append(packet_time)
+    self.packet_bytes.append(length)
+    self.packet_directions.append(DIRECTION_INDEX[direction])
+
+    # If it is a tcp stream, keep track of the sequence numbers and see if any of the data overlaps with previous
+    # ranges on the same connection.
+    if direction == 'in' and flow is not None and tcp_payload_length > 0:
+      stream = flow
+      data_len = tcp_payload_length
+      if stream not in self.streams:
+        self.streams[stream] = StreamRanges()
+      stream_start = self.streams[stream].Unwrap(tcp_sequence)
+      stream_end = stream_start + data_len
+
+      # Find the largest overlap with an existing packet on the stream to see if the data is duplicate
+      # (a spurious retransmit) and keep track of the current packet byte range
+      duplicate_bytes = self.streams[stream].Add(stream_start, stream_end)
+
+      # If the entire payload is duplicate then the whole packet is duplicate
+      if duplicate_bytes >= data_len:
+        duplicate_bytes = length
+
+      if duplicate_bytes > 0:
+        self.bytes['in_dup'] += duplicate_bytes
+        self.packet_times.append(packet_time)
+        self.packet_bytes.append(duplicate_bytes)
+        self.packet_directions.append(DIRECTION_INDEX['in_dup'])
+
+
+  def CalculateSlices(self):
+    """Bucket the recorded packet bytes into the 100ms time slices (all directions are the same size)"""
+    self.slices = {'in': [], 'out': [], 'in_dup': []}
+    if not len(self.packet_times):
+      return
+    if numpy is not None:
+      elapsed = numpy.frombuffer(self.packet_times, dtype=numpy.float64) - self.start_time
+      buckets = numpy.maximum(numpy.floor(elapsed * 10), 0).astype(numpy.int64)
+      directions = numpy.frombuffer(self.packet_directions, dtype=numpy.uint8)
+      packet_bytes = numpy.array(self.packet_bytes, dtype=numpy.int64)
+      count = int(buckets.max()) + 1
+      for index, direction in enumerate(DIRECTIONS):
+        selected = directions == index
+        totals = numpy.zeros(count, dtype=numpy.int64)
+        numpy.add.at(totals, buckets[selected], packet_bytes[selected])
+        self.slices[direction] = totals.tolist()
+    else:
+      buckets = [max(0, int(math.floor((packet_time - self.start_time) * 10))) for packet_time in self.packet_times]
+      count = max(buckets) + 1
+      totals = [[0] * count for _ in DIRECTIONS]
+      for bucket, direction, length in zip(buckets, self.packet_directions, self.packet_bytes):
+        totals[direction][bucket] += length
+      for index, direction in enumerate(DIRECTIONS):
+        self.slices[direction] = totals[index]
+
+
+########################################################################################################################
+#   TCP stream byte ranges
+########################################################################################################################
+class StreamRanges():
+  """Byte ranges seen on a TCP stream, sorted by (unwrapped) sequence number"""
+  def __init__(self):
+    self.starts = []
+    self.ends = []
+    self.max_length = 0
+    self.last_sequence = None
+
+
+  def Unwrap(self, sequence):
+    """Map a 32-bit sequence number into a continuous space (handles wraparound)"""
+    if self.last_sequence is not None:
+      # Use the 4GB window closest to the previous sequence number
+      sequence += self.last_sequence - (self.last_sequence & 0xFFFFFFFF)
+      if sequence - self.last_sequence > 0x80000000:
+        sequence -= 0x100000000
+      elif self.last_sequence - sequence > 0x80000000:
+        sequence += 0x100000000
+    self.last_sequence = sequence
+    return sequence
+
+
+  def Add(self, start, end):
+    """Add the [start, end) range and return the largest overlap it had with any single previous range"""
+    duplicate_bytes = 0
+    # Only ranges that start within max_length before the new range can overlap it
+    first = bisect.bisect_right(self.starts, start - self.max_length)
+    last = bisect.bisect_left(self.starts, end)
+    for index in xrange(first, last):
+      overlap = min(self.ends[index], end) - max(self.starts[index], start)
+      if overlap > duplicate_bytes:
+        duplicate_bytes = overlap
+
+    # A range that is entirely inside an existing one can never have a larger overlap than it so it doesn't need
+    # to be kept
+    length = end - start
+    if duplicate_bytes < length:
+      index = bisect.bisect_right(self.starts, start)
+      self.starts.insert(index, start)
+      self.ends.insert(index, end)
+      if length > self.max_length:
+        self.max_length = length
+    return duplicate_bytes
+
+
+########################################################################################################################
+#   Benchmark
+########################################################################################################################
+def WriteSyntheticCapture(out, packet_count):
+  """Write a Linux cooked capture of a single download with packet_count inbound segments and ~1% retransmits"""
+  random.seed(0)
+  mss = 1448
+  with open(out, 'wb') as f:
+    f.write(struct.pack("=LHHLLLL", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 113))
+
+    def WritePacket(packet_time, direction, sequence, payload_length):
+      ip_header = struct.pack("!BBHHHBBHLL", 0x45, 0, 40 + payload_length, 0, 0, 64, 6, 0, 0x0A000001, 0x0A000002)
+      if direction == 'out':
+        tcp_header = struct.pack("!HHLLBBHHH", 40000, 443, sequence, 0, 0x50, 0x10, 65535, 0, 0)
+      else:
+        tcp_header = struct.pack("!HHLLBBHHH", 443, 40000, sequence, 0, 0x50, 0x10, 65535, 0, 0)
+      packet_data = struct.pack("!HHHLL", 4 if direction == 'out' else 0, 1, 6, 0, 0) +\
+          struct.pack("!H", 0x800) + ip_header + tcp_header
+      seconds = int(packet_time)
+      useconds = int((packet_time - seconds) * 1000000)
+      f.write(struct.pack("=LLLL", seconds, useconds, len(packet_data), len(packet_data) + payload_length))
+      f.write(packet_data)
+
+    # An inbound packet before the first outbound one so the test start time isn't zero
+    WritePacket(999.0, 'in', 0, 0)
+    packet_time = 1000.0
+    WritePacket(packet_time, 'out', 0, 0)
+    # Start close to the top of the sequence space so the download wraps around
+    sequence = 0xFFFFFFFF - mss * (packet_count / 2)
+    for index in xrange(packet_count):
+      packet_time += 0.0001
+      if index and random.random() < 0.01:
+        # retransmit one of the recent segments
+        offset = random.randint(1, min(index, 100)) * mss
+        WritePacket(packet_time, 'in', (sequence - offset) & 0xFFFFFFFF, mss)
+      else:
+        WritePacket(packet_time, 'in', sequence & 0xFFFFFFFF, mss)
+        sequence += mss
+
+
+def Benchmark(packet_count):
+  """Time the processing of a synthetic capture"""
+  import tempfile
+  handle, path = tempfile.mkstemp(suffix='.cap')
+  os.close(handle)
+  try:
+    WriteSyntheticCapture(path, packet_count)
+    start = time.time()
+    pcap = Pcap()
+    pcap.Process(path)
+    elapsed = time.time() - start
+    print "Processed {0:d} packets in {1:0.3f} seconds".format(packet_count + 2, elapsed)
+    print "Bytes In:  {0:d}".format(pcap.bytes['in'])
+    print "Duplicate Bytes In:  {0:d}".format(pcap.bytes['in_dup'])
+  finally:
+    os.remove(path)
+
+
+########################################################################################################################
+#   Main Entry Point
+########################################################################################################################
+def main():
+  global options
+  import argparse
+  parser = argparse.ArgumentParser(description='WebPageTest pcap parser.',
+                                   prog='pcap_parser')
+  parser.add_argument('-v', '--verbose', action='count',
+                      help="Increase verbosity (specify multiple times for more). -vvvv for full debug output.")
+  parser.add_argument('-i', '--input', help="Input pcap file.")
+  parser.add_argument('-s', '--stats', help="Output bandwidth information file.")
+  parser.add_argument('-d', '--details', help="Output bandwidth details file (time sliced bandwidth data).")
+  parser.add_argument('-j', '--json', action='store_true', default=False, help="Set output format to JSON")
+  parser.add_argument('-b', '--benchmark', type=int, nargs='?', const=100000,
+                      help="Time the processing of a synthetic capture with the given number of packets (100k default).")
+  options = parser.parse_args()
+
+  # Set up logging
+  log_level = logging.CRITICAL
+  if options.verbose == 1:
+    log_level = logging.ERROR
+  elif options.verbose == 2:
+    log_level = logging.WARNING
+  elif options.verbose == 3:
+    log_level = logging.INFO
+  elif options.verbose >= 4:
+    log_level = logging.DEBUG
+  logging.basicConfig(level=log_level, format="%(asctime)s.%(msecs)03d - %(message)s", datefmt="%H:%M:%S")
+
+  if options.benchmark:
+    Benchmark(options.benchmark)
+    return
+
+  if not options.input:
+    parser.error("Input trace file is not specified.")
+
+  start = time.time()
+  pcap = Pcap()
+  pcap.Process(options.input)
+
+  if options.stats:
+    pcap.SaveStats(options.stats)
+  if options.details:
+    pcap.SaveDetails(options.details)
+  pcap.Print()
+
+  end = time.time()
+  elapsed = end - start
+  logging.debug("Elapsed Time: {0:0.4f}".format(elapsed))
+
+if '__main__' == __name__:
+  main()
@@ -14,19 +14,241 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import array
 import gzip
+import heapq
+import io
 import logging
 import math
 import os
 import re
+import tempfile
 import time
-import urlparse
 
 # try a fast json parser if it is installed
 try:
     import ujson as json
 except BaseException:
     import json
+# The standard json module is used for incremental decoding and for the
+# sort spill files (it round-trips floats exactly)
+import json as std_json
+# numpy speeds up the CPU slice accounting if it is installed
+try:
+    import numpy
+except BaseException:
+    numpy = None
+
+# Lines longer than this are decoded incrementally instead of as a single event
+TRACE_LINE_LIMIT = 1024 * 1024
+# Size of the reads when incrementally decoding a trace
+TRACE_READ_SIZE = 1024 * 1024
+# Number of trace events to sort in memory before spilling a sorted run to disk
+TRACE_SORT_RUN_SIZE = 50000
+# Largest single value buffered while incrementally decoding a trace (anything
+# bigger is treated as malformed and the rest of the trace is skipped)
+TRACE_VALUE_LIMIT = 32 * 1024 * 1024
+JSON_WHITESPACE = ' \t\r\n'
+# Request fields holding timestamps that get normalized to ms from the start
+NETLOG_REQUEST_TIMES = ('dns_start', 'dns_end', 'connect_start', 'connect_end',
+                        'ssl_start', 'ssl_end', 'start', 'first_byte', 'end')
+NETLOG_URL_HOST_RE = re.compile(r'[^:/?#]+://(?:[^@/?#]*@)?\[?([^\]/?#]*?)\]?(?::\d*)?(?:[/?#]|$)')
+NETLOG_PUSH_HEADER_RE = re.compile(r':(scheme|authority|path): (.+)')
+
+##########################################################################
+#   Incremental JSON decoding
+##########################################################################
+class JsonStream(object):
+    """Decodes the values of a large JSON document one at a time from a file"""
+    def __init__(self, f, buf):
+        self.f = f
+        self.buf = buf
+        self.pos = 0
+        self.eof = False
+        self.decoder = std_json.JSONDecoder()
+
+    def read_more(self):
+        """Append the next chunk of the file to the unconsumed part of the buffer"""
+        more = None
+        if not self.eof:
+            more = self.f.read(TRACE_READ_SIZE)
+        if not more:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + more
+        self.pos = 0
+        return True
+
+    def peek(self, skip):
+        """Next character after any of the skip characters (None at the end of the file)"""
+        while True:
+            length = len(self.buf)
+            while self.pos < length and self.buf[self.pos] in skip:
+                self.pos += 1
+            if self.pos < length:
+                return self.buf[self.pos]
+            if not self.read_more():
+                return None
+
+    def decode(self):
+        """Decode the next value (None if it is malformed, truncated or too large)"""
+        self.peek(JSON_WHITESPACE)
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self.buf) or not self.read_more():
+                    self.pos = end
+                    return value
+            except ValueError:
+                if len(self.buf) - self.pos > TRACE_VALUE_LIMIT:
+                    logging.warning("Trace value at least %d bytes long, it is probably malformed",
+                                    TRACE_VALUE_LIMIT)
+                    return None
+                if not self.read_more():
+                    return None
+
+##########################################################################
+#   Netlog source records
+##########################################################################
+class NetlogConnectJob(object):
+    """Connect job (links sockets to DNS lookups and group names)"""
+    __slots__ = ('socket', 'group', 'dns')
+
+    def __init__(self):
+        self.socket = None
+        self.group = None
+        self.dns = None
+
+
+class NetlogStreamJob(object):
+    """HTTP stream job (links requests to sockets and h2 sessions)"""
+    __slots__ = ('socket', 'url_request', 'h2_session')
+
+    def __init__(self):
+        self.socket = None
+        self.url_request = None
+        self.h2_session = None
+
+
+class NetlogHttp2Session(object):
+    """HTTP/2 session and its streams"""
+    __slots__ = ('socket', 'host', 'protocol', 'stream')
+
+    def __init__(self):
+        self.socket = None
+        self.host = None
+        self.protocol = None
+        self.stream = {}
+
+
+class NetlogHttp2Stream(object):
+    """A single stream within an HTTP/2 session"""
+    __slots__ = ('bytes_in', 'chunks', 'exclusive', 'parent_stream_id', 'weight', 'url',
+                 'url_request', 'first_byte', 'end', 'request_headers', 'response_headers',
+                 'pushed')
+
+    def __init__(self):
+        self.bytes_in = 0
+        # (ts, bytes) tuples
+        self.chunks = []
+        self.exclusive = None
+        self.parent_stream_id = None
+        self.weight = None
+        self.url = None
+        self.url_request = None
+        self.first_byte = None
+        self.end = None
+        self.request_headers = None
+        self.response_headers = None
+        self.pushed = None
+
+    def copy_to(self, request):
+        """Copy the stream details over to the matching URL request"""
+        if self.request_headers is not None:
+            request['request_headers'] = self.request_headers
+        if self.response_headers is not None:
+            request['response_headers'] = self.response_headers
+        if self.exclusive is not None:
+            request['exclusive'] = self.exclusive
+        if self.parent_stream_id is not None:
+            request['parent_stream_id'] = self.parent_stream_id
+        if self.weight is not None:
+            request['weight'] = self.weight
+        if 'first_byte' not in request and self.first_byte is not None:
+            request['first_byte'] = self.first_byte
+        if 'end' not in request and self.end is not None:
+            request['end'] = self.end
+        if self.bytes_in > request['bytes_in']:
+            request['bytes_in'] = self.bytes_in
+            request['chunks'] = [{'ts': ts, 'bytes': count} for ts, count in self.chunks]
+
+
+class NetlogDns(object):
+    """Host resolver job"""
+    __slots__ = ('start', 'end', 'host', 'address_list', 'claimed')
+
+    def __init__(self):
+        self.start = None
+        self.end = None
+        self.host = None
+        self.address_list = None
+        self.claimed = False
+
+
+class NetlogSocket(object):
+    """Socket connection and the traffic on it"""
+    __slots__ = ('address', 'source_address', 'group', 'dns', 'h2_session',
+                 'connect_start', 'connect_end', 'ssl_start', 'ssl_end',
+                 'bytes_in', 'bytes_out', 'chunks_in', 'chunks_out', 'certificates',
+                 'claimed')
+
+    def __init__(self):
+        self.address = None
+        self.source_address = None
+        self.group = None
+        self.dns = None
+        self.h2_session = None
+        self.connect_start = None
+        self.connect_end = None
+        self.ssl_start = None
+        self.ssl_end = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # flattened ts, bytes pairs
+        self.chunks_in = array.array('d')
+        self.chunks_out = array.array('d')
+        self.certificates = None
+        self.claimed = False
+
+    def copy_to(self, request):
+        """Copy the socket details over to a request on the socket (the
+        connection times only go to the first request to claim it)"""
+        if self.address is not None:
+            request['server_address'] = self.address
+        if self.source_address is not None:
+            request['client_address'] = self.source_address
+        if self.group is not None:
+            request['socket_group'] = self.group
+        if not self.claimed:
+            self.claimed = True
+            if self.connect_start is not None:
+                request['connect_start'] = self.connect_start
+            if self.connect_end is not None:
+                request['connect_end'] = self.connect_end
+            if self.ssl_start is not None:
+                request['ssl_start'] = self.ssl_start
+            if self.ssl_end is not None:
+                request['ssl_end'] = self.ssl_end
+
+
+def netlog_url_host(url):
+    """Lower-case host name for a request URL (same as urlparse's hostname)"""
+    match = NETLOG_URL_HOST_RE.match(url)
+    if match and match.group(1):
+        return match.group(1).lower()
+    return None
+
 
 ##########################################################################
 #   Trace processing
@@ -43,16 +265,19 @@ class Trace():
         self.scripts = None
         self.timeline_events = []
         self.trace_events = []
+        self.trace_event_runs = []
         self.interactive = []
         self.interactive_start = 0
         self.interactive_end = None
         self.start_time = None
         self.end_time = None
         self.cpu = {'main_thread': None}
+        self.slice_arrays = None
         self.feature_usage = None
         self.feature_usage_start_time = None
         self.netlog = {'bytes_in': 0, 'bytes_out': 0, 'next_request_id': 1000000}
         self.netlog_requests = None
+        self.netlog_urls = {}
         self.v8stats = None
         self.v8stack = {}
         return
@@ -103,24 +328,18 @@ class Trace():
     ##########################################################################
     def Process(self, trace):
         f = None
-        line_mode = False
         self.__init__()
         logging.debug("Loading trace: %s", trace)
         try:
             file_name, ext = os.path.splitext(trace)
+            # buffered readers keep the length-limited readline calls fast
             if ext.lower() == '.gz':
-                f = gzip.open(trace, 'rb')
+                f = io.BufferedReader(gzip.open(trace, 'rb'), TRACE_READ_SIZE)
             else:
-                f = open(trace, 'r')
-            for line in f:
+                f = io.open(trace, 'rb', TRACE_READ_SIZE)
+            for trace_event in self.IterateTraceEvents(f):
                 try:
-                    trace_event = json.loads(line.strip("\r\n\t ,"))
-                    if not line_mode and 'traceEvents' in trace_event:
-                        for sub_event in trace_event['traceEvents']:
-                            self.FilterTraceEvent(sub_event)
-                    else:
-                        line_mode = True
-                        self.FilterTraceEvent(trace_event)
+                    self.FilterTraceEvent(trace_event)
                 except BaseException:
                     pass
         except BaseException:
@@ -129,6 +348,64 @@ class Trace():
             f.close()
         self.ProcessTraceEvents()
 
+    def IterateTraceEvents(self, f):
+        """Yield the events from a trace file without loading all of it.
+        Handles both one event per line and a single {"traceEvents":[...]} blob."""
+        line_mode = False
+        while True:
+            line = f.readline(TRACE_LINE_LIMIT)
+            if not line:
+                break
+            if len(line) >= TRACE_LINE_LIMIT and not line.endswith('\n'):
+                for trace_event in self.IterateJsonEvents(f, line):
+                    yield trace_event
+                break
+            try:
+                trace_event = json.loads(line.strip("\r\n\t ,"))
+            except BaseException:
+                continue
+            if not line_mode and 'traceEvents' in trace_event:
+                for sub_event in trace_event['traceEvents']:
+                    yield sub_event
+            else:
+                line_mode = True
+                yield trace_event
+
+    def IterateJsonEvents(self, f, buf):
+        """Incrementally decode the remaining trace events from a trace that is
+        not one event per line, reading more of the file as needed. Handles a bare
+        list of events and an object with a traceEvents list under any of its keys."""
+        stream = JsonStream(f, buf)
+        char = stream.peek(JSON_WHITESPACE)
+        if char == '[':
+            stream.pos += 1
+            for trace_event in self.IterateJsonList(stream):
+                yield trace_event
+        elif char == '{':
+            stream.pos += 1
+            while stream.peek(JSON_WHITESPACE + ',') == '"':
+                key = stream.decode()
+                if key is None or stream.peek(JSON_WHITESPACE) != ':':
+                    break
+                stream.pos += 1
+                if key == 'traceEvents' and stream.peek(JSON_WHITESPACE) == '[':
+                    stream.pos += 1
+                    for trace_event in self.IterateJsonList(stream):
+                        yield trace_event
+                elif stream.decode() is None:
+                    # Skip the values for the other keys
+                    break
+
+    def IterateJsonList(self, stream):
+        """Yield the objects from a JSON list (after the opening bracket)"""
+        while stream.peek(JSON_WHITESPACE + ',') == '{':
+            trace_event = stream.decode()
+            if trace_event is None:
+                break
+            yield trace_event
+        if stream.peek(JSON_WHITESPACE) == ']':
+            stream.pos += 1
+
     def ProcessTimeline(self, timeline):
         self.__init__()
         self.cpu['main_thread'] = '0'
@@ -169,28 +446,78 @@ class Trace():
         if f is not None:
             f.close()
 
-    def FilterTraceEvent(self, trace_event):
-        cat = trace_event['cat']
+    def IsProcessedCategory(self, cat):
+        """Check if trace events from the given category are used by the trace processing"""
         if cat == 'toplevel' or cat == 'ipc,toplevel':
-            return
-        if cat == 'devtools.timeline' or \
-                cat.find('devtools.timeline') >= 0 or \
-                cat.find('blink.feature_usage') >= 0 or \
-                cat.find('blink.user_timing') >= 0 or \
-                cat.find('loading') >= 0 or \
-                cat.find('rail') >= 0 or \
-                cat.find('netlog') >= 0 or \
-                cat.find('v8') >= 0:
+            return False
+        return cat == 'devtools.timeline' or \
+            cat.find('devtools.timeline') >= 0 or \
+            cat.find('blink.feature_usage') >= 0 or \
+            cat.find('blink.user_timing') >= 0 or \
+            cat.find('loading') >= 0 or \
+            cat.find('rail') >= 0 or \
+            cat.find('netlog') >= 0 or \
+            cat.find('v8') >= 0
+
+    def FilterTraceEvent(self, trace_event):
+        if self.IsProcessedCategory(trace_event['cat']):
             self.trace_events.append(trace_event)
+            if len(self.trace_events) >= TRACE_SORT_RUN_SIZE:
+                self.SpillTraceEvents()
+
+    def SpillTraceEvents(self):
+        """Sort the buffered trace events and move them to a temporary file"""
+        self.trace_events.sort(key=lambda trace_event: trace_event['ts'])
+        handle, path = tempfile.mkstemp(suffix='.trace')
+        with os.fdopen(handle, 'wb') as f:
+            for trace_event in self.trace_events:
+                f.write(std_json.dumps(trace_event) + "\n")
+        logging.debug("Spilled %d sorted trace events to %s", len(self.trace_events), path)
+        self.trace_event_runs.append(path)
+        self.trace_events = []
 
-    def ProcessTraceEvents(self):
-        # sort the raw trace events by timestamp and then process them
-        if len(self.trace_events):
+    def IterateTraceEventRun(self, run, path):
+        """Yield the (ts, run, position, event) entries from a spilled run"""
+        with open(path, 'rb') as f:
+            position = 0
+            for line in f:
+                trace_event = std_json.loads(line)
+                yield (trace_event['ts'], run, position, trace_event)
+                position += 1
+
+    def SortedTraceEvents(self):
+        """Yield the buffered trace events in (stable) timestamp order, merging
+        any runs that were spilled to disk"""
+        if self.trace_event_runs:
+            self.trace_events.sort(key=lambda trace_event: trace_event['ts'])
+            last_run = len(self.trace_event_runs)
+            runs = [self.IterateTraceEventRun(run, path)
+                    for run, path in enumerate(self.trace_event_runs)]
+            runs.append((trace_event['ts'], last_run, position, trace_event)
+                        for position, trace_event in enumerate(self.trace_events))
+            logging.debug("Merging %d sorted runs of trace events", len(runs))
+            for _, _, _, trace_event in heapq.merge(*runs):
+                yield trace_event
+        else:
             logging.debug("Sorting %d trace events", len(self.trace_events))
             self.trace_events.sort(key=lambda trace_event: trace_event['ts'])
-            logging.debug("Processing trace events")
             for trace_event in self.trace_events:
-                self.ProcessTraceEvent(trace_event)
+                yield trace_event
+
+    def ProcessTraceEvents(self):
+        # sort the raw trace events by timestamp and then process them
+        if len(self.trace_events) or self.trace_event_runs:
+            logging.debug("Processing trace events")
+            try:
+                for trace_event in self.SortedTraceEvents():
+                    self.ProcessTraceEvent(trace_event)
+            finally:
+                for path in self.trace_event_runs:
+                    try:
+                        os.remove(path)
+                    except Exception:
+                        pass
+                self.trace_event_runs = []
             self.trace_events = []
 
         # Post-process the netlog events (may shift the start time)
@@ -370,10 +697,24 @@ class Trace():
 
             # Create the empty time slices for all of the threads
             self.cpu['slices'] = {}
-            for thread in self.threads.keys():
-                self.cpu['slices'][thread] = {'total': [0.0] * slice_count}
-                for name in self.threads[thread].keys():
-                    self.cpu['slices'][thread][name] = [0.0] * slice_count
+            self.slice_arrays = None
+            if numpy is not None:
+                # Each thread gets a categories x slices array. The row order
+                # matches the iteration order of the per-thread slices dict.
+                self.slice_arrays = {}
+                for thread in self.threads.keys():
+                    self.cpu['slices'][thread] = {'total': None}
+                    for name in self.threads[thread].keys():
+                        self.cpu['slices'][thread][name] = None
+                    names = self.cpu['slices'][thread].keys()
+                    self.slice_arrays[thread] = {
+                        'rows': dict((name, row) for row, name in enumerate(names)),
+                        'data': numpy.zeros((len(names), slice_count))}
+            else:
+                for thread in self.threads.keys():
+                    self.cpu['slices'][thread] = {'total': [0.0] * slice_count}
+                    for name in self.threads[thread].keys():
+                        self.cpu['slices'][thread][name] = [0.0] * slice_count
 
             # Go through all of the timeline events recursively and account for
             # the time they consumed
@@ -386,13 +727,23 @@ class Trace():
 
             # Go through all of the fractional times and convert the float
             # fractional times to integer usecs
-            for thread in self.cpu['slices'].keys():
-                del self.cpu['slices'][thread]['total']
-                for name in self.cpu['slices'][thread].keys():
-                    for slice in range(len(self.cpu['slices'][thread][name])):
-                        self.cpu['slices'][thread][name][slice] =\
-                            int(self.cpu['slices'][thread][name]
-                                [slice] * self.cpu['slice_usecs'])
+            if self.slice_arrays is not None:
+                for thread in self.slice_arrays:
+                    rows = self.slice_arrays[thread]['rows']
+                    usecs = (self.slice_arrays[thread]['data'] *
+                             self.cpu['slice_usecs']).astype(numpy.int64)
+                    del self.cpu['slices'][thread]['total']
+                    for name in self.cpu['slices'][thread].keys():
+                        self.cpu['slices'][thread][name] = usecs[rows[name]].tolist()
+                self.slice_arrays = None
+            else:
+                for thread in self.cpu['slices'].keys():
+                    del self.cpu['slices'][thread]['total']
+                    for name in self.cpu['slices'][thread].keys():
+                        for slice in range(len(self.cpu['slices'][thread][name])):
+                            self.cpu['slices'][thread][name][slice] =\
+                                int(self.cpu['slices'][thread][name]
+                                    [slice] * self.cpu['slice_usecs'])
 
     def ProcessTimelineEvent(self, timeline_event, parent, stack = None):
         start = timeline_event['s'] - self.start_time
@@ -452,6 +803,16 @@ class Trace():
             slice_usecs = self.cpu['slice_usecs']
             first_slice = int(float(start) / float(slice_usecs))
             last_slice = int(float(end) / float(slice_usecs))
+            if self.slice_arrays is not None:
+                # Negative slices wrap around to the end (like list indexing)
+                # so they are accounted separately from the regular ones
+                if first_slice < 0:
+                    self.AdjustTimelineSliceRange(thread, first_slice, min(last_slice, -1),
+                                                  start, end, name, parent)
+                if last_slice >= 0:
+                    self.AdjustTimelineSliceRange(thread, max(first_slice, 0), last_slice,
+                                                  start, end, name, parent)
+                first_slice = last_slice + 1
             for slice_number in xrange(first_slice, last_slice + 1):
                 slice_start = slice_number * slice_usecs
                 slice_end = slice_start + slice_usecs
@@ -466,6 +827,58 @@ class Trace():
                 for child in timeline_event['c']:
                     self.ProcessTimelineEvent(child, name, dict(stack))
 
+    # Add the time to a range of slices and subtract the time from a parent
+    # event. Does the same math as AdjustTimelineSlice on all of the slices at
+    # once with the per-thread numpy arrays.
+    def AdjustTimelineSliceRange(self, thread, first_slice, last_slice, start, end,
+                                 name, parent):
+        if name == parent or thread not in self.slice_arrays:
+            return
+        rows = self.slice_arrays[thread]['rows']
+        data = self.slice_arrays[thread]['data']
+        slice_count = data.shape[1]
+        # Slices past the end (or before the wrapped start) don't exist
+        first_slice = max(first_slice, -slice_count)
+        last_slice = min(last_slice, slice_count - 1)
+        if last_slice < first_slice or name not in rows:
+            return
+        slice_usecs = self.cpu['slice_usecs']
+        slice_start = numpy.arange(first_slice, last_slice + 1) * slice_usecs
+        elapsed = numpy.minimum(slice_start + slice_usecs, end) - \
+            numpy.maximum(slice_start, start)
+        fraction = numpy.minimum(1.0, elapsed.astype(float) / float(slice_usecs))
+        offset = first_slice + slice_count if first_slice < 0 else first_slice
+        columns = slice(offset, offset + len(fraction))
+        name_row = rows[name]
+        total_row = rows['total']
+        data[name_row, columns] += fraction
+        data[total_row, columns] += fraction
+        if parent is not None:
+            if parent not in rows:
+                return
+            parent_row = rows[parent]
+            adjust = data[parent_row, columns] >= fraction
+            data[parent_row, columns] = numpy.where(
+                adjust, data[parent_row, columns] - fraction, data[parent_row, columns])
+            data[total_row, columns] = numpy.where(
+                adjust, data[total_row, columns] - fraction, data[total_row, columns])
+        # Make sure we didn't exceed 100% in this slice
+        data[name_row, columns] = numpy.minimum(1.0, data[name_row, columns])
+
+        # make sure we don't exceed 100% for any slot (the rows are walked in
+        # order for all of the overflowing slots at once)
+        overflow = numpy.nonzero(data[total_row, columns] > 1.0)[0]
+        if len(overflow):
+            overflow_columns = overflow + offset
+            available = numpy.maximum(0.0, 1.0 - fraction[overflow])
+            for row in xrange(len(rows)):
+                if row != name_row:
+                    values = numpy.minimum(data[row, overflow_columns], available)
+                    data[row, overflow_columns] = values
+                    available = numpy.maximum(0.0, available - values)
+            data[total_row, overflow_columns] = numpy.minimum(
+                1.0, numpy.maximum(0.0, 1.0 - available))
+
     # Add the time to the given slice and subtract the time from a parent event
     def AdjustTimelineSlice(self, thread, slice_number, name, parent, elapsed):
         try:
@@ -573,224 +986,199 @@ class Trace():
             return self.netlog_requests
         requests = []
         if 'url_request' in self.netlog:
+            stage_start = time.time()
+            h2_sessions = self.netlog['h2_session'] if 'h2_session' in self.netlog else {}
             for request_id in self.netlog['url_request']:
                 request = self.netlog['url_request'][request_id]
                 if 'url' in request and request['url'][:16] != 'http://127.0.0.1' and \
                         'start' in request:
                     # Copy any http/2 info over
-                    if 'h2_session' in self.netlog and \
-                            'h2_session' in request and \
-                            request['h2_session'] in self.netlog['h2_session']:
-                        h2_session = self.netlog['h2_session'][request['h2_session']]
-                        if 'stream_id' in request and \
-                                'stream' in h2_session and \
-                                request['stream_id'] in h2_session['stream']:
-                            stream = h2_session['stream'][request['stream_id']]
-                            if 'request_headers' in stream:
-                                request['request_headers'] = stream['request_headers']
-                            if 'response_headers' in stream:
-                                request['response_headers'] = stream['response_headers']
-                            if 'exclusive' in stream:
-                                request['exclusive'] = stream['exclusive']
-                            if 'parent_stream_id' in stream:
-                                request['parent_stream_id'] = stream['parent_stream_id']
-                            if 'weight' in stream:
-                                request['weight'] = stream['weight']
-                            if 'first_byte' not in request and 'first_byte' in stream:
-                                request['first_byte'] = stream['first_byte']
-                            if 'end' not in request and 'end' in stream:
-                                request['end'] = stream['end']
-                            if stream['bytes_in'] > request['bytes_in']:
-                                request['bytes_in'] = stream['bytes_in']
-                                request['chunks'] = stream['chunks']
+                    if 'h2_session' in request and request['h2_session'] in h2_sessions:
+                        h2_session = h2_sessions[request['h2_session']]
+                        if 'stream_id' in request and request['stream_id'] in h2_session.stream:
+                            stream = h2_session.stream[request['stream_id']]
+                            stream.copy_to(request)
                     if 'phantom' not in request:
                         requests.append(request)
+            logging.debug("Netlog: collected %d requests in %0.3fs",
+                          len(requests), time.time() - stage_start)
             if len(requests):
                 # Sort the requests by the start time
                 requests.sort(key=lambda x: x['start'])
                 # Assign the socket connect time to the first request on each socket
                 if 'socket' in self.netlog:
+                    stage_start = time.time()
+                    sockets = self.netlog['socket']
                     for request in requests:
-                        if 'socket' in request and request['socket'] in self.netlog['socket']:
-                            socket = self.netlog['socket'][request['socket']]
-                            if 'address' in socket:
-                                request['server_address'] = socket['address']
-                            if 'source_address' in socket:
-                                request['client_address'] = socket['source_address']
-                            if 'group' in socket:
-                                request['socket_group'] = socket['group']
-                            if 'claimed' not in socket:
-                                socket['claimed'] = True
-                                if 'connect_start' in socket:
-                                    request['connect_start'] = socket['connect_start']
-                                if 'connect_end' in socket:
-                                    request['connect_end'] = socket['connect_end']
-                                if 'ssl_start' in socket:
-                                    request['ssl_start'] = socket['ssl_start']
-                                if 'ssl_end' in socket:
-                                    request['ssl_end'] = socket['ssl_end']
+                        if 'socket' in request and request['socket'] in sockets:
+                            sockets[request['socket']].copy_to(request)
+                    logging.debug("Netlog: assigned sockets in %0.3fs", time.time() - stage_start)
                 # Assign the DNS lookup to the first request that connected to the DocumentSetDomain
                 if 'dns' in self.netlog:
+                    stage_start = time.time()
                     # Build a mapping of the DNS lookups for each domain
                     dns_lookups = {}
-                    for dns_id in self.netlog['dns']:
-                        dns = self.netlog['dns'][dns_id]
-                        if 'host' in dns and 'start' in dns:
-                            hostname = dns['host']
-                            if hostname not in dns_lookups:
-                                dns_lookups[hostname] = dns
-                            elif dns['start'] < dns_lookups[hostname]['start']:
+                    for dns in self.netlog['dns'].itervalues():
+                        if dns.host is not None and dns.start is not None:
+                            hostname = dns.host
+                            if hostname not in dns_lookups or \
+                                    dns.start < dns_lookups[hostname].start:
                                 dns_lookups[hostname] = dns
                     # Go through the requests and assign the DNS lookups as needed
                     for request in requests:
                         if 'connect_start' in request:
-                            hostname = urlparse.urlparse(request['url']).hostname
-                            if hostname in dns_lookups and 'claimed' not in dns_lookups[hostname]:
-                                dns = dns_lookups[hostname]
-                                dns['claimed'] = True
-                                request['dns_start'] = dns['start']
-                                if 'end' in dns:
-                                    request['dns_end'] = dns['end']
+                            dns = dns_lookups.get(netlog_url_host(request['url']))
+                            if dns is not None and not dns.claimed:
+                                dns.claimed = True
+                                request['dns_start'] = dns.start
+                                if dns.end is not None:
+                                    request['dns_end'] = dns.end
+                    logging.debug("Netlog: assigned %d DNS lookups in %0.3fs",
+                                  len(dns_lookups), time.time() - stage_start)
                 # Find the start timestamp if we didn't have one already
-                times = ['dns_start', 'dns_end',
-                         'connect_start', 'connect_end',
-                         'ssl_start', 'ssl_end',
-                         'start', 'first_byte', 'end']
+                stage_start = time.time()
                 for request in requests:
-                    for time_name in times:
+                    for time_name in NETLOG_REQUEST_TIMES:
                         if time_name in request:
                             if self.start_time is None or request[time_name] < self.start_time:
                                 self.start_time = request[time_name]
                 # Go through and adjust all of the times to be relative in ms
                 if self.start_time is not None:
+                    start_time = self.start_time
                     for request in requests:
-                        for time_name in times:
+                        for time_name in NETLOG_REQUEST_TIMES:
                             if time_name in request:
                                 request[time_name] = \
-                                        float(request[time_name] - self.start_time) / 1000.0
+                                        float(request[time_name] - start_time) / 1000.0
                 else:
                     requests = []
+                logging.debug("Netlog: normalized request times in %0.3fs",
+                              time.time() - stage_start)
         if not len(requests):
             requests = None
         self.netlog_requests = requests
         return requests
 
+    def get_netlog_source(self, source_type, source_id, record_type):
+        """Look up (or create) the record for the given netlog source"""
+        if source_type not in self.netlog:
+            self.netlog[source_type] = {}
+        sources = self.netlog[source_type]
+        if source_id not in sources:
+            sources[source_id] = record_type()
+        return sources[source_id]
+
+    def set_netlog_request_url(self, request, url):
+        """Set the url for a URL request, keeping the url index up to date"""
+        if 'url' not in request or request['url'] != url:
+            request['url'] = url
+            if url not in self.netlog_urls:
+                self.netlog_urls[url] = []
+            self.netlog_urls[url].append(request)
+
     def ProcessNetlogConnectJobEvent(self, trace_event):
         """Connect jobs link sockets to DNS lookups/group names"""
-        if 'connect_job' not in self.netlog:
-            self.netlog['connect_job'] = {}
-        request_id = trace_event['id']
-        if request_id not in self.netlog['connect_job']:
-            self.netlog['connect_job'][request_id] = {}
+        entry = self.get_netlog_source('connect_job', trace_event['id'], NetlogConnectJob)
         params = trace_event['args']['params'] if 'params' in trace_event['args'] else {}
-        entry = self.netlog['connect_job'][request_id]
         name = trace_event['name']
         if 'source_dependency' in params and 'id' in params['source_dependency']:
             if name == 'CONNECT_JOB_SET_SOCKET':
                 socket_id = params['source_dependency']['id']
-                entry['socket'] = socket_id
+                entry.socket = socket_id
                 if 'socket' in self.netlog and socket_id in self.netlog['socket']:
-                    if 'group' in entry:
-                        self.netlog['socket'][socket_id]['group'] = entry['group']
-                    if 'dns' in entry:
-                        self.netlog['socket'][socket_id]['dns'] = entry['dns']
+                    socket = self.netlog['socket'][socket_id]
+                    if entry.group is not None:
+                        socket.group = entry.group
+                    if entry.dns is not None:
+                        socket.dns = entry.dns
         if 'group_name' in params:
-            entry['group'] = params['group_name']
+            entry.group = params['group_name']
 
     def ProcessNetlogStreamJobEvent(self, trace_event):
         """Strem jobs leank requests to sockets"""
-        if 'stream_job' not in self.netlog:
-            self.netlog['stream_job'] = {}
-        request_id = trace_event['id']
-        if request_id not in self.netlog['stream_job']:
-            self.netlog['stream_job'][request_id] = {}
+        entry = self.get_netlog_source('stream_job', trace_event['id'], NetlogStreamJob)
         params = trace_event['args']['params'] if 'params' in trace_event['args'] else {}
-        entry = self.netlog['stream_job'][request_id]
         name = trace_event['name']
         if 'source_dependency' in params and 'id' in params['source_dependency']:
+            url_requests = self.netlog['url_request'] if 'url_request' in self.netlog else {}
             if name == 'SOCKET_POOL_BOUND_TO_SOCKET':
                 socket_id = params['source_dependency']['id']
-                entry['socket'] = socket_id
-                if 'url_request' in entry and entry['urlrequest'] in self.netlog['urlrequest']:
-                    self.netlog['urlrequest'][entry['urlrequest']]['socket'] = socket_id
+                entry.socket = socket_id
+                if entry.url_request is not None and entry.url_request in url_requests:
+                    url_requests[entry.url_request]['socket'] = socket_id
             if name == 'HTTP_STREAM_JOB_BOUND_TO_REQUEST':
                 url_request_id = params['source_dependency']['id']
-                entry['url_request'] = url_request_id
-                if url_request_id in self.netlog['url_request']:
-                    url_request = self.netlog['url_request'][url_request_id]
-                    if 'socket' in entry:
-                        url_request['socket'] = entry['socket']
-                    if 'h2_session' in entry:
-                        url_request['h2_session'] = entry['h2_session']
+                entry.url_request = url_request_id
+                if url_request_id in url_requests:
+                    url_request = url_requests[url_request_id]
+                    if entry.socket is not None:
+                        url_request['socket'] = entry.socket
+                    if entry.h2_session is not None:
+                        url_request['h2_session'] = entry.h2_session
             if name == 'HTTP2_SESSION_POOL_IMPORTED_SESSION_FROM_SOCKET' or \
                     name == 'HTTP2_SESSION_POOL_FOUND_EXISTING_SESSION':
                 h2_session_id = params['source_dependency']['id']
-                entry['h2_session'] = h2_session_id
-                if 'url_request' in entry and entry['urlrequest'] in self.netlog['urlrequest']:
-                    self.netlog['urlrequest'][entry['urlrequest']]['h2_session'] = h2_session_id
+                entry.h2_session = h2_session_id
+                if entry.url_request is not None and entry.url_request in url_requests:
+                    url_requests[entry.url_request]['h2_session'] = h2_session_id
 
     def ProcessNetlogHttp2SessionEvent(self, trace_event):
         """Raw H2 session information (linked to sockets and requests)"""
-        if 'h2_session' not in self.netlog:
-            self.netlog['h2_session'] = {}
         session_id = trace_event['id']
-        if session_id not in self.netlog['h2_session']:
-            self.netlog['h2_session'][session_id] = {'stream': {}}
+        entry = self.get_netlog_source('h2_session', session_id, NetlogHttp2Session)
         params = trace_event['args']['params'] if 'params' in trace_event['args'] else {}
-        entry = self.netlog['h2_session'][session_id]
         name = trace_event['name']
         if 'source_dependency' in params and 'id' in params['source_dependency']:
             if name == 'HTTP2_SESSION_INITIALIZED':
                 socket_id = params['source_dependency']['id']
-                entry['socket'] = socket_id
+                entry.socket = socket_id
                 if 'socket' in self.netlog and socket_id in self.netlog['socket']:
-                    self.netlog['socket']['h2_session'] = session_id
-        if 'host' not in entry and 'host' in params:
-            entry['host'] = params['host']
-        if 'protocol' not in entry and 'protocol' in params:
-            entry['protocol'] = params['protocol']
+                    self.netlog['socket'][socket_id].h2_session = session_id
+        if entry.host is None and 'host' in params:
+            entry.host = params['host']
+        if entry.protocol is None and 'protocol' in params:
+            entry.protocol = params['protocol']
         if 'stream_id' in params:
             stream_id = params['stream_id']
-            if stream_id not in entry['stream']:
-                entry['stream'][stream_id] = {'bytes_in': 0, 'chunks': []}
-            stream = entry['stream'][stream_id]
+            if stream_id not in entry.stream:
+                entry.stream[stream_id] = NetlogHttp2Stream()
+            stream = entry.stream[stream_id]
             if 'exclusive' in params:
-                stream['exclusive'] = params['exclusive']
+                stream.exclusive = params['exclusive']
             if 'parent_stream_id' in params:
-                stream['parent_stream_id'] = params['parent_stream_id']
+                stream.parent_stream_id = params['parent_stream_id']
             if 'weight' in params:
-                stream['weight'] = params['weight']
+                stream.weight = params['weight']
             if 'url' in params:
-                stream['url'] = params['url'].split('#', 1)[0]
-                if 'url_request' in stream:
-                    request_id = stream['url_request']
+                stream.url = params['url'].split('#', 1)[0]
+                if stream.url_request is not None:
+                    request_id = stream.url_request
                     if 'url_request' in self.netlog and request_id in self.netlog['url_request']:
                         request = self.netlog['url_request'][request_id]
-                        request['url'] = params['url'].split('#', 1)[0]
+                        self.set_netlog_request_url(request, stream.url)
             if name == 'HTTP2_SESSION_RECV_DATA' and 'size' in params:
-                stream['end'] = trace_event['ts']
-                if 'first_byte' not in stream:
-                    stream['first_byte'] = trace_event['ts']
-                stream['bytes_in'] += params['size']
-                stream['chunks'].append({'ts': trace_event['ts'], 'bytes': params['size']})
+                stream.end = trace_event['ts']
+                if stream.first_byte is None:
+                    stream.first_byte = trace_event['ts']
+                stream.bytes_in += params['size']
+                stream.chunks.append((trace_event['ts'], params['size']))
             if name == 'HTTP2_SESSION_SEND_HEADERS':
                 if 'headers' in params:
-                    stream['request_headers'] = params['headers']
+                    stream.request_headers = params['headers']
             if name == 'HTTP2_SESSION_RECV_HEADERS':
-                if 'first_byte' not in stream:
-                    stream['first_byte'] = trace_event['ts']
-                stream['end'] = trace_event['ts']
+                if stream.first_byte is None:
+                    stream.first_byte = trace_event['ts']
+                stream.end = trace_event['ts']
                 if 'headers' in params:
-                    stream['response_headers'] = params['headers']
-            if name == 'HTTP2_STREAM_ADOPTED_PUSH_STREAM' and 'url' in params and \
-                    'url_request' in self.netlog:
+                    stream.response_headers = params['headers']
+            if name == 'HTTP2_STREAM_ADOPTED_PUSH_STREAM' and 'url' in params:
                 # Find the phantom request with the matching url and mark it
                 url = params['url'].split('#', 1)[0]
-                for request_id in self.netlog['url_request']:
-                    request = self.netlog['url_request'][request_id]
-                    if 'url' in request and url == request['url'] and 'start' not in request:
-                        request['phantom'] = True
-                        break
+                if url in self.netlog_urls:
+                    for request in self.netlog_urls[url]:
+                        if request['url'] == url and 'start' not in request:
+                            request['phantom'] = True
+                            break
         if name == 'HTTP2_SESSION_RECV_PUSH_PROMISE' and 'promised_stream_id' in params:
             # Create a fake request to match the push
             if 'url_request' not in self.netlog:
@@ -800,94 +1188,83 @@ class Trace():
             self.netlog['url_request'][request_id] = {'bytes_in': 0, 'chunks': []}
             request = self.netlog['url_request'][request_id]
             stream_id = params['promised_stream_id']
-            if stream_id not in entry['stream']:
-                entry['stream'][stream_id] = {'bytes_in': 0, 'chunks': []}
-            stream = entry['stream'][stream_id]
+            if stream_id not in entry.stream:
+                entry.stream[stream_id] = NetlogHttp2Stream()
+            stream = entry.stream[stream_id]
             if 'headers' in params:
-                stream['request_headers'] = params['headers']
+                stream.request_headers = params['headers']
                 # synthesize a URL from the request headers
                 scheme = None
                 authority = None
                 path = None
                 for header in params['headers']:
-                    match = re.search(r':scheme: (.+)', header)
-                    if match:
-                        scheme = match.group(1)
-                    match = re.search(r':authority: (.+)', header)
-                    if match:
-                        authority = match.group(1)
-                    match = re.search(r':path: (.+)', header)
+                    match = NETLOG_PUSH_HEADER_RE.match(header)
                     if match:
-                        path = match.group(1)
+                        if match.group(1) == 'scheme':
+                            scheme = match.group(2)
+                        elif match.group(1) == 'authority':
+                            authority = match.group(2)
+                        else:
+                            path = match.group(2)
                 if scheme is not None and authority is not None and path is not None:
                     url = '{0}://{1}{2}'.format(scheme, authority, path).split('#', 1)[0]
-                    request['url'] = url
-                    stream['url'] = url
+                    self.set_netlog_request_url(request, url)
+                    stream.url = url
             request['protocol'] = 'HTTP/2'
             request['h2_session'] = session_id
             request['stream_id'] = stream_id
             request['start'] = trace_event['ts']
             request['pushed'] = True
-            stream['pushed'] = True
-            stream['url_request'] = request_id
-            if 'socket' in entry:
-                request['socket'] = entry['socket']
+            stream.pushed = True
+            stream.url_request = request_id
+            if entry.socket is not None:
+                request['socket'] = entry.socket
 
     def ProcessNetlogDnsEvent(self, trace_event):
-        if 'dns' not in self.netlog:
-            self.netlog['dns'] = {}
         request_id = trace_event['id']
-        if request_id not in self.netlog['dns']:
-            self.netlog['dns'][request_id] = {}
+        entry = self.get_netlog_source('dns', request_id, NetlogDns)
         params = trace_event['args']['params'] if 'params' in trace_event['args'] else {}
-        entry = self.netlog['dns'][request_id]
         name = trace_event['name']
         if 'source_dependency' in params and 'id' in params['source_dependency']:
             parent_id = params['source_dependency']['id']
             if 'connect_job' in self.netlog and parent_id in self.netlog['connect_job']:
-                self.netlog['connect_job'][parent_id]['dns'] = request_id
-        if 'start' not in entry and name == 'HOST_RESOLVER_IMPL_ATTEMPT_STARTED':
-            entry['start'] = trace_event['ts']
+                self.netlog['connect_job'][parent_id].dns = request_id
+        if entry.start is None and name == 'HOST_RESOLVER_IMPL_ATTEMPT_STARTED':
+            entry.start = trace_event['ts']
         if name == 'HOST_RESOLVER_IMPL_ATTEMPT_FINISHED':
-            entry['end'] = trace_event['ts']
-        if 'host' not in entry and 'host' in params:
-            entry['host'] = params['host']
+            entry.end = trace_event['ts']
+        if entry.host is None and 'host' in params:
+            entry.host = params['host']
         if 'address_list' in params:
-            entry['address_list'] = params['address_list']
+            entry.address_list = params['address_list']
 
     def ProcessNetlogSocketEvent(self, trace_event):
-        if 'socket' not in self.netlog:
-            self.netlog['socket'] = {}
-        request_id = trace_event['id']
-        if request_id not in self.netlog['socket']:
-            self.netlog['socket'][request_id] = {'bytes_out': 0, 'bytes_in': 0,
-                                                 'chunks_out': [], 'chunks_in': []}
+        entry = self.get_netlog_source('socket', trace_event['id'], NetlogSocket)
         params = trace_event['args']['params'] if 'params' in trace_event['args'] else {}
-        entry = self.netlog['socket'][request_id]
         name = trace_event['name']
         if 'address' in params:
-            entry['address'] = params['address']
+            entry.address = params['address']
         if 'source_address' in params:
-            entry['source_address'] = params['source_address']
-        if 'connect_start' not in entry and name == 'TCP_CONNECT_ATTEMPT' and \
+            entry.source_address = params['source_address']
+        if entry.connect_start is None and name == 'TCP_CONNECT_ATTEMPT' and \
                 trace_event['ph'] == 'b':
-            entry['connect_start'] = trace_event['ts']
+            entry.connect_start = trace_event['ts']
         if name == 'TCP_CONNECT_ATTEMPT' and trace_event['ph'] == 'e':
-            entry['connect_end'] = trace_event['ts']
-        if 'ssl_start' not in entry and name == 'SSL_CONNECT' and trace_event['ph'] == 'b':
-            entry['ssl_start'] = trace_event['ts']
+            entry.connect_end = trace_event['ts']
+        if entry.ssl_start is None and name == 'SSL_CONNECT' and trace_event['ph'] == 'b':
+            entry.ssl_start = trace_event['ts']
         if name == 'SSL_CONNECT' and trace_event['ph'] == 'e':
-            entry['ssl_end'] = trace_event['ts']
+            entry.ssl_end = trace_event['ts']
         if name == 'SOCKET_BYTES_SENT' and 'byte_count' in params:
-            entry['bytes_out'] += params['byte_count']
-            entry['chunks_out'].append({'ts': trace_event['ts'], 'bytes': params['byte_count']})
+            entry.bytes_out += params['byte_count']
+            entry.chunks_out.extend((trace_event['ts'], params['byte_count']))
         if name == 'SOCKET_BYTES_RECEIVED' and 'byte_count' in params:
-            entry['bytes_in'] += params['byte_count']
-            entry['chunks_in'].append({'ts': trace_event['ts'], 'bytes': params['byte_count']})
+            entry.bytes_in += params['byte_count']
+            entry.chunks_in.extend((trace_event['ts'], params['byte_count']))
         if name == 'SSL_CERTIFICATES_RECEIVED' and 'certificates' in params:
-            if 'certificates' not in entry:
-                entry['certificates'] = []
-            entry['certificates'].extend(params['certificates'])
+            if entry.certificates is None:
+                entry.certificates = []
+            entry.certificates.extend(params['certificates'])
 
     def ProcessNetlogUrlRequestEvent(self, trace_event):
         if 'url_request' not in self.netlog:
@@ -903,7 +1280,7 @@ class Trace():
         if 'method' in params:
             entry['method'] = params['method']
         if 'url' in params:
-            entry['url'] = params['url'].split('#', 1)[0]
+            self.set_netlog_request_url(entry, params['url'].split('#', 1)[0])
         if 'start' not in entry and name == 'HTTP_TRANSACTION_SEND_REQUEST' and \
                 trace_event['ph'] == 'e':
             entry['start'] = trace_event['ts']
@@ -939,7 +1316,6 @@ class Trace():
             self.netlog['url_request'][new_id] = entry
             del self.netlog['url_request'][request_id]
 
-
     #######################################################################
     #   V8 call stats
     #######################################################################
@@ -34,14 +34,291 @@ import logging
 import math
 import os
 import platform
+import Queue
 import re
 import shutil
 import subprocess
 import tempfile
+import threading
+import time
 
 # Globals
 options = None
 client_viewport = None
+ssim_target = None
+
+
+# #################################################################################################
+# Frame store
+# #################################################################################################
+
+FRAME_STORE_CACHE_BYTES = 256 * 1024 * 1024
+# Number of SSIM values kept in the --ssimcache file (least recently used are evicted)
+SSIM_CACHE_SIZE = 20000
+
+
+class FrameStore(object):
+    """Video frames for one directory keyed by frame time (in ms).
+
+    The frame extraction stages query and remove frames through the store instead of
+    globbing the directory so each frame is decoded at most once (as long as the decoded
+    frames fit in the cache). Renames and deletes are only applied to the files when the
+    store is saved.
+
+    Frames streamed from ffmpeg only live in memory until they are saved (they are spilled
+    to raw .npy files if they don't fit in the cache) so frames that get discarded are
+    never encoded."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.frames = {}
+        self.removed = []
+        self.memory = set()
+        self.spilled = {}
+        self.pixels = None
+        self.cache_bytes = 0
+        self.max_cache_bytes = FRAME_STORE_CACHE_BYTES
+        self.crop = None
+        self.decoded = 0
+        try:
+            import numpy as _
+            from collections import OrderedDict
+            from PIL import Image as _
+            self.pixels = OrderedDict()
+        except ImportError:
+            self.pixels = None
+
+    def load(self, prefix):
+        """Add the frames in the directory named <prefix><ms>.png"""
+        match = re.compile(re.escape(prefix) + r'(?P<ms>[0-9]+)\.png$')
+        for file in glob.glob(os.path.join(self.directory, prefix + '*.png')):
+            m = re.search(match, file)
+            if m is not None:
+                self.frames[int(m.groupdict().get('ms'))] = file
+
+    def times(self):
+        """Sorted list of the frame times"""
+        return sorted(self.frames.keys())
+
+    def count(self):
+        return len(self.frames)
+
+    def path(self, time):
+        """Name of the file for the given frame (it may only exist in memory)"""
+        return self.frames[time]
+
+    def file(self, time):
+        """File for the given frame, writing it out if it only exists in memory"""
+        file = self.frames[time]
+        if file in self.memory:
+            from PIL import Image
+            Image.fromarray(self.get(time)).save(file, 'PNG')
+            self.memory.discard(file)
+            if file in self.spilled:
+                self.removed.append(self.spilled.pop(file))
+        return file
+
+    def add(self, time, file, pixels=None):
+        """Add a frame from an existing file (optionally with its decoded pixels)"""
+        if time in self.frames and self.frames[time] != file:
+            self.discard(self.frames[time])
+        self.frames[time] = file
+        if pixels is not None:
+            self.cache_pixels(file, pixels)
+
+    def add_pixels(self, time, pixels, prefix='video-'):
+        """Add a frame that only exists in memory"""
+        file = os.path.join(self.directory, '{0}{1:06d}.png'.format(prefix, time))
+        self.add(time, file, pixels)
+        self.memory.add(file)
+
+    def remove(self, time):
+        """Drop the given frame (the file is deleted when the store is saved)"""
+        self.discard(self.frames.pop(time))
+
+    def discard(self, file):
+        if file in self.memory:
+            self.memory.discard(file)
+            if file in self.spilled:
+                self.removed.append(self.spilled.pop(file))
+        else:
+            self.removed.append(file)
+        self.uncache_pixels(file)
+
+    def take(self, other, time):
+        """Move a frame over from another store (used when splitting videos)"""
+        file = other.frames.pop(time)
+        pixels = None
+        if other.pixels is not None and file in other.pixels:
+            pixels = other.pixels[file]
+            other.uncache_pixels(file)
+        if file in other.memory:
+            other.memory.discard(file)
+            if pixels is None:
+                spilled = other.spilled.pop(file)
+                import numpy
+                pixels = numpy.load(spilled)
+                other.removed.append(spilled)
+            self.add_pixels(time, pixels)
+        else:
+            self.add(time, file, pixels)
+
+    def copy(self, other, time):
+        """Copy a frame from another store"""
+        pixels = other.get(time)
+        if pixels is not None:
+            self.add_pixels(time, pixels)
+        else:
+            dest = os.path.join(self.directory, os.path.basename(other.path(time)))
+            shutil.copyfile(other.path(time), dest)
+            self.add(time, dest)
+
+    def retime(self, adjust):
+        """Re-key every frame to adjust(time). Later frames win any collisions."""
+        frames = {}
+        for time in self.times():
+            new_time = adjust(time)
+            if new_time in frames:
+                self.discard(frames[new_time])
+            frames[new_time] = self.frames[time]
+        self.frames = frames
+
+    def size(self, time):
+        """Width and height of the given frame"""
+        file = self.frames[time]
+        if self.pixels is not None and (file in self.pixels or file in self.memory):
+            height, width = self.get(time).shape[:2]
+        else:
+            from PIL import Image
+            with Image.open(file) as im:
+                width, height = im.size
+        return width, height
+
+    def get(self, time):
+        """Decoded height x width x 3 pixels for the frame (None if numpy isn't available)"""
+        pixels = None
+        if self.pixels is not None:
+            import numpy
+            file = self.frames[time]
+            if file in self.pixels:
+                pixels = self.pixels.pop(file)
+                self.pixels[file] = pixels
+            elif file in self.spilled:
+                pixels = numpy.load(self.spilled[file])
+                self.cache_pixels(file, pixels)
+            else:
+                from PIL import Image
+                with Image.open(file) as im:
+                    pixels = numpy.asarray(im.convert('RGB'))
+                self.decoded += 1
+                self.cache_pixels(file, pixels)
+        return pixels
+
+    def in_memory(self, time):
+        """True if the frame hasn't been written to a file yet"""
+        return self.frames[time] in self.memory
+
+    def set_pixels(self, time, pixels):
+        """Replace the pixels for a frame (that was re-written on disk if it isn't in memory)"""
+        file = self.frames[time]
+        self.uncache_pixels(file)
+        if file in self.spilled:
+            self.removed.append(self.spilled.pop(file))
+        if pixels is not None:
+            self.cache_pixels(file, pixels)
+
+    def cache_pixels(self, file, pixels):
+        if self.pixels is not None:
+            self.uncache_pixels(file)
+            self.pixels[file] = pixels
+            self.cache_bytes += pixels.nbytes
+            while self.cache_bytes > self.max_cache_bytes and len(self.pixels) > 1:
+                evicted_file, evicted = self.pixels.popitem(last=False)
+                self.cache_bytes -= evicted.nbytes
+                if evicted_file in self.memory and evicted_file not in self.spilled:
+                    import numpy
+                    spilled = evicted_file + '.npy'
+                    numpy.save(spilled, evicted)
+                    self.spilled[evicted_file] = spilled
+
+    def uncache_pixels(self, file):
+        if self.pixels is not None and file in self.pixels:
+            self.cache_bytes -= self.pixels.pop(file).nbytes
+
+    def save(self, prefix='ms_'):
+        """Write the frames out as <prefix><ms>.png, applying any pending crop"""
+        crop = None
+        if self.crop is not None:
+            crop = '{0:d}x{1:d}+{2:d}+{3:d}'.format(self.crop['width'], self.crop['height'],
+                                                    self.crop['x'], self.crop['y'])
+            self.crop = None
+        live = set(self.frames.values())
+        for file in self.removed:
+            if file not in live and os.path.isfile(file):
+                os.remove(file)
+        self.removed = []
+        # Move everything that gets renamed out of the way first so frames
+        # can't clobber each other when the times shift
+        moves = []
+        in_memory = []
+        for time in self.times():
+            src = self.frames[time]
+            dest = os.path.join(self.directory, '{0}{1:06d}.png'.format(prefix, time))
+            if src in self.memory:
+                in_memory.append(time)
+            elif src != dest:
+                temp = dest + '.tmp'
+                os.rename(src, temp)
+                self.rename_pixels(src, temp)
+                moves.append((temp, dest))
+                self.frames[time] = dest
+        for temp, dest in moves:
+            os.rename(temp, dest)
+            self.rename_pixels(temp, dest)
+        # Frames that were only in memory get encoded for the first time (already cropped)
+        for time in in_memory:
+            src = self.frames[time]
+            dest = os.path.join(self.directory, '{0}{1:06d}.png'.format(prefix, time))
+            pixels = self.get(time)
+            if crop is not None:
+                cropped = crop_frame_pixels(pixels, crop)
+                if cropped is not None:
+                    pixels = cropped.copy()
+            from PIL import Image
+            Image.fromarray(pixels).save(dest, 'PNG')
+            self.uncache_pixels(src)
+            self.memory.discard(src)
+            if src != dest and os.path.isfile(src):
+                os.remove(src)
+            if src in self.spilled:
+                os.remove(self.spilled.pop(src))
+            self.frames[time] = dest
+            self.cache_pixels(dest, pixels)
+        if crop is not None:
+            for time in self.times():
+                if time not in in_memory:
+                    self.crop_file(time, crop)
+        logging.debug('Saved %d frames to %s (%d decoded)', len(self.frames),
+                      self.directory, self.decoded)
+
+    def rename_pixels(self, src, dest):
+        if self.pixels is not None and src in self.pixels:
+            self.pixels[dest] = self.pixels.pop(src)
+
+    def crop_file(self, time, crop):
+        """Crop a frame that is already on disk and re-write the file"""
+        file = self.frames[time]
+        pixels = self.get(time)
+        cropped = crop_frame_pixels(pixels, crop) if pixels is not None else None
+        if cropped is not None:
+            from PIL import Image
+            cropped = cropped.copy()
+            Image.fromarray(cropped).save(file, 'PNG')
+            self.set_pixels(time, cropped)
+        else:
+            command = 'convert "{0}" -crop {1} "{0}"'.format(file, crop)
+            subprocess.call(command, shell=True)
+            self.set_pixels(time, None)
 
 
 # #################################################################################################
@@ -53,6 +330,7 @@ def video_to_frames(video, directory, force, orange_file, white_file, gray_file,
     """ Extract the video frames"""
     global options
     global client_viewport
+    frames = None
     first_frame = os.path.join(directory, 'ms_000000')
     if (not os.path.isfile(first_frame + '.png')
             and not os.path.isfile(first_frame + '.jpg')) or force:
@@ -72,35 +350,44 @@ def video_to_frames(video, directory, force, orange_file, white_file, gray_file,
                 viewport = find_video_viewport(
                     video, directory, find_viewport, viewport_time)
                 gc.collect()
-                if extract_frames(video, directory, full_resolution, viewport):
+                store = None
+                if options.pipe:
+                    store = extract_frames_pipe(video, directory, full_resolution, viewport)
+                if store is None and extract_frames(video, directory, full_resolution, viewport):
+                    store = FrameStore(directory)
+                    store.load('video-')
+                if store is not None:
                     client_viewport = None
                     if find_viewport and options.notification:
-                        client_viewport = find_image_viewport(
-                            os.path.join(directory, 'video-000000.png'))
+                        client_viewport = find_image_viewport(store.file(store.times()[0]))
                     if multiple and orange_file is not None:
-                        directories = split_videos(directory, orange_file)
+                        stores = split_videos(store, orange_file)
+                        store.save()
                     else:
-                        directories = [directory]
-                    for dir in directories:
-                        trim_video_end(dir, trim_end)
+                        stores = [store]
+                    for frames in stores:
+                        trim_video_end(frames, trim_end)
                         if orange_file is not None:
-                            remove_frames_before_orange(dir, orange_file)
-                            remove_orange_frames(dir, orange_file)
-                        find_first_frame(dir, white_file)
-                        blank_first_frame(dir)
-                        find_render_start(dir, orange_file, gray_file)
-                        find_last_frame(dir, white_file)
-                        adjust_frame_times(dir)
+                            remove_frames_before_orange(frames, orange_file)
+                            remove_orange_frames(frames, orange_file)
+                        find_first_frame(frames, white_file)
+                        blank_first_frame(frames)
+                        find_render_start(frames, orange_file, gray_file)
+                        find_last_frame(frames, white_file)
+                        adjust_frame_times(frames)
                         if timeline_file is not None and not multiple:
-                            synchronize_to_timeline(dir, timeline_file)
-                        eliminate_duplicate_frames(dir)
-                        eliminate_similar_frames(dir)
+                            synchronize_to_timeline(frames, timeline_file)
+                        eliminate_duplicate_frames(frames)
+                        eliminate_similar_frames(frames)
                         # See if we are limiting the number of frames to keep
                         # (before processing them to save processing time)
                         if options.maxframes > 0:
-                            cap_frame_count(dir, options.maxframes)
-                        crop_viewport(dir)
+                            cap_frame_count(frames, options.maxframes)
+                        crop_viewport(frames)
+                        frames.save()
                         gc.collect()
+                    if multiple:
+                        frames = None
                 else:
                     logging.critical("Error extracting the video frames from %s", video)
             else:
@@ -109,6 +396,7 @@ def video_to_frames(video, directory, force, orange_file, white_file, gray_file,
             logging.critical("Input video file %s does not exist", video)
     else:
         logging.info("Extracted video already exists in %s", directory)
+    return frames
 
 
 def extract_frames(video, directory, full_resolution, viewport):
@@ -151,50 +439,134 @@ def extract_frames(video, directory, full_resolution, viewport):
     return ret
 
 
-def split_videos(directory, orange_file):
+def extract_frames_pipe(video, directory, full_resolution, viewport):
+    """Stream the decimated frames from ffmpeg into a FrameStore without writing them to disk"""
+    try:
+        import numpy
+    except ImportError:
+        logging.debug('numpy is not available, extracting the frames as png files')
+        return None
+    store = None
+    logging.info("Streaming frames from " + video)
+    decimate = get_decimate_filter()
+    if decimate is not None:
+        crop = ''
+        if viewport is not None:
+            crop = 'crop={0}:{1}:{2}:{3},'.format(
+                viewport['width'], viewport['height'], viewport['x'], viewport['y'])
+        scale = 'scale=iw*min(400/iw\\,400/ih):ih*min(400/iw\\,400/ih),'
+        if full_resolution:
+            scale = ''
+        command = ['ffmpeg', '-v', 'debug', '-i', video, '-vsync', '0',
+                   '-vf', crop + scale + decimate + '=0:64:640:0.001',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-']
+        logging.debug(' '.join(command))
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        frame_times = Queue.Queue()
+        frame_size = {}
+        size_known = threading.Event()
+        log_thread = threading.Thread(target=read_ffmpeg_log,
+                                      args=(proc.stderr, frame_times, frame_size, size_known))
+        log_thread.daemon = True
+        log_thread.start()
+        # ffmpeg always logs the output stream before writing the first frame
+        waited = 0
+        while not size_known.is_set() and log_thread.is_alive() and waited < 60:
+            size_known.wait(1)
+            waited += 1
+        if 'width' in frame_size and 'height' in frame_size:
+            width = frame_size['width']
+            height = frame_size['height']
+            frame_bytes = width * height * 3
+            store = FrameStore(directory)
+            while True:
+                data = proc.stdout.read(frame_bytes)
+                if len(data) < frame_bytes:
+                    break
+                try:
+                    timecode = frame_times.get(timeout=30)
+                except Queue.Empty:
+                    logging.critical('Missing frame timestamp from ffmpeg')
+                    break
+                frame_time = int(math.ceil(timecode * 1000))
+                pixels = numpy.frombuffer(data, dtype=numpy.uint8).reshape((height, width, 3))
+                store.add_pixels(frame_time, pixels)
+            logging.debug('Streamed %d frames (%dx%d)', store.count(), width, height)
+        else:
+            logging.critical('Unable to determine the frame size from ffmpeg')
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        log_thread.join()
+        if store is not None and not store.count():
+            store = None
+    return store
+
+
+def read_ffmpeg_log(stderr, frame_times, frame_size, size_known):
+    """Parse the ffmpeg debug log for the output frame size and the kept frame timestamps"""
+    keep = re.compile(r'keep pts:[0-9]+ pts_time:(?P<timecode>[0-9\.]+)')
+    size = re.compile(r'Stream #0:0.*Video: rawvideo.*, (?P<width>[0-9]+)x(?P<height>[0-9]+)')
+    in_output = False
+    try:
+        for line in iter(stderr.readline, ""):
+            if not size_known.is_set():
+                if line.startswith('Output #0'):
+                    in_output = True
+                elif in_output:
+                    m = re.search(size, line)
+                    if m is not None:
+                        frame_size['width'] = int(m.groupdict().get('width'))
+                        frame_size['height'] = int(m.groupdict().get('height'))
+                        size_known.set()
+            match = re.search(keep, line)
+            if match:
+                frame_times.put(float(match.groupdict().get('timecode')))
+    finally:
+        size_known.set()
+
+
+def split_videos(store, orange_file):
     """Split multiple videos on orange frame separators"""
     logging.debug(
         "Splitting video on orange frames (this may take a while)...")
-    directories = []
+    stores = []
     current = 0
     found_orange = False
-    video_dir = None
-    frames = sorted(glob.glob(os.path.join(directory, 'video-*.png')))
-    if len(frames):
-        for frame in frames:
-            if is_color_frame(frame, orange_file):
-                if not found_orange:
-                    found_orange = True
-                    # Make a copy of the orange frame for the end of the
-                    # current video
-                    if video_dir is not None:
-                        dest = os.path.join(video_dir, os.path.basename(frame))
-                        shutil.copyfile(frame, dest)
-                    current += 1
-                    video_dir = os.path.join(directory, str(current))
-                    logging.debug("Orange frame found: %s, starting video directory %s",
-                                  frame, video_dir)
-                    if not os.path.isdir(video_dir):
-                        os.mkdir(video_dir, 0o755)
-                    if os.path.isdir(video_dir):
-                        video_dir = os.path.realpath(video_dir)
-                        clean_directory(video_dir)
-                        directories.append(video_dir)
-                    else:
-                        video_dir = None
-            else:
-                found_orange = False
-            if video_dir is not None:
-                dest = os.path.join(video_dir, os.path.basename(frame))
-                os.rename(frame, dest)
-            else:
-                logging.debug("Removing spurious frame %s at the beginning", frame)
-                os.remove(frame)
-    return directories
+    video_store = None
+    for time in store.times():
+        if is_color_frame(store, time, orange_file):
+            if not found_orange:
+                found_orange = True
+                # Make a copy of the orange frame for the end of the
+                # current video
+                if video_store is not None:
+                    video_store.copy(store, time)
+                current += 1
+                video_dir = os.path.join(store.directory, str(current))
+                logging.debug("Orange frame found: %s, starting video directory %s",
+                              store.path(time), video_dir)
+                if not os.path.isdir(video_dir):
+                    os.mkdir(video_dir, 0o755)
+                if os.path.isdir(video_dir):
+                    video_dir = os.path.realpath(video_dir)
+                    clean_directory(video_dir)
+                    video_store = FrameStore(video_dir)
+                    stores.append(video_store)
+                else:
+                    video_store = None
+        else:
+            found_orange = False
+        if video_store is not None:
+            video_store.take(store, time)
+        else:
+            logging.debug("Removing spurious frame %s at the beginning", store.path(time))
+            store.remove(time)
+    return stores
 
-def remove_frames_before_orange(directory, orange_file):
+def remove_frames_before_orange(store, orange_file):
     """Remove stray frames from the start of the video"""
-    frames = sorted(glob.glob(os.path.join(directory, 'video-*.png')))
+    frames = store.times()
     if len(frames):
         # go through the first 20 frames and remove any that come before the first orange frame.
         # iOS video capture starts with a blank white frame and then flips to
@@ -205,7 +577,7 @@ def remove_frames_before_orange(directory, orange_file):
         frame_count = 0
         for frame in frames:
             frame_count += 1
-            if is_color_frame(frame, orange_file):
+            if is_color_frame(store, frame, orange_file):
                 found_orange = True
                 break
             if frame_count > 20:
@@ -214,25 +586,25 @@ def remove_frames_before_orange(directory, orange_file):
 
         if found_orange and len(remove_frames):
             for frame in remove_frames:
-                logging.debug("Removing pre-orange frame %s", frame)
-                os.remove(frame)
+                logging.debug("Removing pre-orange frame %s", store.path(frame))
+                store.remove(frame)
 
 
-def remove_orange_frames(directory, orange_file):
+def remove_orange_frames(store, orange_file):
     """Remove orange frames from the beginning of the video"""
-    frames = sorted(glob.glob(os.path.join(directory, 'video-*.png')))
+    frames = store.times()
     if len(frames):
         logging.debug("Scanning for orange frames...")
         for frame in frames:
-            if is_color_frame(frame, orange_file):
-                logging.debug("Removing Orange frame: %s", frame)
-                os.remove(frame)
+            if is_color_frame(store, frame, orange_file):
+                logging.debug("Removing Orange frame: %s", store.path(frame))
+                store.remove(frame)
             else:
                 break
         for frame in reversed(frames):
-            if is_color_frame(frame, orange_file):
-                logging.debug("Removing orange frame %s from the end", frame)
-                os.remove(frame)
+            if frame in store.frames and is_color_frame(store, frame, orange_file):
+                logging.debug("Removing orange frame %s from the end", store.path(frame))
+                store.remove(frame)
             else:
                 break
 
@@ -375,70 +747,50 @@ def find_video_viewport(video, directory, find_viewport, viewport_time):
     return viewport
 
 
-def trim_video_end(directory, trim_time):
+def trim_video_end(store, trim_time):
     if trim_time > 0:
         logging.debug(
             "Trimming " +
             str(trim_time) +
             "ms from the end of the video in " +
-            directory)
-        frames = sorted(glob.glob(os.path.join(directory, 'video-*.png')))
+            store.directory)
+        frames = store.times()
         if len(frames):
-            match = re.compile(r'video-(?P<ms>[0-9]+)\.png')
-            m = re.search(match, frames[-1])
-            if m is not None:
-                frame_time = int(m.groupdict().get('ms'))
-                end_time = frame_time - trim_time
-                logging.debug("Trimming frames before " + str(end_time) + "ms")
-                for frame in frames:
-                    m = re.search(match, frame)
-                    if m is not None:
-                        frame_time = int(m.groupdict().get('ms'))
-                        if frame_time > end_time:
-                            logging.debug("Trimming frame " + frame)
-                            os.remove(frame)
+            end_time = frames[-1] - trim_time
+            logging.debug("Trimming frames before " + str(end_time) + "ms")
+            for frame_time in frames:
+                if frame_time > end_time:
+                    logging.debug("Trimming frame " + store.path(frame_time))
+                    store.remove(frame_time)
 
 
-def adjust_frame_times(directory):
-    offset = None
-    frames = sorted(glob.glob(os.path.join(directory, 'video-*.png')))
+def adjust_frame_times(store):
+    frames = store.times()
     if len(frames):
-        match = re.compile(r'video-(?P<ms>[0-9]+)\.png')
-        for frame in frames:
-            m = re.search(match, frame)
-            if m is not None:
-                frame_time = int(m.groupdict().get('ms'))
-                if offset is None:
-                    offset = frame_time
-                new_time = frame_time - offset
-                dest = os.path.join(
-                    directory, 'ms_{0:06d}.png'.format(new_time))
-                os.rename(frame, dest)
+        offset = frames[0]
+        store.retime(lambda frame_time: frame_time - offset)
 
 
-def find_first_frame(directory, white_file):
+def find_first_frame(store, white_file):
     global options
     try:
         if options.startwhite:
-            files = sorted(glob.glob(os.path.join(directory, 'video-*.png')))
+            files = store.times()
             count = len(files)
             if count > 1:
-                from PIL import Image
                 for i in xrange(count):
-                    if is_white_frame(files[i], white_file):
+                    if is_white_frame(store, files[i], white_file):
                         break
                     else:
                         logging.debug(
-                            'Removing non-white frame {0} from the beginning'.format(files[i]))
-                        os.remove(files[i])
+                            'Removing non-white frame {0} from the beginning'.format(
+                                store.path(files[i])))
+                        store.remove(files[i])
         elif options.findstart > 0 and options.findstart <= 100:
-            files = sorted(glob.glob(os.path.join(directory, 'video-*.png')))
+            files = store.times()
             count = len(files)
             if count > 1:
-                from PIL import Image
-                blank = files[0]
-                with Image.open(blank) as im:
-                    width, height = im.size
+                width, height = store.size(files[0])
                 match_height = int(
                     math.ceil(
                         height *
@@ -455,9 +807,10 @@ def find_first_frame(directory, white_file):
                 for i in xrange(count):
                     if not found_first_change:
                         different = not frames_match(
-                            files[i], files[i + 1], 5, 100, crop, None)
-                        logging.debug('Removing early frame %s from the beginning', files[i])
-                        os.remove(files[i])
+                            store, files[i], files[i + 1], 5, 100, crop, None)
+                        logging.debug('Removing early frame %s from the beginning',
+                                      store.path(files[i]))
+                        store.remove(files[i])
                         if different:
                             first_frame = files[i + 1]
                             found_first_change = True
@@ -465,61 +818,60 @@ def find_first_frame(directory, white_file):
                         if files[i] != first_frame:
                             if found_non_white_frame:
                                 found_white_frame = is_white_frame(
-                                    files[i], white_file)
+                                    store, files[i], white_file)
                                 if not found_white_frame:
                                     logging.debug(
-                                        'Removing early non-white frame {0} from the beginning'.format(files[i]))
-                                    os.remove(files[i])
+                                        'Removing early non-white frame {0} from the beginning'.format(
+                                            store.path(files[i])))
+                                    store.remove(files[i])
                             else:
                                 found_non_white_frame = not is_white_frame(
-                                    files[i], white_file)
+                                    store, files[i], white_file)
                                 logging.debug(
-                                    'Removing early pre-non-white frame {0} from the beginning'.format(files[i]))
-                                os.remove(files[i])
+                                    'Removing early pre-non-white frame {0} from the beginning'.format(
+                                        store.path(files[i])))
+                                store.remove(files[i])
                     if found_first_change and found_white_frame:
                         break
     except BaseException:
         logging.exception('Error finding first frame')
 
 
-def find_last_frame(directory, white_file):
+def find_last_frame(store, white_file):
     global options
     try:
         if options.endwhite:
-            files = sorted(glob.glob(os.path.join(directory, 'video-*.png')))
+            files = store.times()
             count = len(files)
             if count > 2:
                 found_end = False
-                from PIL import Image
                 for i in xrange(2, count):
                     if found_end:
                         logging.debug(
                             'Removing frame {0} from the end'.format(
-                                files[i]))
-                        os.remove(files[i])
-                    if is_white_frame(files[i], white_file):
+                                store.path(files[i])))
+                        store.remove(files[i])
+                    elif is_white_frame(store, files[i], white_file):
                         found_end = True
                         logging.debug(
                             'Removing ending white frame {0}'.format(
-                                files[i]))
-                        os.remove(files[i])
+                                store.path(files[i])))
+                        store.remove(files[i])
     except BaseException:
         logging.exception('Error finding last frame')
 
 
-def find_render_start(directory, orange_file, gray_file):
+def find_render_start(store, orange_file, gray_file):
     global options
     global client_viewport
     try:
         if client_viewport is not None or options.viewport is not None or (
                 options.renderignore > 0 and options.renderignore <= 100):
-            files = sorted(glob.glob(os.path.join(directory, 'video-*.png')))
+            files = store.times()
             count = len(files)
             if count > 1:
-                from PIL import Image
                 first = files[0]
-                with Image.open(first) as im:
-                    width, height = im.size
+                width, height = store.size(first)
                 if options.renderignore > 0 and options.renderignore <= 100:
                     mask = {}
                     mask['width'] = int(
@@ -560,32 +912,30 @@ def find_render_start(directory, orange_file, gray_file):
                 crop = '{0:d}x{1:d}+{2:d}+{3:d}'.format(
                     width, height, left, top)
                 for i in xrange(1, count):
-                    if frames_match(first, files[i], 10, 500, crop, mask):
-                        logging.debug('Removing pre-render frame %s', files[i])
-                        os.remove(files[i])
-                    elif orange_file is not None and is_color_frame(files[i], orange_file):
-                        logging.debug('Removing orange frame %s', files[i])
-                        os.remove(files[i])
-                    elif gray_file is not None and is_color_frame(files[i], gray_file):
-                        logging.debug('Removing gray frame %s', files[i])
-                        os.remove(files[i])
+                    if frames_match(store, first, files[i], 10, 500, crop, mask):
+                        logging.debug('Removing pre-render frame %s', store.path(files[i]))
+                        store.remove(files[i])
+                    elif orange_file is not None and is_color_frame(store, files[i], orange_file):
+                        logging.debug('Removing orange frame %s', store.path(files[i]))
+                        store.remove(files[i])
+                    elif gray_file is not None and is_color_frame(store, files[i], gray_file):
+                        logging.debug('Removing gray frame %s', store.path(files[i]))
+                        store.remove(files[i])
                     else:
                         break
     except BaseException:
         logging.exception('Error getting render start')
 
 
-def eliminate_duplicate_frames(directory):
+def eliminate_duplicate_frames(store):
     global options
     global client_viewport
 
     try:
-        files = sorted(glob.glob(os.path.join(directory, 'ms_*.png')))
+        files = store.times()
         if len(files) > 1:
-            from PIL import Image
             blank = files[0]
-            with Image.open(blank) as im:
-                width, height = im.size
+            width, height = store.size(blank)
             if options.viewport and options.notification:
                 if client_viewport['width'] == width and client_viewport['height'] == height:
                     client_viewport = None
@@ -620,18 +970,18 @@ def eliminate_duplicate_frames(directory):
             # field.
             count = len(files)
             for i in xrange(1, count):
-                if frames_match(blank, files[i], 10, 0, crop, None):
+                if frames_match(store, blank, files[i], 10, 0, crop, None):
                     logging.debug(
                         'Removing duplicate frame {0} from the beginning'.format(
-                            files[i]))
-                    os.remove(files[i])
+                            store.path(files[i])))
+                    store.remove(files[i])
                 else:
                     break
 
             # Do another pass looking for the last frame but with an allowance for up
             # to a 10% difference in individual pixels to deal with noise
             # around text.
-            files = sorted(glob.glob(os.path.join(directory, 'ms_*.png')))
+            files = store.times()
             count = len(files)
             duplicates = []
             if count > 2:
@@ -639,33 +989,34 @@ def eliminate_duplicate_frames(directory):
                 baseline = files[0]
                 previous_frame = baseline
                 for i in xrange(1, count):
-                    if frames_match(baseline, files[i], 10, 0, crop, None):
-                        if previous_frame is baseline:
+                    if frames_match(store, baseline, files[i], 10, 0, crop, None):
+                        if previous_frame == baseline:
                             duplicates.append(previous_frame)
                         else:
                             logging.debug(
-                                'Removing duplicate frame {0} from the end'.format(previous_frame))
-                            os.remove(previous_frame)
+                                'Removing duplicate frame {0} from the end'.format(
+                                    store.path(previous_frame)))
+                            store.remove(previous_frame)
                         previous_frame = files[i]
                     else:
                         break
             for duplicate in duplicates:
                 logging.debug(
-                    'Removing duplicate frame {0} from the end'.format(duplicate))
-                os.remove(duplicate)
+                    'Removing duplicate frame {0} from the end'.format(store.path(duplicate)))
+                store.remove(duplicate)
 
     except BaseException:
         logging.exception('Error processing frames for duplicates')
 
 
-def eliminate_similar_frames(directory):
+def eliminate_similar_frames(store):
     global client_viewport
     global options
     try:
         # only do this when decimate couldn't be used to eliminate similar
         # frames
         if options.notification:
-            files = sorted(glob.glob(os.path.join(directory, 'ms_*.png')))
+            files = store.times()
             count = len(files)
             if count > 3:
                 crop = None
@@ -674,50 +1025,44 @@ def eliminate_similar_frames(directory):
                                                             client_viewport['x'], client_viewport['y'])
                 baseline = files[1]
                 for i in xrange(2, count - 1):
-                    if frames_match(baseline, files[i], 1, 0, crop, None):
+                    if frames_match(store, baseline, files[i], 1, 0, crop, None):
                         logging.debug(
                             'Removing similar frame {0}'.format(
-                                files[i]))
-                        os.remove(files[i])
+                                store.path(files[i])))
+                        store.remove(files[i])
                     else:
                         baseline = files[i]
     except BaseException:
         logging.exception('Error removing similar frames')
 
 
-def blank_first_frame(directory):
+def blank_first_frame(store):
     global options
     try:
         if options.forceblank:
-            files = sorted(glob.glob(os.path.join(directory, 'video-*.png')))
+            files = store.times()
             count = len(files)
             if count > 1:
-                from PIL import Image
-                with Image.open(files[0]) as im:
-                    width, height = im.size
-                command = 'convert -size {0}x{1} xc:white PNG24:"{2}"'.format(
-                    width, height, files[0])
-                subprocess.call(command, shell=True)
+                width, height = store.size(files[0])
+                # Frames streamed from ffmpeg only need their pixels replaced
+                if not store.in_memory(files[0]):
+                    command = 'convert -size {0}x{1} xc:white PNG24:"{2}"'.format(
+                        width, height, store.path(files[0]))
+                    subprocess.call(command, shell=True)
+                pixels = None
+                if store.pixels is not None:
+                    import numpy
+                    pixels = numpy.full((height, width, 3), 255, dtype=numpy.uint8)
+                store.set_pixels(files[0], pixels)
     except BaseException:
         logging.exception('Error blanking first frame')
 
 
-def crop_viewport(directory):
+def crop_viewport(store):
+    """Crop the frames to the viewport (applied when the store is saved)"""
     global client_viewport
-    if client_viewport is not None:
-        try:
-            files = sorted(glob.glob(os.path.join(directory, 'ms_*.png')))
-            count = len(files)
-            if count > 0:
-                crop = '{0:d}x{1:d}+{2:d}+{3:d}'.format(client_viewport['width'], client_viewport['height'],
-                                                        client_viewport['x'], client_viewport['y'])
-                for i in xrange(count):
-                    command = 'convert "{0}" -crop {1} "{0}"'.format(
-                        files[i], crop)
-                    subprocess.call(command, shell=True)
-
-        except BaseException:
-            logging.exception('Error cropping to viewport')
+    if client_viewport is not None and store.count() > 0:
+        store.crop = dict(client_viewport)
 
 
 def get_decimate_filter():
@@ -751,14 +1096,12 @@ def clean_directory(directory):
         os.remove(file)
 
 
-def is_color_frame(file, color_file):
+def is_color_frame(store, time, color_file):
     """Check a section from the middle, top and bottom of the viewport to see if it matches"""
     match = False
     if os.path.isfile(color_file):
         try:
-            from PIL import Image
-            with Image.open(file) as img:
-                width, height = img.size
+            width, height = store.size(time)
             crops = []
             # Middle
             crops.append('{0:d}x{1:d}+{2:d}+{3:d}'.format(
@@ -773,46 +1116,52 @@ def is_color_frame(file, color_file):
                 int(width / 2), int(height / 5),
                 int(width / 4), height - int(height / 5) - 50))
             for crop in crops:
-                command = ('convert "{0}" "(" "{1}" -crop {2} -resize 200x200! ")"'
-                           ' miff:- | compare -metric AE - -fuzz 10% null:'
-                          ).format(color_file, file, crop)
-                compare = subprocess.Popen(command, stderr=subprocess.PIPE, shell=True)
-                out, err = compare.communicate()
-                if re.match('^[0-9]+$', err):
-                    different_pixels = int(err)
-                    if different_pixels < 100:
-                        match = True
-                        break
+                different_pixels = resized_difference_count(color_file, store.get(time),
+                                                            crop, 10)
+                if different_pixels is None:
+                    command = ('convert "{0}" "(" "{1}" -crop {2} -resize 200x200! ")"'
+                               ' miff:- | compare -metric AE - -fuzz 10% null:'
+                              ).format(color_file, store.file(time), crop)
+                    different_pixels = imagemagick_difference_count(command)
+                if different_pixels is not None and different_pixels < 100:
+                    match = True
+                    break
         except Exception:
             pass
     return match
 
 
-def is_white_frame(file, white_file):
+def is_white_frame(store, time, white_file):
     global client_viewport
     global options
     white = False
     if os.path.isfile(white_file):
-        if options.viewport:
-            command = ('convert "{0}" "(" "{1}" -resize 200x200! ")" miff:- | '
-                       'compare -metric AE - -fuzz 10% null:').format(white_file, file)
-        else:
-            command = ('convert "{0}" "(" "{1}" -gravity Center -crop 50%x33%+0+0 -resize 200x200! ")" miff:- | '
-                       'compare -metric AE - -fuzz 10% null:').format(white_file, file)
+        crop = None
+        if not options.viewport:
+            width, height = store.size(time)
+            crop = center_crop_region(width, height, 50, 33)
         if client_viewport is not None:
             crop = '{0:d}x{1:d}+{2:d}+{3:d}'.format(
                 client_viewport['width'],
                 client_viewport['height'],
                 client_viewport['x'],
                 client_viewport['y'])
-            command = ('convert "{0}" "(" "{1}" -crop {2} -resize 200x200! ")" miff:- | '
-                       'compare -metric AE - -fuzz 10% null:').format(white_file, file, crop)
-        compare = subprocess.Popen(command, stderr=subprocess.PIPE, shell=True)
-        out, err = compare.communicate()
-        if re.match('^[0-9]+$', err):
-            different_pixels = int(err)
-            if different_pixels < 500:
-                white = True
+        different_pixels = resized_difference_count(white_file, store.get(time), crop, 10)
+        if different_pixels is None:
+            # ImageMagick needs the frame on disk
+            file = store.file(time)
+            if client_viewport is not None:
+                command = ('convert "{0}" "(" "{1}" -crop {2} -resize 200x200! ")" miff:- | '
+                           'compare -metric AE - -fuzz 10% null:').format(white_file, file, crop)
+            elif options.viewport:
+                command = ('convert "{0}" "(" "{1}" -resize 200x200! ")" miff:- | '
+                           'compare -metric AE - -fuzz 10% null:').format(white_file, file)
+            else:
+                command = ('convert "{0}" "(" "{1}" -gravity Center -crop 50%x33%+0+0 -resize 200x200! ")" miff:- | '
+                           'compare -metric AE - -fuzz 10% null:').format(white_file, file)
+            different_pixels = imagemagick_difference_count(command)
+        if different_pixels is not None and different_pixels < 500:
+            white = True
 
     return white
 
@@ -831,39 +1180,181 @@ def colors_are_similar(a, b, threshold=15):
     return similar
 
 
-def frames_match(image1, image2, fuzz_percent,
+def frames_match(store, time1, time2, fuzz_percent,
                  max_differences, crop_region, mask_rect):
     match = False
-    fuzz = ''
-    if fuzz_percent > 0:
-        fuzz = '-fuzz {0:d}% '.format(fuzz_percent)
-    crop = ''
-    if crop_region is not None:
-        crop = '-crop {0} '.format(crop_region)
-    if mask_rect is None:
-        img1 = '"{0}"'.format(image1)
-        img2 = '"{0}"'.format(image2)
-    else:
-        img1 = '( "{0}" -size {1}x{2} xc:white -geometry +{3}+{4} -compose over -composite )'.format(
-            image1, mask_rect['width'], mask_rect['height'], mask_rect['x'], mask_rect['y'])
-        img2 = '( "{0}" -size {1}x{2} xc:white -geometry +{3}+{4} -compose over -composite )'.format(
-            image2, mask_rect['width'], mask_rect['height'], mask_rect['x'], mask_rect['y'])
-    command = 'convert {0} {1} {2}miff:- | compare -metric AE - {3}null:'.format(
-        img1, img2, crop, fuzz)
-    if platform.system() != 'Windows':
-        command = command.replace('(', '\\(').replace(')', '\\)')
+    different_pixels = None
+    pixels1 = store.get(time1)
+    pixels2 = store.get(time2)
+    if pixels1 is not None and pixels2 is not None:
+        different_pixels = pixel_difference_count(pixels1, pixels2, fuzz_percent,
+                                                  crop_region, mask_rect)
+    if different_pixels is None:
+        # ImageMagick needs the frames on disk
+        image1 = store.file(time1)
+        image2 = store.file(time2)
+        fuzz = ''
+        if fuzz_percent > 0:
+            fuzz = '-fuzz {0:d}% '.format(fuzz_percent)
+        crop = ''
+        if crop_region is not None:
+            crop = '-crop {0} '.format(crop_region)
+        if mask_rect is None:
+            img1 = '"{0}"'.format(image1)
+            img2 = '"{0}"'.format(image2)
+        else:
+            img1 = '( "{0}" -size {1}x{2} xc:white -geometry +{3}+{4} -compose over -composite )'.format(
+                image1, mask_rect['width'], mask_rect['height'], mask_rect['x'], mask_rect['y'])
+            img2 = '( "{0}" -size {1}x{2} xc:white -geometry +{3}+{4} -compose over -composite )'.format(
+                image2, mask_rect['width'], mask_rect['height'], mask_rect['x'], mask_rect['y'])
+        command = 'convert {0} {1} {2}miff:- | compare -metric AE - {3}null:'.format(
+            img1, img2, crop, fuzz)
+        if platform.system() != 'Windows':
+            command = command.replace('(', '\\(').replace(')', '\\)')
+        different_pixels = imagemagick_difference_count(command)
+    if different_pixels is not None and different_pixels <= max_differences:
+        match = True
+
+    return match
+
+
+def imagemagick_difference_count(command):
+    """Run a convert | compare -metric AE pipeline and return the number of different pixels"""
+    different_pixels = None
     compare = subprocess.Popen(command, stderr=subprocess.PIPE, shell=True)
     out, err = compare.communicate()
     if re.match('^[0-9]+$', err):
         different_pixels = int(err)
-        if different_pixels <= max_differences:
-            match = True
     else:
         logging.debug(
             'Unexpected compare result: out: "{0}", err: "{1}"'.format(
                 out, err))
+    return different_pixels
 
-    return match
+
+##########################################################################
+#   In-process frame comparison
+##########################################################################
+# The comparisons below mirror the "compare -metric AE -fuzz N%" pipelines
+# without forking ImageMagick for every frame. They all return None when
+# numpy/PIL are not available or the inputs are something the in-process
+# path does not handle (the caller then falls back to ImageMagick).
+
+FRAME_CACHE_SIZE = 8
+CROP_REGION_RE = re.compile(r'^(\d+)x(\d+)\+(\d+)\+(\d+)$')
+frame_cache = None
+
+
+def load_frame_pixels(file):
+    """Decode a frame into a height x width x 3 array (cached for repeated baselines)"""
+    global frame_cache
+    pixels = None
+    try:
+        import numpy
+        from collections import OrderedDict
+        from PIL import Image
+
+        if frame_cache is None:
+            frame_cache = OrderedDict()
+        stat = os.stat(file)
+        key = (os.path.realpath(file), stat.st_mtime, stat.st_size)
+        if key in frame_cache:
+            pixels = frame_cache.pop(key)
+        else:
+            with Image.open(file) as im:
+                pixels = numpy.asarray(im.convert('RGB'))
+        frame_cache[key] = pixels
+        while len(frame_cache) > FRAME_CACHE_SIZE:
+            frame_cache.popitem(last=False)
+    except Exception:
+        pixels = None
+    return pixels
+
+
+def crop_frame_pixels(pixels, crop_region):
+    """Apply a WxH+X+Y crop the same way ImageMagick does (clipped to the image)"""
+    if crop_region is None:
+        return pixels
+    match = CROP_REGION_RE.match(crop_region)
+    if match is None:
+        return None
+    width, height, x, y = [int(value) for value in match.groups()]
+    image_height, image_width = pixels.shape[:2]
+    if width <= 0 or height <= 0 or x >= image_width or y >= image_height:
+        return None
+    return pixels[y:min(y + height, image_height), x:min(x + width, image_width)]
+
+
+def center_crop_region(width, height, width_percent, height_percent):
+    """Equivalent of -gravity Center -crop W%xH%+0+0 as an explicit crop region"""
+    crop_width = int(math.floor(width * width_percent / 100.0 + 0.5))
+    crop_height = int(math.floor(height * height_percent / 100.0 + 0.5))
+    return '{0:d}x{1:d}+{2:d}+{3:d}'.format(crop_width, crop_height,
+                                            int((width - crop_width) / 2),
+                                            int((height - crop_height) / 2))
+
+
+def count_different_pixels(pixels1, pixels2, fuzz_percent):
+    """Count the pixels that "compare -metric AE -fuzz N%" counts as different.
+    ImageMagick compares the squared color distance (summed across the channels)
+    against the square of the fuzz distance."""
+    import numpy
+    delta = pixels1.astype(numpy.int32) - pixels2.astype(numpy.int32)
+    distance = (delta * delta).sum(axis=2)
+    fuzz = fuzz_percent * 255.0 / 100.0
+    different = distance > fuzz * fuzz
+    return int(numpy.count_nonzero(different))
+
+
+def pixel_difference_count(pixels1, pixels2, fuzz_percent, crop_region, mask_rect):
+    """In-process equivalent of the frames_match ImageMagick pipeline"""
+    try:
+        if pixels1.shape != pixels2.shape:
+            return None
+        if mask_rect is not None:
+            pixels1 = pixels1.copy()
+            pixels2 = pixels2.copy()
+            for pixels in [pixels1, pixels2]:
+                pixels[mask_rect['y']:mask_rect['y'] + mask_rect['height'],
+                       mask_rect['x']:mask_rect['x'] + mask_rect['width']] = 255
+        pixels1 = crop_frame_pixels(pixels1, crop_region)
+        pixels2 = crop_frame_pixels(pixels2, crop_region)
+        if pixels1 is None or pixels2 is None:
+            return None
+        return count_different_pixels(pixels1, pixels2, fuzz_percent)
+    except Exception:
+        logging.exception('Error comparing frames in-process')
+    return None
+
+
+def frame_difference_count(image1, image2, fuzz_percent, crop_region, mask_rect):
+    """Compare two frame files in-process (None if they can't be compared here)"""
+    pixels1 = load_frame_pixels(image1)
+    pixels2 = load_frame_pixels(image2)
+    if pixels1 is None or pixels2 is None:
+        return None
+    return pixel_difference_count(pixels1, pixels2, fuzz_percent, crop_region, mask_rect)
+
+
+def resized_difference_count(reference_file, pixels, crop_region, fuzz_percent):
+    """In-process equivalent of comparing a reference against a region resized to 200x200"""
+    try:
+        import numpy
+        from PIL import Image
+
+        reference = load_frame_pixels(reference_file)
+        if reference is None or pixels is None:
+            return None
+        pixels = crop_frame_pixels(pixels, crop_region)
+        if pixels is None:
+            return None
+        resized = numpy.asarray(Image.fromarray(pixels).resize((200, 200), Image.LANCZOS))
+        if reference.shape != resized.shape:
+            return None
+        return count_different_pixels(reference, resized, fuzz_percent)
+    except Exception:
+        logging.exception('Error comparing frame to reference in-process')
+    return None
 
 
 def generate_orange_png(orange_file):
@@ -904,22 +1395,10 @@ def generate_white_png(white_file):
         logging.exception('Error generating white png ' + white_file)
 
 
-def synchronize_to_timeline(directory, timeline_file):
+def synchronize_to_timeline(store, timeline_file):
     offset = get_timeline_offset(timeline_file)
     if offset > 0:
-        frames = sorted(glob.glob(os.path.join(directory, 'ms_*.png')))
-        match = re.compile(r'ms_(?P<ms>[0-9]+)\.png')
-        for frame in frames:
-            m = re.search(match, frame)
-            if m is not None:
-                frame_time = int(m.groupdict().get('ms'))
-                new_time = max(frame_time - offset, 0)
-                dest = os.path.join(
-                    directory, 'ms_{0:06d}.png'.format(new_time))
-                if frame != dest:
-                    if os.path.isfile(dest):
-                        os.remove(dest)
-                    os.rename(frame, dest)
+        store.retime(lambda frame_time: max(frame_time - offset, 0))
 
 
 def get_timeline_offset(timeline_file):
@@ -1028,7 +1507,7 @@ def get_timeline_event_navigate_time(timeline_event):
 ##########################################################################
 
 
-def calculate_histograms(directory, histograms_file, force):
+def calculate_histograms(directory, histograms_file, force, frames=None):
     if not os.path.isfile(histograms_file) or force:
         try:
             extension = None
@@ -1038,24 +1517,39 @@ def calculate_histograms(directory, histograms_file, force):
                 extension = '.png'
             elif os.path.isfile(first_frame + '.jpg'):
                 extension = '.jpg'
+            if frames is not None and (frames.directory != directory or extension != '.png'):
+                frames = None
             if extension is not None:
                 histograms = []
-                frames = sorted(
-                    glob.glob(
-                        os.path.join(
-                            directory,
-                            'ms_*' +
-                            extension)))
-                match = re.compile(r'ms_(?P<ms>[0-9]+)\.')
-                for frame in frames:
-                    m = re.search(match, frame)
-                    if m is not None:
-                        frame_time = int(m.groupdict().get('ms'))
-                        histogram = calculate_image_histogram(frame)
-                        gc.collect()
+                if frames is not None:
+                    # Re-use the frames that were already decoded during extraction
+                    for frame_time in frames.times():
+                        histogram = None
+                        pixels = frames.get(frame_time)
+                        if pixels is not None:
+                            histogram = calculate_pixels_histogram(pixels)
+                        if histogram is None:
+                            histogram = calculate_image_histogram(frames.file(frame_time))
                         if histogram is not None:
                             histograms.append(
                                 {'time': frame_time, 'histogram': histogram})
+                else:
+                    files = sorted(
+                        glob.glob(
+                            os.path.join(
+                                directory,
+                                'ms_*' +
+                                extension)))
+                    match = re.compile(r'ms_(?P<ms>[0-9]+)\.')
+                    for frame in files:
+                        m = re.search(match, frame)
+                        if m is not None:
+                            frame_time = int(m.groupdict().get('ms'))
+                            histogram = calculate_image_histogram(frame)
+                            if histogram is not None:
+                                histograms.append(
+                                    {'time': frame_time, 'histogram': histogram})
+                gc.collect()
                 if os.path.isfile(histograms_file):
                     os.remove(histograms_file)
                 f = gzip.open(histograms_file, 'wb')
@@ -1076,29 +1570,67 @@ def calculate_image_histogram(file):
         from PIL import Image
 
         im = Image.open(file)
-        width, height = im.size
-        pixels = im.load()
-        histogram = {'r': [0 for i in xrange(256)],
-                     'g': [0 for i in xrange(256)],
-                     'b': [0 for i in xrange(256)]}
-        for y in xrange(height):
-            for x in xrange(width):
-                try:
-                    pixel = pixels[x, y]
-                    # Don't include White pixels (with a tiny bit of slop for
-                    # compression artifacts)
-                    if pixel[0] < 250 or pixel[1] < 250 or pixel[2] < 250:
-                        histogram['r'][pixel[0]] += 1
-                        histogram['g'][pixel[1]] += 1
-                        histogram['b'][pixel[2]] += 1
-                except BaseException:
-                    pass
+        histogram = calculate_image_histogram_numpy(im)
+        if histogram is None:
+            histogram = calculate_image_histogram_python(im)
     except BaseException:
         histogram = None
         logging.exception('Error calculating histogram for ' + file)
     return histogram
 
 
+def calculate_image_histogram_python(im):
+    """Walk the image one pixel at a time (used when numpy isn't available)"""
+    width, height = im.size
+    pixels = im.load()
+    histogram = {'r': [0 for i in xrange(256)],
+                 'g': [0 for i in xrange(256)],
+                 'b': [0 for i in xrange(256)]}
+    for y in xrange(height):
+        for x in xrange(width):
+            try:
+                pixel = pixels[x, y]
+                # Don't include White pixels (with a tiny bit of slop for
+                # compression artifacts)
+                if pixel[0] < 250 or pixel[1] < 250 or pixel[2] < 250:
+                    histogram['r'][pixel[0]] += 1
+                    histogram['g'][pixel[1]] += 1
+                    histogram['b'][pixel[2]] += 1
+            except BaseException:
+                pass
+    return histogram
+
+
+def calculate_image_histogram_numpy(im):
+    """Calculate the histogram for the whole frame at once.
+    Returns None if numpy isn't available or the image isn't RGB(A)."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    # Single-channel and palette images don't have per-pixel r/g/b tuples so
+    # leave them for the pure-python path to keep the results identical.
+    if im.mode not in ['RGB', 'RGBA', 'RGBX']:
+        return None
+    return calculate_pixels_histogram(numpy.asarray(im))
+
+
+def calculate_pixels_histogram(pixels):
+    """Histogram of the non-white pixels in a height x width x channels array"""
+    import numpy
+    histogram = None
+    if pixels.ndim == 3 and pixels.shape[2] >= 3:
+        pixels = pixels[:, :, :3].reshape(-1, 3)
+        # Don't include White pixels (with a tiny bit of slop for
+        # compression artifacts)
+        pixels = pixels[(pixels < 250).any(axis=1)]
+        histogram = {}
+        for index, channel in enumerate(['r', 'g', 'b']):
+            histogram[channel] = numpy.bincount(pixels[:, index],
+                                                minlength=256).tolist()
+    return histogram
+
+
 ##########################################################################
 #   Screen Shots
 ##########################################################################
@@ -1196,9 +1728,8 @@ def render_video(directory, video_file):
 ##########################################################################
 #   Reduce the number of saved video frames if necessary
 ##########################################################################
-def cap_frame_count(directory, maxframes):
-    directory = os.path.realpath(directory)
-    frames = sorted(glob.glob(os.path.join(directory, 'ms_*.png')))
+def cap_frame_count(store, maxframes):
+    frames = store.times()
     frame_count = len(frames)
     if frame_count > maxframes:
         # First pass, sample all video frames at 10fps instead of 60fps,
@@ -1207,9 +1738,9 @@ def cap_frame_count(directory, maxframes):
             'Sampling 10fps: Reducing {0:d} frames to target of {1:d}...'.format(
                 frame_count, maxframes))
         skip_frames = int(maxframes * 0.2)
-        sample_frames(frames, 100, 0, skip_frames)
+        sample_frames(store, frames, 100, 0, skip_frames)
 
-        frames = sorted(glob.glob(os.path.join(directory, 'ms_*.png')))
+        frames = store.times()
         frame_count = len(frames)
         if frame_count > maxframes:
             # Second pass, sample all video frames after the first 5 seconds at
@@ -1218,9 +1749,9 @@ def cap_frame_count(directory, maxframes):
                 'Sampling 2fps: Reducing {0:d} frames to target of {1:d}...'.format(
                     frame_count, maxframes))
             skip_frames = int(maxframes * 0.4)
-            sample_frames(frames, 500, 5000, skip_frames)
+            sample_frames(store, frames, 500, 5000, skip_frames)
 
-            frames = sorted(glob.glob(os.path.join(directory, 'ms_*.png')))
+            frames = store.times()
             frame_count = len(frames)
             if frame_count > maxframes:
                 # Third pass, sample all video frames after the first 10
@@ -1229,45 +1760,38 @@ def cap_frame_count(directory, maxframes):
                     'Sampling 1fps: Reducing {0:d} frames to target of {1:d}...'.format(
                         frame_count, maxframes))
                 skip_frames = int(maxframes * 0.6)
-                sample_frames(frames, 1000, 10000, skip_frames)
+                sample_frames(store, frames, 1000, 10000, skip_frames)
 
     logging.debug(
         '{0:d} frames final count with a target max of {1:d} frames...'.format(
             frame_count, maxframes))
 
 
-def sample_frames(frames, interval, start_ms, skip_frames):
+def sample_frames(store, frames, interval, start_ms, skip_frames):
     frame_count = len(frames)
     if frame_count > 3:
         # Always keep the first and last frames, only sample in the middle
         first_frame = frames[0]
         first_change = frames[1]
         last_frame = frames[-1]
-        match = re.compile(r'ms_(?P<ms>[0-9]+)\.')
-        m = re.search(match, first_change)
-        first_change_time = 0
-        if m is not None:
-            first_change_time = int(m.groupdict().get('ms'))
+        first_change_time = first_change
         last_bucket = None
         logging.debug('Sapling frames in {0:d}ms intervals after {1:d} ms, skipping {2:d} frames...'.format(interval,
                                                                                                             first_change_time + start_ms,
                                                                                                             skip_frames))
         frame_count = 0
-        for frame in frames:
-            m = re.search(match, frame)
-            if m is not None:
-                frame_count += 1
-                frame_time = int(m.groupdict().get('ms'))
-                frame_bucket = int(math.floor(frame_time / interval))
-                if (frame_time > first_change_time + start_ms and
-                        frame_bucket == last_bucket and
-                        frame != first_frame and
-                        frame != first_change and
-                        frame != last_frame and
-                        frame_count > skip_frames):
-                    logging.debug('Removing sampled frame ' + frame)
-                    os.remove(frame)
-                last_bucket = frame_bucket
+        for frame_time in frames:
+            frame_count += 1
+            frame_bucket = int(math.floor(frame_time / interval))
+            if (frame_time > first_change_time + start_ms and
+                    frame_bucket == last_bucket and
+                    frame_time != first_frame and
+                    frame_time != first_change and
+                    frame_time != last_frame and
+                    frame_count > skip_frames):
+                logging.debug('Removing sampled frame ' + store.path(frame_time))
+                store.remove(frame_time)
+            last_bucket = frame_bucket
 
 
 ##########################################################################
@@ -1275,7 +1799,8 @@ def sample_frames(frames, interval, start_ms, skip_frames):
 ##########################################################################
 
 
-def calculate_visual_metrics(histograms_file, start, end, perceptual, dirs):
+def calculate_visual_metrics(histograms_file, start, end, perceptual, dirs,
+                             ssim_cache_file=None):
     metrics = None
     histograms = load_histograms(histograms_file, start, end)
     if histograms is not None and len(histograms) > 0:
@@ -1291,7 +1816,8 @@ def calculate_visual_metrics(histograms_file, start, end, perceptual, dirs):
             ]
             if perceptual:
                 metrics.append({'name': 'Perceptual Speed Index',
-                                'value': calculate_perceptual_speed_index(progress, dirs)})
+                                'value': calculate_perceptual_speed_index(progress, dirs,
+                                                                           ssim_cache_file)})
         else:
             metrics = [
                 {'name': 'First Visual Change',
@@ -1334,11 +1860,18 @@ def load_histograms(histograms_file, start, end):
 
 
 def calculate_visual_progress(histograms):
+    global options
     progress = []
     first = histograms[0]['histogram']
     last = histograms[-1]['histogram']
+    frames_progress = None
+    if options is None or options.progress_engine == 'numpy':
+        frames_progress = calculate_frames_progress_numpy(histograms, first, last)
     for index, histogram in enumerate(histograms):
-        p = calculate_frame_progress(histogram['histogram'], first, last)
+        if frames_progress is not None:
+            p = frames_progress[index]
+        else:
+            p = calculate_frame_progress(histogram['histogram'], first, last)
         progress.append({'time': histogram['time'],
                          'progress': p})
         logging.debug(
@@ -1375,6 +1908,44 @@ def calculate_frame_progress(histogram, start, final):
     return math.floor(progress * 100)
 
 
+def calculate_frames_progress_numpy(histograms, start, final):
+    """Same as calculate_frame_progress but for all of the frames at once.
+    The start/final deltas are only calculated once and the greedy bucket matching
+    runs on every frame in parallel. Returns None if numpy isn't available."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    slop = 5  # allow for matching slight color variations
+    buckets = 256
+    frame_count = len(histograms)
+    total = 0
+    matched = numpy.zeros(frame_count, dtype=numpy.int64)
+    for channel in ['r', 'g', 'b']:
+        first = numpy.array(start[channel], dtype=numpy.int64)
+        targets = numpy.abs(numpy.array(final[channel], dtype=numpy.int64) - first)
+        if not targets.any():
+            continue
+        available = numpy.abs(numpy.array([histogram['histogram'][channel]
+                                           for histogram in histograms],
+                                          dtype=numpy.int64) - first)
+        for i in numpy.flatnonzero(targets):
+            total += int(targets[i])
+            target = numpy.full(frame_count, targets[i], dtype=numpy.int64)
+            for j in xrange(max(0, i - slop), min(buckets, i + slop)):
+                this_match = numpy.minimum(target, available[:, j])
+                available[:, j] -= this_match
+                matched += this_match
+                target -= this_match
+                if not target.any():
+                    break
+    progress = []
+    for frame_matched in matched.tolist():
+        frame_progress = (float(frame_matched) / float(total)) if total else 1
+        progress.append(math.floor(frame_progress * 100))
+    return progress
+
+
 def find_visually_complete(progress):
     time = 0
     for p in progress:
@@ -1398,20 +1969,21 @@ def calculate_speed_index(progress):
     return int(si)
 
 
-def calculate_perceptual_speed_index(progress, directory):
-    from ssim import compute_ssim
+def calculate_perceptual_speed_index(progress, directory, ssim_cache_file=None):
     x = len(progress)
     dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), directory)
-    first_paint_frame = os.path.join(
-        dir, "ms_{0:06d}.png".format(
-            progress[1]["time"]))
     target_frame = os.path.join(
         dir, "ms_{0:06d}.png".format(progress[x - 1]["time"]))
-    ssim_1 = compute_ssim(first_paint_frame, target_frame)
-    per_si = float(progress[1]['time'])
-    last_ms = progress[1]['time']
     # Full Path of the Target Frame
     logging.debug("Target image for perSI is %s" % target_frame)
+    # The SSIM of the last frame is never used (it is the target)
+    frame_times = set([p['time'] for p in progress[1:x - 1]])
+    frame_times.add(progress[1]['time'])
+    ssim_values = calculate_ssim_values(dir, sorted(frame_times), target_frame,
+                                        ssim_cache_file)
+    ssim_1 = ssim_values[progress[1]['time']]
+    per_si = float(progress[1]['time'])
+    last_ms = progress[1]['time']
     ssim = ssim_1
     for p in progress[1:]:
         elapsed = p['time'] - last_ms
@@ -1419,14 +1991,122 @@ def calculate_perceptual_speed_index(progress, directory):
         # Full Path of the Current Frame
         current_frame = os.path.join(dir, "ms_{0:06d}.png".format(p["time"]))
         logging.debug("Current Image is %s" % current_frame)
-        # Takes full path of PNG frames to compute SSIM value
         per_si += elapsed * (1.0 - ssim)
-        ssim = compute_ssim(current_frame, target_frame)
-        gc.collect()
+        if p['time'] in ssim_values:
+            ssim = ssim_values[p['time']]
         last_ms = p['time']
     return int(per_si)
 
 
+def calculate_ssim_values(directory, frame_times, target_frame, cache_file):
+    """SSIM of each of the frames against the target frame.
+    If there is a cache file the results are cached by the hashes of the frame and
+    target files. Anything missing is calculated across a process pool."""
+    import multiprocessing
+    cache = load_ssim_cache(cache_file)
+    target_hash = file_hash(target_frame) if cache_file is not None else None
+    now = int(time.time())
+    values = {}
+    pending = []
+    for frame_time in frame_times:
+        frame = os.path.join(directory, "ms_{0:06d}.png".format(frame_time))
+        key = None
+        if target_hash is not None:
+            key = '{0}:{1}'.format(file_hash(frame), target_hash)
+        if key in cache:
+            values[frame_time] = cache[key][0]
+            cache[key][1] = now
+        else:
+            pending.append((frame_time, frame, key))
+    if cache_file is not None:
+        logging.debug('SSIM cache: %d hits, %d to calculate', len(values), len(pending))
+    if pending:
+        frames = [frame for _, frame, _ in pending]
+        processes = min(multiprocessing.cpu_count(), len(frames))
+        if processes > 1:
+            pool = multiprocessing.Pool(processes, init_ssim_worker, (target_frame,))
+            try:
+                results = pool.map(compute_frame_ssim, frames)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            init_ssim_worker(target_frame)
+            results = [compute_frame_ssim(frame) for frame in frames]
+        for (frame_time, _, key), value in zip(pending, results):
+            values[frame_time] = value
+            if key is not None:
+                cache[key] = [value, now]
+    save_ssim_cache(cache_file, cache)
+    return values
+
+
+def init_ssim_worker(target_frame):
+    """Load the target frame once per worker process"""
+    global ssim_target
+    from ssim import SSIM
+    from ssim.utils import get_gaussian_kernel
+    ssim_target = {'file': target_frame,
+                   'ssim': SSIM(target_frame, get_gaussian_kernel(11, 1.5))}
+
+
+def compute_frame_ssim(frame):
+    """SSIM of a single frame against the pre-loaded target"""
+    global ssim_target
+    from PIL import Image
+    from ssim import compute_ssim
+    with Image.open(frame) as im:
+        size = im.size
+    if size == ssim_target['ssim'].img.size:
+        value = ssim_target['ssim'].ssim_value(frame)
+    else:
+        # compute_ssim resizes the target to the frame size
+        value = compute_ssim(frame, ssim_target['file'])
+    return float(value)
+
+
+def file_hash(file):
+    import hashlib
+    with open(file, 'rb') as f_in:
+        return hashlib.md5(f_in.read()).hexdigest()
+
+
+def load_ssim_cache(cache_file):
+    """SSIM values keyed by frame and target hash as [value, last used time] pairs"""
+    cache = {}
+    if cache_file is not None and os.path.isfile(cache_file):
+        try:
+            with gzip.open(cache_file, 'rb') as f_in:
+                cache = json.load(f_in)
+            cache = dict((key, entry) for key, entry in cache.iteritems()
+                         if isinstance(entry, list) and len(entry) == 2)
+        except Exception:
+            logging.exception('Error loading SSIM cache ' + cache_file)
+            cache = {}
+    return cache
+
+
+def save_ssim_cache(cache_file, cache):
+    """Evict the least recently used values and write the cache"""
+    if cache_file is not None:
+        if len(cache) > SSIM_CACHE_SIZE:
+            keys = sorted(cache, key=lambda key: cache[key][1], reverse=True)
+            for key in keys[SSIM_CACHE_SIZE:]:
+                del cache[key]
+        try:
+            cache_dir = os.path.dirname(os.path.realpath(cache_file))
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            tmp_file = cache_file + '.tmp'
+            with gzip.open(tmp_file, 'wb') as f_out:
+                json.dump(cache, f_out)
+            if os.path.isfile(cache_file):
+                os.remove(cache_file)
+            os.rename(tmp_file, cache_file)
+        except Exception:
+            logging.exception('Error saving SSIM cache ' + cache_file)
+
+
 ##########################################################################
 #   Check any dependencies
 ##########################################################################
@@ -1465,6 +2145,14 @@ def check_config():
         print 'FAIL'
         ok = False
 
+    print 'NumPy:   ',
+    try:
+        import numpy
+
+        print 'OK'
+    except BaseException:
+        print 'Not installed (optional, used for faster frame analysis)'
+
     print 'SSIM:    ',
     try:
         from ssim import compute_ssim
@@ -1534,6 +2222,9 @@ def main():
                              "(if specified, frames will be converted to JPEG).")
     parser.add_argument('-l', '--full', action='store_true', default=False,
                         help="Keep full-resolution images instead of resizing to 400x400 pixels")
+    parser.add_argument('--pipe', action='store_true', default=False,
+                        help="Stream the frames from ffmpeg instead of writing every frame as a "
+                             "png (only the frames that are kept get written, requires numpy).")
     parser.add_argument('-f', '--force', action='store_true', default=False,
                         help="Force processing of a video file (overwrite existing directory).")
     parser.add_argument('-o', '--orange', action='store_true', default=False,
@@ -1580,6 +2271,12 @@ def main():
                              "sampling (to 10fps, 1fps, etc).")
     parser.add_argument('-k', '--perceptual', action='store_true', default=False,
                         help="Calculate perceptual Speed Index")
+    parser.add_argument('--ssimcache',
+                        help="File for caching the perceptual Speed Index SSIM values across runs "
+                             "(should be outside of the test results, no caching by default).")
+    parser.add_argument('--progress-engine', choices=['numpy', 'python'], default='numpy',
+                        help="Implementation to use for calculating the visual progress "
+                             "(numpy falls back to python if it isn't installed).")
     parser.add_argument('-j', '--json', action='store_true', default=False,
                         help="Set output format to JSON")
 
@@ -1630,6 +2327,7 @@ def main():
     try:
         if not options.check:
             viewport = None
+            frames = None
             if options.video:
                 orange_file = None
                 if options.orange:
@@ -1652,17 +2350,18 @@ def main():
                     if not os.path.isfile(gray_file):
                         gray_file = os.path.join(temp_dir, 'gray.png')
                         generate_gray_png(gray_file)
-                video_to_frames(options.video, directory, options.force, orange_file,
-                                white_file, gray_file, options.multiple, options.viewport,
-                                options.viewporttime, options.full, options.timeline,
-                                options.trimend)
+                frames = video_to_frames(options.video, directory, options.force, orange_file,
+                                         white_file, gray_file, options.multiple, options.viewport,
+                                         options.viewporttime, options.full, options.timeline,
+                                         options.trimend)
             if not options.multiple:
                 if options.render is not None:
                     render_video(directory, options.render)
                 # Calculate the histograms and visual metrics
-                calculate_histograms(directory, histogram_file, options.force)
+                calculate_histograms(directory, histogram_file, options.force, frames)
                 metrics = calculate_visual_metrics(histogram_file, options.start, options.end,
-                                                   options.perceptual, directory)
+                                                   options.perceptual, directory,
+                                                   options.ssimcache)
                 if options.screenshot is not None:
                     quality = 30
                     if options.quality is not None:
@@ -94,21 +94,26 @@ class VideoProcessing(object):
             subprocess.call(args)
 
     def frames_match(self, image1, image2, crop_region, fuzz_percent, max_differences):
-        """Compare video frames"""
-        crop = ''
-        if crop_region is not None:
-            crop = '-crop {0} '.format(crop_region)
+        """Compare video frames (in-process when possible, falling back to ImageMagick)"""
+        from internal.support.visualmetrics import frame_difference_count
         match = False
-        command = 'convert {0} {1} {2}miff:- | compare -metric AE -'.format(image1, image2, crop)
-        if fuzz_percent > 0:
-            command += ' -fuzz {0:d}%'.format(fuzz_percent)
-        command += ' null:'.format()
-        compare = subprocess.Popen(command, stderr=subprocess.PIPE, shell=True)
-        _, err = compare.communicate()
-        if re.match('^[0-9]+$', err):
-            different_pixels = int(err)
-            if different_pixels <= max_differences:
-                match = True
+        different_pixels = frame_difference_count(image1, image2, fuzz_percent,
+                                                  crop_region, None)
+        if different_pixels is None:
+            crop = ''
+            if crop_region is not None:
+                crop = '-crop {0} '.format(crop_region)
+            command = 'convert {0} {1} {2}miff:- | compare -metric AE -'.format(image1, image2,
+                                                                               crop)
+            if fuzz_percent > 0:
+                command += ' -fuzz {0:d}%'.format(fuzz_percent)
+            command += ' null:'.format()
+            compare = subprocess.Popen(command, stderr=subprocess.PIPE, shell=True)
+            _, err = compare.communicate()
+            if re.match('^[0-9]+$', err):
+                different_pixels = int(err)
+        if different_pixels is not None and different_pixels <= max_differences:
+            match = True
         return match
 
     def cap_frame_count(self, directory, maxframes):
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Microbenchmark for the ws4py frame masking and UTF-8 validation.
+
+Times Frame.mask and Utf8Validator.validate on 1KB, 1MB and 16MB payloads
+along with the original octet-at-a-time implementations (those are skipped
+for payloads over 1MB unless --reference is passed since they take seconds per call).
+
+    python misc/ws4py_benchmark.py [-r] [-n ITERATIONS]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from ws4py.framing import Frame
+from ws4py.utf8validator import Utf8Validator
+
+SIZES = [('1KB', 1024), ('1MB', 1024 * 1024), ('16MB', 16 * 1024 * 1024)]
+REFERENCE_MAX_SIZE = 1024 * 1024
+
+
+def reference_mask(key, data):
+    """Per-octet masking loop that Frame.mask replaced"""
+    masked = bytearray(data)
+    key = bytearray(key)
+    for i in range(len(data)):
+        masked[i] = masked[i] ^ key[i % 4]
+    return masked
+
+
+def reference_validate(data):
+    """Per-octet DFA walk that Utf8Validator.validate replaced"""
+    dfa = Utf8Validator.UTF8VALIDATOR_DFA
+    state = Utf8Validator.UTF8_ACCEPT
+    for b in data:
+        state = dfa[256 + (state << 4) + dfa[b]]
+        if state == Utf8Validator.UTF8_REJECT:
+            return False
+    return state == Utf8Validator.UTF8_ACCEPT
+
+
+def utf8_payload(size):
+    """Mostly ASCII text with 2, 3 and 4 byte sequences mixed in, truncated on a code point"""
+    rand = random.Random(0)
+    chars = [u'a', u'b', u' ', u'\xe9', u'\u4e2d', u'\U0001f600']
+    block = u''.join(rand.choice(chars) for _ in range(65536)).encode('utf-8')
+    data = bytearray(block * (size // len(block) + 1))
+    length = size
+    while length > 0 and (data[length] & 0xC0) == 0x80:
+        length -= 1
+    return data[:length]
+
+
+def time_call(func, iterations):
+    """Best wall time of a call in ms"""
+    best = None
+    for _ in range(iterations):
+        start = time.time()
+        func()
+        elapsed = (time.time() - start) * 1000.0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ws4py masking and UTF-8 validation benchmark.')
+    parser.add_argument('-n', '--iterations', type=int, default=5,
+                        help="Number of runs for each measurement (the best one is reported).")
+    parser.add_argument('-r', '--reference', action='store_true', default=False,
+                        help="Also time the octet-at-a-time implementations on 16MB.")
+    options = parser.parse_args()
+
+    key = bytearray(os.urandom(4))
+    frame = Frame(masking_key=bytes(key))
+    print('{0:<10}{1:>6}{2:>14}{3:>14}'.format('', 'size', 'ms', 'reference ms'))
+    for name, size in SIZES:
+        data = bytearray(os.urandom(size))
+        iterations = options.iterations if size <= REFERENCE_MAX_SIZE else 1
+        elapsed = time_call(lambda: frame.mask(data), iterations)
+        reference = ''
+        if options.reference or size <= REFERENCE_MAX_SIZE:
+            if frame.mask(data) != reference_mask(key, data):
+                print('mask mismatch at {0}'.format(name))
+                return 1
+            reference = '{0:0.2f}'.format(time_call(lambda: reference_mask(key, data), 1))
+        print('{0:<10}{1:>6}{2:>14.2f}{3:>14}'.format('mask', name, elapsed, reference))
+    for name, size in SIZES:
+        data = utf8_payload(size)
+        iterations = options.iterations if size <= REFERENCE_MAX_SIZE else 1
+
+        def validate():
+            validator = Utf8Validator()
+            return validator.validate(data)
+        elapsed = time_call(validate, iterations)
+        reference = ''
+        if options.reference or size <= REFERENCE_MAX_SIZE:
+            result = validate()
+            if not result[0] or not result[1] or not reference_validate(data):
+                print('validate mismatch at {0}'.format(name))
+                return 1
+            reference = '{0:0.2f}'.format(time_call(lambda: reference_validate(data), 1))
+        print('{0:<10}{1:>6}{2:>14.2f}{3:>14}'.format('validate', name, elapsed, reference))
+    return 0
+
+
+if '__main__' == __name__:
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+Checks for the incremental trace decoding in internal/support/trace_parser.py.
+
+    python -m unittest discover -s tests
+"""
+import io
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                '..', 'internal', 'support'))
+import trace_parser
+
+
+class IterateTraceEventsTest(unittest.TestCase):
+    """Traces that are a single long line get decoded one event at a time"""
+    def setUp(self):
+        self.limits = (trace_parser.TRACE_LINE_LIMIT, trace_parser.TRACE_READ_SIZE,
+                       trace_parser.TRACE_VALUE_LIMIT)
+        # Small limits so the test traces go through the incremental path
+        trace_parser.TRACE_LINE_LIMIT = 64
+        trace_parser.TRACE_READ_SIZE = 50
+        trace_parser.TRACE_VALUE_LIMIT = 400
+        self.events = [{'name': 'event{0:d}'.format(i), 'ts': i * 123456789,
+                        'args': {'data': 'x,}]{' * (i % 7)}} for i in range(50)]
+
+    def tearDown(self):
+        (trace_parser.TRACE_LINE_LIMIT, trace_parser.TRACE_READ_SIZE,
+         trace_parser.TRACE_VALUE_LIMIT) = self.limits
+
+    def iterate(self, text):
+        return list(trace_parser.Trace().IterateTraceEvents(io.BytesIO(text)))
+
+    def check_layouts(self, trace):
+        for separators in [(', ', ': '), (',', ':')]:
+            text = json.dumps(trace, sort_keys=True, separators=separators)
+            self.assertEqual(self.iterate(text), self.events)
+            self.assertEqual(self.iterate(text + '\n'), self.events)
+
+    def test_trace_events_first(self):
+        self.check_layouts({'traceEvents': self.events})
+
+    def test_trace_events_after_other_keys(self):
+        self.check_layouts({'metadata': {'keys': [1, {'name': 'traceEvents'}]},
+                            'traceEvents': self.events, 'zzz': 2})
+
+    def test_number_split_across_reads(self):
+        self.check_layouts({'a': 123456789012345, 'traceEvents': self.events})
+
+    def test_list(self):
+        self.assertEqual(self.iterate(json.dumps(self.events)), self.events)
+
+    def test_malformed_event(self):
+        text = json.dumps({'metadata': {}, 'traceEvents': self.events})
+        text = text.replace('"event10"', '"event10', 1) + ' ' * 10000
+        # Everything before the bad event is kept and the rest isn't buffered
+        self.assertEqual(self.iterate(text), self.events[:10])
+
+
+if '__main__' == __name__:
+    unittest.main()
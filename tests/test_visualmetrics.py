@@ -0,0 +1,183 @@
+"""
+Checks for the in-process frame analysis in internal/support/visualmetrics.py.
+
+    python -m unittest discover -s tests
+
+Requires numpy and Pillow (the tests are skipped without them).
+"""
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+from distutils.spawn import find_executable
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                '..', 'internal', 'support'))
+import visualmetrics
+
+try:
+    import numpy
+    from PIL import Image
+except ImportError:
+    numpy = None
+
+
+class Options(object):
+    """Stand-in for the parsed visualmetrics command-line options"""
+    viewport = False
+    forceblank = False
+
+
+@unittest.skipIf(numpy is None, 'numpy and Pillow are required')
+class HistogramTest(unittest.TestCase):
+    """The numpy histograms have to match the pixel-by-pixel python ones"""
+    def synthetic_frame(self, mode):
+        """Random frame with white and near-white pixels mixed in"""
+        rand = random.Random(0)
+        width, height = 64, 48
+        channels = len(Image.new(mode, (1, 1)).getbands())
+        data = bytearray()
+        for _ in range(width * height):
+            if rand.random() < 0.25:
+                data.extend([rand.randint(250, 255)] * channels)
+            else:
+                data.extend([rand.randint(0, 255) for _ in range(channels)])
+        return Image.frombytes(mode, (width, height), bytes(data))
+
+    def test_frame_files(self):
+        for mode in ['RGB', 'RGBA', 'L', 'P']:
+            im = self.synthetic_frame(mode)
+            histogram = visualmetrics.calculate_image_histogram_numpy(im)
+            if mode in ['L', 'P']:
+                # Left to the python path
+                self.assertIsNone(histogram)
+            else:
+                self.assertEqual(histogram,
+                                 visualmetrics.calculate_image_histogram_python(im), mode)
+
+    def test_decoded_frames(self):
+        # Frames decoded in-process are always RGB
+        for mode in ['RGB', 'RGBA', 'L', 'P']:
+            im = self.synthetic_frame(mode).convert('RGB')
+            self.assertEqual(visualmetrics.calculate_pixels_histogram(numpy.asarray(im)),
+                             visualmetrics.calculate_image_histogram_python(im), mode)
+
+
+@unittest.skipIf(numpy is None, 'numpy and Pillow are required')
+class PipeFallbackTest(unittest.TestCase):
+    """Frames streamed with --pipe only exist in memory so the ImageMagick fallbacks
+    have to write them out before running convert/compare"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = visualmetrics.FrameStore(self.directory)
+        for frame_time in [0, 100]:
+            self.store.add_pixels(frame_time, numpy.full((300, 400, 3), 255, dtype=numpy.uint8))
+        # References that aren't 200x200 can't be compared in-process
+        self.reference = os.path.join(self.directory, 'reference.png')
+        Image.new('RGB', (100, 100), (255, 255, 255)).save(self.reference, 'PNG')
+        self.commands = []
+        self.original_count = visualmetrics.imagemagick_difference_count
+        self.original_options = visualmetrics.options
+        self.original_viewport = visualmetrics.client_viewport
+        visualmetrics.imagemagick_difference_count = self.difference_count
+        visualmetrics.options = Options()
+        visualmetrics.client_viewport = None
+
+    def tearDown(self):
+        visualmetrics.imagemagick_difference_count = self.original_count
+        visualmetrics.options = self.original_options
+        visualmetrics.client_viewport = self.original_viewport
+        shutil.rmtree(self.directory)
+
+    def difference_count(self, command):
+        """Record the command and check that the frames it references were written"""
+        self.commands.append(command)
+        for file in re.findall(r'"([^"]+\.png)"', command):
+            self.assertTrue(os.path.isfile(file), file)
+        return 0
+
+    def test_frames_match(self):
+        # A crop outside of the frame forces the ImageMagick path
+        self.assertTrue(visualmetrics.frames_match(self.store, 0, 100, 10, 0,
+                                                   '10x10+5000+5000', None))
+        self.assertEqual(len(self.commands), 1)
+
+    def test_is_white_frame(self):
+        self.assertTrue(visualmetrics.is_white_frame(self.store, 0, self.reference))
+        self.assertEqual(len(self.commands), 1)
+
+    def test_is_color_frame(self):
+        self.assertTrue(visualmetrics.is_color_frame(self.store, 0, self.reference))
+        self.assertEqual(len(self.commands), 1)
+
+    def test_save_after_fallback(self):
+        visualmetrics.frames_match(self.store, 0, 100, 10, 0, '10x10+5000+5000', None)
+        self.store.save()
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['ms_000000.png', 'ms_000100.png', 'reference.png'])
+
+
+@unittest.skipIf(numpy is None, 'numpy and Pillow are required')
+class FrameDifferenceTest(unittest.TestCase):
+    """The in-process pixel counts have to match ImageMagick's compare -metric AE -fuzz N%"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def count(self, delta, fuzz_percent):
+        pixels1 = numpy.full((1, 1, 3), 100, dtype=numpy.uint8)
+        pixels2 = pixels1 + numpy.array(delta, dtype=numpy.uint8)
+        return visualmetrics.count_different_pixels(pixels1, pixels2, fuzz_percent)
+
+    def test_color_distance(self):
+        # 10% fuzz is a distance of 25.5 across all of the channels combined
+        self.assertEqual(self.count([20, 20, 20], 10), 1)
+        self.assertEqual(self.count([25, 0, 0], 10), 0)
+        self.assertEqual(self.count([26, 0, 0], 10), 1)
+        self.assertEqual(self.count([14, 14, 14], 10), 0)
+        self.assertEqual(self.count([15, 15, 15], 10), 1)
+        self.assertEqual(self.count([0, 0, 1], 0), 1)
+        self.assertEqual(self.count([0, 0, 0], 0), 0)
+
+    def write_frame_pair(self, index):
+        """Random frame and a copy with deltas scattered around the fuzz thresholds"""
+        rand = random.Random(index)
+        pixels1 = numpy.array([[[rand.randint(30, 225) for _ in range(3)] for _ in range(64)]
+                               for _ in range(48)], dtype=numpy.uint8)
+        deltas = numpy.array([[[rand.choice([0, 0, 5, 10, 13, 14, 20, 26, 30]) *
+                                rand.choice([-1, 1]) for _ in range(3)] for _ in range(64)]
+                              for _ in range(48)], dtype=numpy.int16)
+        pixels2 = (pixels1.astype(numpy.int16) + deltas).astype(numpy.uint8)
+        files = []
+        for name, pixels in [('a', pixels1), ('b', pixels2)]:
+            file = os.path.join(self.directory, '{0}{1:d}.png'.format(name, index))
+            Image.fromarray(pixels).save(file, 'PNG')
+            files.append(file)
+        return files
+
+    @unittest.skipIf(find_executable('compare') is None or find_executable('convert') is None,
+                     'ImageMagick is required')
+    def test_matches_imagemagick(self):
+        for index in range(4):
+            image1, image2 = self.write_frame_pair(index)
+            for fuzz_percent in [0, 5, 10, 15]:
+                for crop in [None, '32x24+8+8']:
+                    crop_option = '-crop {0} '.format(crop) if crop is not None else ''
+                    command = ('convert "{0}" "{1}" {2}miff:- | '
+                               'compare -metric AE - -fuzz {3:d}% null:').format(
+                                   image1, image2, crop_option, fuzz_percent)
+                    expected = visualmetrics.imagemagick_difference_count(command)
+                    self.assertIsNotNone(expected)
+                    count = visualmetrics.frame_difference_count(image1, image2, fuzz_percent,
+                                                                 crop, None)
+                    self.assertEqual(count, expected,
+                                     '{0} {1:d}% {2}'.format(image1, fuzz_percent, crop))
+
+
+if '__main__' == __name__:
+    unittest.main()
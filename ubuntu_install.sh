@@ -1,7 +1,7 @@
 #!/bin/bash
 sudo apt-get install -y python2.7 python-pip imagemagick ffmpeg xvfb dbus-x11 cgroup-tools software-properties-common python-software-properties psmisc
 sudo dbus-uuidgen --ensure
-sudo pip install dnspython monotonic pillow psutil requests ujson xvfbwrapper marionette_driver
+sudo pip install dnspython monotonic numpy pillow psutil requests ujson xvfbwrapper marionette_driver
 curl -sL https://deb.nodesource.com/setup_7.x | sudo bash -
 sudo apt-get install -y nodejs
 sudo npm install -g lighthouse
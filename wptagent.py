@@ -644,6 +644,9 @@ def main():
                         help="Watchdog file to update when successfully connected.")
     parser.add_argument('--log',
                         help="Log critical errors to the given file.")
+    parser.add_argument('--logcompression', type=int, choices=xrange(1, 10), default=7,
+                        help="gzip compression level for the dev tools and trace logs "\
+                        "(defaults to 7).")
 
     # Video capture/display settings
     parser.add_argument('--xvfb', action='store_true', default=False,
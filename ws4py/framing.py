@@ -14,6 +14,16 @@ OPCODE_PONG = 0xa
 
 __all__ = ['Frame']
 
+# XOR translation tables, one per masking key octet (built on demand)
+_xor_tables = {}
+
+def _xor_table(key):
+    table = _xor_tables.get(key)
+    if table is None:
+        table = bytes(bytearray(b ^ key for b in range(256)))
+        _xor_tables[key] = table
+    return table
+
 class Frame(object):
     def __init__(self, opcode=None, body=b'', masking_key=None, fin=0, rsv1=0, rsv2=0, rsv3=0):
         """
@@ -237,14 +247,21 @@ class Frame(object):
             self.masking_key = some_bytes
 
         if len(buf) < self.payload_length:
-            nxt_buf_size = self.payload_length - len(buf)
-            some_bytes = (yield nxt_buf_size)
-            some_bytes = buf + (some_bytes or b'')
-            while len(some_bytes) < self.payload_length:
-                l = self.payload_length - len(some_bytes)
+            # Copy the payload into a buffer allocated up front as it
+            # arrives rather than concatenating (and copying) every chunk
+            some_bytes = bytearray(self.payload_length)
+            view = memoryview(some_bytes)
+            received = len(buf)
+            view[:received] = buf
+            while received < self.payload_length:
+                l = self.payload_length - received
                 b = (yield l)
-                if b is not None:
-                    some_bytes = some_bytes + b
+                if b:
+                    if len(b) > l:
+                        b = b[:l]
+                    view[received:received + len(b)] = b
+                    received += len(b)
+            view = None
         else:
             if self.payload_length == len(buf):
                 some_bytes = buf
@@ -267,7 +284,9 @@ class Frame(object):
         masked = bytearray(data)
         if py3k: key = self.masking_key
         else: key = map(ord, self.masking_key)
-        for i in range(len(data)):
-            masked[i] = masked[i] ^ key[i%4]
+        # Every 4th octet shares a key octet so each of the 4 strided
+        # slices can be transformed in bulk with a translation table
+        for j in range(min(4, len(masked))):
+            masked[j::4] = masked[j::4].translate(_xor_table(key[j]))
         return masked
     unmask = mask
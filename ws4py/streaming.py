@@ -211,7 +211,8 @@ class Stream(object):
                             # when we get each byte one by one.
                             # Our only solution here is to convert our
                             # string to a bytearray.
-                            some_bytes = bytearray(some_bytes)
+                            if not isinstance(some_bytes, bytearray):
+                                some_bytes = bytearray(some_bytes)
 
                     if frame.opcode == OPCODE_TEXT:
                         if self.message and not self.message.completed:
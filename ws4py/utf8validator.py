@@ -29,6 +29,15 @@
 ##
 ###############################################################################
 
+import codecs
+import re
+
+## Chunks at least this large are checked with the C UTF-8 decoder
+BULK_MIN_SIZE = 64
+BULK_CHUNK_SIZE = 65536
+## Encoded surrogates are invalid UTF-8 but accepted by the Python 2 decoder
+SURROGATE_RE = re.compile(b'\xed[\xa0-\xbf]')
+
 
 class Utf8Validator(object):
     """
@@ -102,6 +111,10 @@ class Utf8Validator(object):
         When valid? == True, currentIndex will be len(ba) and totalIndex the
         total amount of consumed bytes.
         """
+        if self.state == Utf8Validator.UTF8_ACCEPT and len(ba) >= BULK_MIN_SIZE:
+            result = self._validate_bulk(ba)
+            if result is not None:
+                return result
         state = self.state
         DFA = Utf8Validator.UTF8VALIDATOR_DFA
         i = 0  # make sure 'i' is set if when 'ba' is empty
@@ -115,3 +128,35 @@ class Utf8Validator(object):
         self.i += i
         self.state = state
         return True, state == Utf8Validator.UTF8_ACCEPT, i, self.i
+
+    def _validate_bulk(self, ba):
+        """
+        Validate a chunk starting on a code point boundary with the C decoder.
+
+        Returns the same quad as validate() when the chunk is valid (possibly
+        ending in an incomplete code point) or None when the byte-wise DFA
+        has to be used to find where the sequence became invalid.
+        """
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        length = len(ba)
+        previous = b''
+        try:
+            for pos in range(0, length, BULK_CHUNK_SIZE):
+                chunk = bytes(ba[pos:pos + BULK_CHUNK_SIZE])
+                if SURROGATE_RE.search(previous + chunk[:1]) or SURROGATE_RE.search(chunk):
+                    return None
+                previous = chunk[-1:]
+                decoder.decode(chunk)
+        except UnicodeDecodeError:
+            return None
+        # Run the incomplete trailing code point (if any) through the DFA
+        state = Utf8Validator.UTF8_ACCEPT
+        DFA = Utf8Validator.UTF8VALIDATOR_DFA
+        for b in bytearray(decoder.getstate()[0]):
+            state = DFA[256 + (state << 4) + DFA[b]]
+            if state == Utf8Validator.UTF8_REJECT:
+                return None
+        i = length - 1
+        self.i += i
+        self.state = state
+        return True, state == Utf8Validator.UTF8_ACCEPT, i, self.i
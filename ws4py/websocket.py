@@ -21,6 +21,11 @@ from ws4py.messaging import Message, PingControlMessage,\
 from ws4py.compat import basestring, unicode
 
 DEFAULT_READING_SIZE = 2
+# Bounds for the buffer that the socket is read into (it adapts to the message sizes)
+MIN_RECEIVE_BUFFER_SIZE = 65536
+MAX_RECEIVE_BUFFER_SIZE = 4194304
+# Reads smaller than this are handed to the parser as bytes instead of a view
+MIN_VIEW_SIZE = 4096
 
 logger = logging.getLogger('ws4py')
 
@@ -141,6 +146,17 @@ class WebSocket(object):
         "Internal buffer to get around SSL problems"
         self.buf = b''
 
+        self.receive_buffer = None
+        """
+        Reusable buffer that the socket is read into.
+        """
+
+        self.receive_view = None
+        self.message_size = 0
+        """
+        Moving average of the received message sizes.
+        """
+
         self._local_address = None
         self._peer_address = None
 
@@ -356,12 +372,41 @@ class WebSocket(object):
         This is a bit of a shame because we have to process
         more data than what wanted initially.
         """
-        data = b""
+        data = []
         pending = self.sock.pending()
         while pending:
-            data += self.sock.recv(pending)
+            data.append(self.sock.recv(pending))
             pending = self.sock.pending()
-        return data
+        return b"".join(data)
+
+    def _resize_receive_buffer(self, size):
+        """
+        Reallocates the receive buffer to hold ``size`` bytes, rounded
+        up to a power of two and kept within the buffer size bounds.
+        """
+        capacity = MIN_RECEIVE_BUFFER_SIZE
+        while capacity < size and capacity < MAX_RECEIVE_BUFFER_SIZE:
+            capacity *= 2
+        if self.receive_buffer is None or len(self.receive_buffer) != capacity:
+            self.receive_buffer = bytearray(capacity)
+            self.receive_view = memoryview(self.receive_buffer)
+
+    def _recv(self):
+        """
+        Reads up to ``self.reading_buffer_size`` bytes into the
+        receive buffer. Small reads (frame headers) are returned as
+        bytes, larger ones as a view into the receive buffer that is
+        only valid until the next read.
+        """
+        if self.receive_buffer is None or \
+                (self.reading_buffer_size > len(self.receive_buffer) and
+                 len(self.receive_buffer) < MAX_RECEIVE_BUFFER_SIZE):
+            self._resize_receive_buffer(self.reading_buffer_size)
+        size = min(self.reading_buffer_size, len(self.receive_buffer))
+        count = self.sock.recv_into(self.receive_view, size)
+        if count < MIN_VIEW_SIZE:
+            return self.receive_view[:count].tobytes()
+        return self.receive_view[:count]
 
     def once(self):
         """
@@ -389,11 +434,16 @@ class WebSocket(object):
         try:
             if self._is_secure:
                 b = self._get_from_pending()
+            elif hasattr(self.sock, 'recv_into'):
+                b = self._recv()
             else:
                 b = self.sock.recv(self.reading_buffer_size)
             if not b:
                 return False
-            self.buf += b
+            if self.buf:
+                self.buf += b.tobytes() if isinstance(b, memoryview) else b
+            else:
+                self.buf = b
         except (socket.error, OSError, pyOpenSSLError) as e:
             if hasattr(e, "errno") and e.errno == errno.EINTR:
                 pass
@@ -474,6 +524,12 @@ class WebSocket(object):
             return False
 
         if s.has_message:
+            # Shrink the receive buffer back down when large messages stop coming
+            self.message_size = (self.message_size * 7 + len(s.message.data)) // 8
+            if self.receive_buffer is not None and \
+                    len(self.receive_buffer) > MIN_RECEIVE_BUFFER_SIZE and \
+                    self.message_size * 4 < len(self.receive_buffer):
+                self._resize_receive_buffer(self.message_size)
             self.received_message(s.message)
             if s.message is not None:
                 s.message.data = None